@@ -0,0 +1,129 @@
+"""
+模拟Ollama /api/generate 接口：可配置延迟与失败率，用于离线压测 HybridRouter.llm_route
+
+    python -m benchmarks.fake_ollama --port 11435 --latency-ms 300 --jitter-ms 100 --failure-rate 0.05
+    CHERRY_OLLAMA_URL=http://127.0.0.1:11435/api/generate python cherry_context_mcp_v2.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 与HybridRouter.module_examples对应的关键词，用于给出看起来合理的分类
+ROUTE_KEYWORDS = {
+    "sql": ("配置", "参数", "限制", "规则", "设置", "多少"),
+    "graph": ("谁", "关系", "合作", "上下游", "汇报", "负责"),
+}
+
+
+class FakeOllama:
+    """在后台线程运行的模拟服务；stats记录请求数、失败数和超时数"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=200.0, jitter_ms=50.0,
+                 failure_rate=0.0, timeout_rate=0.0, timeout_seconds=30.0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate  # 返回HTTP 500
+        self.timeout_rate = timeout_rate  # 挂起timeout_seconds后才响应，触发客户端超时
+        self.timeout_seconds = timeout_seconds
+        self.stats = {'requests': 0, 'failures': 0, 'timeouts': 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/generate"
+
+    @staticmethod
+    def classify(prompt):
+        question = prompt.split("问题:", 1)[-1]
+        for route, keywords in ROUTE_KEYWORDS.items():
+            if any(keyword in question for keyword in keywords):
+                return route
+        return "vdb"
+
+    def _plan(self):
+        """决定本次请求的延迟（秒）和结果：ok / failure / timeout"""
+        with self._lock:
+            self.stats['requests'] += 1
+            roll = self._rng.random()
+            delay = max(0.0, self._rng.gauss(self.latency_ms, self.jitter_ms)) / 1000
+            if roll < self.timeout_rate:
+                self.stats['timeouts'] += 1
+                return self.timeout_seconds, "timeout"
+            if roll < self.timeout_rate + self.failure_rate:
+                self.stats['failures'] += 1
+                return delay, "failure"
+            return delay, "ok"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != "/api/generate":
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+                delay, outcome = fake._plan()
+                time.sleep(delay)
+                if outcome == "failure":
+                    self._reply(500, {"error": "fake ollama failure"})
+                else:
+                    self._reply(200, {"model": body.get("model"), "done": True,
+                                      "response": fake.classify(body.get("prompt", ""))})
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 客户端已超时断开
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟Ollama /api/generate")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--latency-ms', type=float, default=200.0)
+    parser.add_argument('--jitter-ms', type=float, default=50.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakeOllama(args.host, args.port, args.latency_ms, args.jitter_ms,
+                      args.failure_rate, args.timeout_rate).start()
+    print(f"模拟Ollama已启动: {fake.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+合成数据生成器：相同的种子和规模总是生成相同的数据
+"""
+import hashlib
+import random
+import re
+
+import numpy as np
+
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘"
+GIVEN = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉萍红娥玲兰飞鹏辉"
+TOPICS = ["机器学习", "向量检索", "数据库", "接口限流", "缓存策略", "日志分析", "权限管理", "部署运维",
+          "前端性能", "消息队列", "知识图谱", "模型推理", "中文分词", "搜索排序", "监控告警", "容量规划"]
+VERBS = ["优化", "配置", "排查", "设计", "评估", "迁移", "扩容", "实现", "测试", "监控"]
+OBJECTS = ["索引", "查询", "服务", "集群", "接口", "任务", "模型", "存储", "请求", "会话"]
+ENGLISH = ["latency", "throughput", "index", "shard", "cache", "token", "embedding", "rerank",
+           "pipeline", "retry", "timeout", "batch", "replica", "schema", "quota", "worker"]
+COMPONENTS = ["api", "search", "vector", "graph", "memory", "router", "cache", "auth", "gateway", "scheduler"]
+SETTINGS = ["rate_limit", "timeout_ms", "max_batch", "pool_size", "ttl_seconds", "retry_count", "top_k", "shard_size"]
+POSITIONS = ["产品经理", "开发工程师", "测试工程师", "架构师", "运维工程师", "设计师", "数据分析师", "项目经理"]
+DEPARTMENTS = ["产品部", "技术部", "测试部", "运维部", "设计部", "数据部"]
+RELATIONS = ["合作", "汇报", "负责", "参与", "沟通", "指导"]
+
+LANGUAGES = ("zh", "mixed", "en")
+
+
+def _sentence(rng, lang):
+    topic, verb, obj = rng.choice(TOPICS), rng.choice(VERBS), rng.choice(OBJECTS)
+    if lang == "zh":
+        return f"在{topic}场景中需要{verb}{obj}，{rng.choice(TOPICS)}相关的{rng.choice(OBJECTS)}也要同步{rng.choice(VERBS)}。"
+    if lang == "en":
+        words = rng.sample(ENGLISH, 4)
+        return f"The {words[0]} of {rng.choice(COMPONENTS)} {words[1]} depends on {words[2]} and {words[3]}. "
+    return (f"{topic}的{rng.choice(ENGLISH)}指标需要{verb}，"
+            f"参考 {rng.choice(COMPONENTS)}_{rng.choice(SETTINGS)} 与 {rng.choice(ENGLISH)} {obj}。")
+
+
+def documents(n, lang="mixed", seed=0, sentences=(2, 5)):
+    """n篇文档；lang为 zh / mixed / en，mixed下中文、中英混排、英文约为 2:2:1"""
+    rng = random.Random(f"docs-{seed}-{lang}")
+    docs = []
+    for i in range(n):
+        doc_lang = lang if lang != "mixed" else rng.choice(("zh", "zh", "mixed", "mixed", "en"))
+        count = rng.randint(*sentences)
+        docs.append(f"文档{i}：" + "".join(_sentence(rng, doc_lang) for _ in range(count)))
+    return docs
+
+
+def document_metadata(n, seed=0):
+    """与documents对应的元数据（类别、来源、时间戳）"""
+    rng = random.Random(f"meta-{seed}")
+    base = 1_700_000_000
+    return [{'category': rng.choice(TOPICS[:6]), 'source': rng.choice(("wiki", "notes", "chat")),
+             'timestamp': base + rng.randint(0, 365 * 86400)} for _ in range(n)]
+
+
+def queries(n, lang="mixed", seed=1):
+    """检索查询：一部分命中配置键等精确标识符，一部分为自然语言问题"""
+    rng = random.Random(f"queries-{seed}-{lang}")
+    result = []
+    for _ in range(n):
+        kind = rng.random()
+        if kind < 0.3:
+            result.append(f"{rng.choice(COMPONENTS)}_{rng.choice(SETTINGS)}是多少")
+        elif kind < 0.8 or lang == "zh":
+            result.append(f"如何{rng.choice(VERBS)}{rng.choice(TOPICS)}的{rng.choice(OBJECTS)}")
+        else:
+            result.append(f"how to tune {rng.choice(ENGLISH)} for {rng.choice(COMPONENTS)}")
+    return result
+
+
+def configs(n, seed=0):
+    """配置行 (key, value, description, category)，键唯一"""
+    rng = random.Random(f"configs-{seed}")
+    rows = []
+    for i in range(n):
+        component, setting = COMPONENTS[i % len(COMPONENTS)], SETTINGS[(i // len(COMPONENTS)) % len(SETTINGS)]
+        key = f"{component}_{setting}" if i < len(COMPONENTS) * len(SETTINGS) else f"{component}_{setting}_{i}"
+        rows.append((key, str(rng.randint(1, 10000)), f"{rng.choice(TOPICS)}的{setting}参数", component))
+    return rows
+
+
+def rules(n, seed=0):
+    """规则行 (name, condition, action, category)"""
+    rng = random.Random(f"rules-{seed}")
+    return [(f"{rng.choice(TOPICS)}规则{i}", f"{rng.choice(ENGLISH)} > {rng.randint(1, 1000)}",
+             f"{rng.choice(VERBS)}{rng.choice(OBJECTS)}", rng.choice(COMPONENTS)) for i in range(n)]
+
+
+def person_name(i):
+    """第i个人名（姓+名，超出组合数后加编号保证唯一）"""
+    combos = len(SURNAMES) * len(GIVEN)
+    name = SURNAMES[i % len(SURNAMES)] + GIVEN[(i // len(SURNAMES)) % len(GIVEN)]
+    return name if i < combos else f"{name}{i // combos}"
+
+
+def graph(num_nodes, num_edges, seed=0):
+    """图数据（GraphDB的JSON结构）：人员节点 + 随机关系边"""
+    rng = random.Random(f"graph-{seed}")
+    nodes = [{"id": person_name(i), "label": "Person",
+              "properties": {"职位": rng.choice(POSITIONS), "部门": rng.choice(DEPARTMENTS)}}
+             for i in range(num_nodes)]
+    relationships = []
+    for _ in range(num_edges):
+        a, b = rng.randrange(num_nodes), rng.randrange(num_nodes)
+        relationships.append({"from": nodes[a]["id"], "to": nodes[b]["id"],
+                              "type": rng.choice(RELATIONS), "properties": {}})
+    return {"nodes": nodes, "relationships": relationships}
+
+
+def graph_queries(n, num_nodes, seed=1):
+    """图查询：人名 + 关系词"""
+    rng = random.Random(f"graph-queries-{seed}")
+    return [f"谁和{person_name(rng.randrange(num_nodes))}{rng.choice(RELATIONS)}" for _ in range(n)]
+
+
+class HashingEncoder:
+    """确定性的特征哈希编码器：不加载模型，只用于隔离索引本身的开销"""
+
+    def __init__(self, dimension=384):
+        self.dimension = dimension
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in re.findall(r'[a-z0-9_]+|[一-鿿]{1,2}', text.lower()):
+                digest = hashlib.md5(token.encode('utf-8')).digest()
+                column = int.from_bytes(digest[:4], 'little') % self.dimension
+                matrix[row, column] += 1.0 if digest[4] & 1 else -1.0
+        return matrix
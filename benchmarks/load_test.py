@@ -0,0 +1,370 @@
+"""
+MCP服务器并发压测：N个会话各自启动一个服务器进程（与Cherry Studio客户端相同，走真实的stdio协议），
+按目标速率回放问题日志或合成问题，LLM路由指向本地模拟Ollama
+
+    python -m benchmarks.load_test --sessions 8 --rate 4 --requests 400 --output load.json
+    python -m benchmarks.load_test --questions questions.jsonl --speed 2 --ollama-failure-rate 0.05
+    python -m benchmarks.load_test --sessions 4 --rate 0 --duration 60   # 闭环：每个会话收到响应后立即发下一条
+    python -m benchmarks.load_test --url http://127.0.0.1:8765/mcp --sessions 16   # 压测已运行的HTTP服务
+    python -m benchmarks.load_test --url http://127.0.0.1:8765/v1/enhance_prompt --api rest
+
+问题日志为每行一个问题的文本，或JSONL：{"question": ..., "session_id": ..., "offset": 秒}，
+带offset且未指定--rate时按录制的时间间隔回放（--speed 加速）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from . import generators
+from .fake_ollama import FakeOllama
+from .metrics import summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SERVER = os.path.join(ROOT, "cherry_context_mcp_v2.py")
+
+
+def load_questions(path):
+    """读取问题日志 -> [{'question', 'session_id', 'offset'}]"""
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                record = json.loads(line)
+                entries.append({'question': record['question'], 'session_id': record.get('session_id'),
+                                'offset': record.get('offset')})
+            else:
+                entries.append({'question': line, 'session_id': None, 'offset': None})
+    return entries
+
+
+def synthetic_questions(n, lang="mixed", num_nodes=500, seed=1):
+    """文档/配置类问题与图关系类问题按 3:1 混合"""
+    texts = generators.queries(n - n // 4, lang, seed) + generators.graph_queries(n // 4, num_nodes, seed)
+    random.Random(seed).shuffle(texts)
+    return [{'question': text, 'session_id': None, 'offset': None} for text in texts]
+
+
+def schedule(entries, sessions, rate, speed):
+    """为每条问题确定 (会话序号, 计划发送时间)；rate<=0 时为闭环，不设发送时间"""
+    session_index = {}
+    planned = []
+    recorded = rate is None and all(entry['offset'] is not None for entry in entries)
+    for i, entry in enumerate(entries):
+        if entry['session_id'] is not None:
+            session = session_index.setdefault(entry['session_id'], len(session_index) % sessions)
+        else:
+            session = i % sessions
+        if recorded:
+            at = entry['offset'] / speed
+        elif rate and rate > 0:
+            at = i / rate
+        else:
+            at = None
+        planned.append((session, at, entry))
+    return planned
+
+
+def seed_data_dir(data_dir, docs, edges, lang):
+    """在子进程中构造插件并写入合成数据（编码文档需要加载模型，不放在压测进程里）"""
+    code = ("import sys; from types import SimpleNamespace; "
+            "from benchmarks.suites import populate, write_graph; "
+            "from cherry_plugin.plugin import CherryContextPlugin; "
+            "d, docs, edges, lang = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), sys.argv[4]; "
+            "write_graph(d, edges); p = CherryContextPlugin(data_dir=d, prefetch=False); "
+            "populate(p, docs, SimpleNamespace(lang=lang, batch_size=10000)); p.memory.close()")
+    subprocess.run([sys.executable, '-c', code, data_dir, str(docs), str(edges), lang],
+                   cwd=ROOT, stdout=sys.stderr, check=True)
+
+
+class Session:
+    """一个客户端会话：stdio时对应一个服务器进程；指定--url时连接已运行的HTTP服务（MCP或REST）"""
+
+    def __init__(self, index, args, env, errlog):
+        self.index = index
+        self.args = args
+        self.env = env
+        self.errlog = errlog
+        self.session_id = f"load-{index}"
+        self.results = []  # (延迟秒, 错误信息或None)
+        self.startup_seconds = None
+        self.server_stats = None
+
+    async def run(self, items, clock):
+        """clock为各会话共享的 {'t': 开始时间, 'deadline': 截止时间, 'ready': 已就绪会话数}"""
+        launched = time.perf_counter()
+        async with AsyncExitStack() as stack:
+            client = await self._connect(stack)
+            self.startup_seconds = time.perf_counter() - launched
+            # 所有会话完成初始化后同时开始发送
+            clock['ready'] += 1
+            while clock['t'] is None:
+                await asyncio.sleep(0.01)
+
+            pending = []
+            for _, at, entry in items:
+                if at is None:
+                    if time.perf_counter() >= clock['deadline']:
+                        break
+                    await self._call(client, entry)
+                    continue
+                delay = clock['t'] + at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if time.perf_counter() >= clock['deadline']:
+                    break
+                pending.append(asyncio.create_task(self._call(client, entry)))
+            if pending:
+                await asyncio.gather(*pending)
+            if self.index == 0:
+                self.server_stats = await self._stats(client)
+
+    async def _connect(self, stack):
+        """建立连接并完成初始化，返回MCP ClientSession或REST客户端"""
+        headers = {'Authorization': f"Bearer {self.args.token}"} if self.args.token else None
+        if self.args.url and self.args.api == "rest":
+            import httpx
+            # 同一会话复用一个keep-alive连接
+            client = await stack.enter_async_context(httpx.AsyncClient(headers=headers,
+                                                                       timeout=self.args.request_timeout))
+            return RestClient(client, self.args.url)
+
+        from mcp import ClientSession, StdioServerParameters
+        if not self.args.url:
+            from mcp.client.stdio import stdio_client
+            server_args = [self.args.server]
+            if self.args.server_workers:
+                server_args += ['--workers', str(self.args.server_workers)]
+            params = StdioServerParameters(command=sys.executable, args=server_args, env=self.env, cwd=ROOT)
+            streams = await stack.enter_async_context(stdio_client(params, errlog=self.errlog))
+        elif self.args.url.rstrip('/').endswith('/sse'):
+            from mcp.client.sse import sse_client
+            streams = await stack.enter_async_context(sse_client(self.args.url, headers=headers))
+        else:
+            streams = await stack.enter_async_context(_streamable_http(self.args.url, headers,
+                                                                       self.args.request_timeout))
+        session = await stack.enter_async_context(ClientSession(streams[0], streams[1]))
+        await asyncio.wait_for(session.initialize(), self.args.startup_timeout)
+        return session
+
+    async def _stats(self, client):
+        """压测结束后取服务器端的分阶段统计（服务器不支持stats工具时返回None）"""
+        try:
+            if isinstance(client, RestClient):
+                stats = await client.stats()
+            else:
+                result = await asyncio.wait_for(client.call_tool("stats", {"traces": 0}), self.args.request_timeout)
+                stats = json.loads("".join(getattr(block, 'text', '') for block in result.content))
+        except Exception:
+            return None
+        return {key: stats.get(key) for key in ('counters', 'histograms', 'components', 'prefork') if key in stats}
+
+    async def _call(self, client, entry):
+        arguments = {'question': entry['question'], 'session_id': entry['session_id'] or self.session_id}
+        sent = time.perf_counter()
+        error = None
+        try:
+            if isinstance(client, RestClient):
+                error = await asyncio.wait_for(client.enhance(arguments), self.args.request_timeout)
+            else:
+                result = await asyncio.wait_for(client.call_tool("enhance_prompt", arguments),
+                                                self.args.request_timeout)
+                text = "".join(getattr(block, 'text', '') for block in result.content)
+                if result.isError:
+                    error = "tool error"
+                elif text.startswith("处理失败"):
+                    error = text.splitlines()[0][:200]
+        except asyncio.TimeoutError:
+            error = "timeout"
+        except Exception as e:
+            error = _describe(e)
+        self.results.append((time.perf_counter() - sent, error))
+
+
+class RestClient:
+    """REST接口 POST /v1/enhance_prompt 的客户端"""
+
+    def __init__(self, client, url):
+        self.client = client
+        self.url = url
+
+    async def enhance(self, arguments):
+        """返回错误信息，成功时返回None"""
+        response = await self.client.post(self.url, json=arguments)
+        if response.status_code != 200:
+            return f"HTTP {response.status_code}: {response.text[:200]}"
+        return None
+
+    async def stats(self):
+        response = await self.client.get(self.url.rsplit('/v1/', 1)[0] + "/v1/stats", params={'traces': 0})
+        response.raise_for_status()
+        return response.json()
+
+
+def _streamable_http(url, headers, timeout):
+    """streamable HTTP客户端（兼容新旧版本mcp的接口）"""
+    try:
+        import httpx
+        from mcp.client.streamable_http import streamable_http_client
+    except ImportError:
+        from mcp.client.streamable_http import streamablehttp_client
+        return streamablehttp_client(url, headers=headers, timeout=timeout)
+
+    @asynccontextmanager
+    async def connect():
+        async with httpx.AsyncClient(headers=headers, timeout=httpx.Timeout(timeout, read=300)) as client:
+            async with streamable_http_client(url, http_client=client) as streams:
+                yield streams
+    return connect()
+
+
+async def run_load(args, entries, env, errlog):
+    planned = schedule(entries, args.sessions, args.rate, args.speed)
+    sessions = [Session(i, args, env, errlog) for i in range(args.sessions)]
+    clock = {'t': None, 'deadline': float('inf'), 'ready': 0}
+    tasks = [asyncio.create_task(session.run([p for p in planned if p[0] == session.index], clock))
+             for session in sessions]
+
+    # 等待全部会话初始化（有会话启动失败时不再等待）
+    while clock['ready'] < len(sessions) and not any(task.done() for task in tasks):
+        await asyncio.sleep(0.05)
+    began = time.perf_counter()
+    if args.duration:
+        clock['deadline'] = began + args.duration
+    clock['t'] = began
+    outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+    return sessions, outcomes, time.perf_counter() - began
+
+
+def _describe(error):
+    """异常 -> 简短描述（展开TaskGroup的ExceptionGroup）"""
+    while hasattr(error, 'exceptions') and error.exceptions:
+        error = error.exceptions[0]
+    return f"{type(error).__name__}: {error}"[:200]
+
+
+def build_report(args, sessions, outcomes, wall, fake):
+    results = [item for session in sessions for item in session.results]
+    errors = [error for _, error in results if error]
+    error_types = {}
+    for error in errors:
+        error_types[error] = error_types.get(error, 0) + 1
+    latencies = [seconds for seconds, error in results if not error]
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'args': {k: v for k, v in vars(args).items()},
+        },
+        'sessions': len(sessions),
+        'sessions_failed': [_describe(o) for o in outcomes if isinstance(o, BaseException)],
+        'requests': len(results),
+        'errors': len(errors),
+        'error_rate': round(len(errors) / len(results), 4) if results else None,
+        'error_types': dict(sorted(error_types.items(), key=lambda item: -item[1])[:10]),
+        'wall_s': round(wall, 3),
+        'throughput_rps': round(len(results) / wall, 3) if wall > 0 else None,
+        'offered_rps': args.rate if args.rate else None,
+        'latency': summarize(latencies) if latencies else None,
+        'latency_all': summarize([seconds for seconds, _ in results]) if results else None,
+        'startup': summarize([s.startup_seconds for s in sessions if s.startup_seconds is not None])
+        if any(s.startup_seconds is not None for s in sessions) else None,
+        'per_session': {s.session_id: len(s.results) for s in sessions},
+        'ollama': dict(fake.stats) if fake else None,
+        'server_stats': sessions[0].server_stats if sessions else None,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="MCP服务器并发压测")
+    parser.add_argument('--server', default=DEFAULT_SERVER, help="MCP服务器脚本")
+    parser.add_argument('--url', help="压测已运行的HTTP服务（如 http://127.0.0.1:8765/mcp，以/sse结尾时用SSE），"
+                                      "不再启动服务器进程")
+    parser.add_argument('--api', choices=("mcp", "rest"), default="mcp",
+                        help="rest: --url指向 /v1/enhance_prompt，直接POST JSON")
+    parser.add_argument('--token', help="HTTP服务的访问令牌")
+    parser.add_argument('--sessions', type=int, default=4, help="并发会话数（stdio时每个会话一个服务器进程）")
+    parser.add_argument('--server-workers', type=int, default=0, help="每个服务器进程预派生的worker数（--workers）")
+    parser.add_argument('--rate', type=float, help="总目标速率（请求/秒），0为闭环；默认按录制时间或2/秒")
+    parser.add_argument('--speed', type=float, default=1.0, help="按录制时间回放时的加速倍数")
+    parser.add_argument('--requests', type=int, default=200, help="合成问题条数（未指定--questions时）")
+    parser.add_argument('--duration', type=float, default=0, help="最长压测秒数，0为不限")
+    parser.add_argument('--questions', help="问题日志（文本或JSONL）")
+    parser.add_argument('--lang', choices=("zh", "mixed", "en"), default="mixed")
+    parser.add_argument('--data-dir', help="插件数据目录；默认创建临时目录并写入合成数据")
+    parser.add_argument('--seed-docs', type=int, default=1000, help="临时数据目录中的文档数")
+    parser.add_argument('--seed-edges', type=int, default=5000, help="临时数据目录中的图边数")
+    parser.add_argument('--ollama-url', help="使用已有的Ollama（不启动模拟服务）")
+    parser.add_argument('--ollama-latency-ms', type=float, default=300.0)
+    parser.add_argument('--ollama-jitter-ms', type=float, default=100.0)
+    parser.add_argument('--ollama-failure-rate', type=float, default=0.0)
+    parser.add_argument('--ollama-timeout-rate', type=float, default=0.0)
+    parser.add_argument('--request-timeout', type=float, default=120.0)
+    parser.add_argument('--startup-timeout', type=float, default=300.0)
+    parser.add_argument('--server-log', help="服务器stderr输出文件（默认丢弃）")
+    parser.add_argument('--output', help="结果JSON路径（默认打印到标准输出）")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.questions:
+        entries = load_questions(args.questions)
+    else:
+        entries = synthetic_questions(args.requests, args.lang, max(100, args.seed_edges // 10))
+    if args.rate is None and not all(entry['offset'] is not None for entry in entries):
+        args.rate = 2.0
+
+    fake, data_dir, temporary, env = None, args.data_dir, False, None
+    if not args.url:
+        # 连接已运行的HTTP服务时，数据目录和Ollama由该服务自己的配置决定
+        if args.ollama_url:
+            ollama_url = args.ollama_url
+        else:
+            fake = FakeOllama(latency_ms=args.ollama_latency_ms, jitter_ms=args.ollama_jitter_ms,
+                              failure_rate=args.ollama_failure_rate,
+                              timeout_rate=args.ollama_timeout_rate).start()
+            ollama_url = fake.url
+
+        if not data_dir:
+            data_dir, temporary = tempfile.mkdtemp(prefix="cherry_load_"), True
+            print(f"写入合成数据: {data_dir}", file=sys.stderr)
+            seed_data_dir(data_dir, args.seed_docs, args.seed_edges, args.lang)
+        env = dict(os.environ, CHERRY_OLLAMA_URL=ollama_url, CHERRY_DATA_DIR=data_dir)
+
+    errlog = open(args.server_log or os.devnull, 'w', encoding='utf-8')
+    try:
+        print(f"启动 {args.sessions} 个会话，共 {len(entries)} 条问题 ...", file=sys.stderr)
+        sessions, outcomes, wall = asyncio.run(run_load(args, entries, env, errlog))
+    finally:
+        errlog.close()
+        if fake:
+            fake.stop()
+        if temporary:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = build_report(args, sessions, outcomes, wall, fake)
+    latency = report['latency'] or {}
+    print(f"请求 {report['requests']}，错误率 {report['error_rate']}，吞吐 {report['throughput_rps']}/s，"
+          f"p50 {latency.get('p50_ms')}ms p95 {latency.get('p95_ms')}ms p99 {latency.get('p99_ms')}ms",
+          file=sys.stderr)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
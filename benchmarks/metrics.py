@@ -0,0 +1,91 @@
+"""
+度量工具：延迟分位数、吞吐量、峰值内存和分阶段计时
+"""
+import functools
+import sys
+import time
+
+import numpy as np
+
+
+class LatencyRecorder:
+    """按阶段记录耗时（秒）"""
+
+    def __init__(self):
+        self.samples = {}
+
+    def record(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def measure(self, stage, func, *args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.record(stage, time.perf_counter() - started)
+        return result
+
+    def summary(self):
+        return {stage: summarize(values) for stage, values in self.samples.items()}
+
+
+def summarize(seconds):
+    """延迟样本 -> 分位数（毫秒）与吞吐量"""
+    values = np.asarray(seconds, dtype=np.float64) * 1000
+    total = float(values.sum())
+    return {
+        'count': int(len(values)),
+        'mean_ms': round(float(values.mean()), 4),
+        'p50_ms': round(float(np.percentile(values, 50)), 4),
+        'p95_ms': round(float(np.percentile(values, 95)), 4),
+        'p99_ms': round(float(np.percentile(values, 99)), 4),
+        'max_ms': round(float(values.max()), 4),
+        'qps': round(len(values) * 1000 / total, 2) if total > 0 else None,
+    }
+
+
+def run_queries(func, queries, warmup=5):
+    """顺序执行查询并返回延迟摘要（先预热，不计入结果）"""
+    for query in queries[:warmup]:
+        func(query)
+    seconds = []
+    for query in queries:
+        started = time.perf_counter()
+        func(query)
+        seconds.append(time.perf_counter() - started)
+    return summarize(seconds)
+
+
+def timed(func, *args, **kwargs):
+    """执行一次并返回 (结果, 秒)"""
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def instrument(obj, method, recorder, stage=None):
+    """把对象上的方法替换为计时包装（只影响该实例）"""
+    original = getattr(obj, method)
+
+    @functools.wraps(original)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            recorder.record(stage or method, time.perf_counter() - started)
+
+    setattr(obj, method, wrapper)
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB），不支持的平台返回None"""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / 2 ** 20, 1)
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return round(peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10, 1)
@@ -0,0 +1,208 @@
+"""
+基准测试入口
+
+    python -m benchmarks.run --scale small --output bench.json
+    python -m benchmarks.run --suites vector,sql --docs 1000,100000 --encoder hash
+    python -m benchmarks.run --compare base.json bench.json --threshold 0.1
+
+每个 (测试项, 规模) 在独立子进程中运行，峰值内存互不影响；比较模式下出现回退时退出码为1。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 各规模预设：向量文档数、SQL行数、图边数、端到端/启动的文档数
+SCALES = {
+    'small': {'docs': [1000], 'rows': [1000], 'edges': [5000], 'pipeline': [1000]},
+    'medium': {'docs': [1000, 100000], 'rows': [1000, 10000], 'edges': [5000, 100000], 'pipeline': [10000]},
+    'large': {'docs': [1000, 100000, 1000000], 'rows': [1000, 10000, 100000],
+              'edges': [5000, 100000, 1000000], 'pipeline': [100000]},
+}
+# 测试项 -> 使用的规模参数
+SIZE_KEYS = {'vector': 'docs', 'sql': 'rows', 'graph': 'edges', 'cache': 'rows',
+             'startup': 'pipeline', 'pipeline': 'pipeline'}
+
+# 指标后缀 -> 越低越好(True) / 越高越好(False)
+LOWER_IS_BETTER = ('_ms', '_s', '_mb')
+HIGHER_IS_BETTER = ('qps', '_per_s')
+
+
+def _sizes(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Cherry上下文插件基准测试")
+    parser.add_argument('--suites', default="vector,sql,graph,cache,startup,pipeline",
+                        help="逗号分隔：vector,sql,graph,cache,startup,pipeline")
+    parser.add_argument('--scale', choices=sorted(SCALES), default="small")
+    parser.add_argument('--docs', type=_sizes, help="覆盖向量文档规模，如 1000,100000")
+    parser.add_argument('--rows', type=_sizes, help="覆盖配置/规则表行数")
+    parser.add_argument('--edges', type=_sizes, help="覆盖图边数（节点数为边数的1/10）")
+    parser.add_argument('--pipeline-docs', type=_sizes, help="覆盖端到端/启动测试的文档数")
+    parser.add_argument('--queries', type=int, default=200, help="每项检索的查询条数")
+    parser.add_argument('--scan-queries', type=int, default=50, help="全量扫描类检索的查询条数")
+    parser.add_argument('--lang', choices=("zh", "mixed", "en"), default="mixed")
+    parser.add_argument('--encoder', choices=("model", "hash"), default="model",
+                        help="hash: 用特征哈希代替模型编码，只测索引开销（仅vector/graph；startup和pipeline始终加载真实模型）")
+    parser.add_argument('--batch-size', type=int, default=10000, help="批量写入文档数")
+    parser.add_argument('--shard-size', type=int, default=100000, help="每个向量分片的最大文档数")
+    parser.add_argument('--max-link-nodes', type=int, default=20000, help="超过该节点数时跳过实体链接测试")
+    parser.add_argument('--rerank', action='store_true', help="同时测试重排序延迟")
+    parser.add_argument('--output', help="结果JSON路径（默认打印到标准输出）")
+    parser.add_argument('--compare', nargs=2, metavar=("BASE", "NEW"), help="比较两次结果")
+    parser.add_argument('--threshold', type=float, default=0.1, help="比较时视为回退的相对变化")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--child-output', help=argparse.SUPPRESS)
+    return parser
+
+
+def run_child(args):
+    """子进程：运行单个测试项并把结果写到 --child-output"""
+    from .metrics import peak_rss_mb
+    from .suites import SUITES
+
+    workdir = tempfile.mkdtemp(prefix=f"cherry_bench_{args.child}_")
+    try:
+        started = time.perf_counter()
+        result = SUITES[args.child](args.size, args, workdir)
+        result['total_s'] = round(time.perf_counter() - started, 4)
+        result['peak_rss_mb'] = peak_rss_mb()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    with open(args.child_output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+def _child_command(args, suite, size, output):
+    command = [sys.executable, '-m', 'benchmarks.run', '--child', suite, '--size', str(size),
+               '--child-output', output, '--queries', str(args.queries),
+               '--scan-queries', str(args.scan_queries), '--lang', args.lang, '--encoder', args.encoder,
+               '--batch-size', str(args.batch_size), '--shard-size', str(args.shard_size),
+               '--max-link-nodes', str(args.max_link_nodes)]
+    if args.rerank:
+        command.append('--rerank')
+    return command
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_suites(args):
+    scale = SCALES[args.scale]
+    overrides = {'docs': args.docs, 'rows': args.rows, 'edges': args.edges, 'pipeline': args.pipeline_docs}
+    results = {}
+    for suite in [s.strip() for s in args.suites.split(',') if s.strip()]:
+        if suite not in SIZE_KEYS:
+            print(f"未知测试项: {suite}", file=sys.stderr)
+            continue
+        key = SIZE_KEYS[suite]
+        for size in overrides[key] or scale[key]:
+            print(f"运行 {suite} (规模 {size}) ...", file=sys.stderr)
+            fd, output = tempfile.mkstemp(suffix='.json')
+            os.close(fd)
+            try:
+                # 子进程的标准输出重定向到stderr，避免与结果JSON混在一起
+                completed = subprocess.run(_child_command(args, suite, size, output), cwd=ROOT,
+                                           stdout=sys.stderr)
+                if completed.returncode != 0:
+                    results.setdefault(suite, {})[str(size)] = {'error': f"exit code {completed.returncode}"}
+                    continue
+                with open(output, encoding='utf-8') as f:
+                    results.setdefault(suite, {})[str(size)] = json.load(f)
+            finally:
+                os.remove(output)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'git_commit': _git_commit(),
+            'args': {k: v for k, v in vars(args).items() if not k.startswith('child') and k != 'size'},
+        },
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+def flatten(results, prefix=""):
+    """嵌套结果 -> {'vector.1000.search_hybrid.p95_ms': 值}，只保留数值"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def _direction(metric):
+    """1: 越高越好，-1: 越低越好，0: 不参与比较"""
+    leaf = metric.rsplit('.', 1)[-1]
+    if leaf.endswith(HIGHER_IS_BETTER):
+        return 1
+    if leaf.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare(base_path, new_path, threshold):
+    """逐项比较两次结果，返回回退数量"""
+    with open(base_path, encoding='utf-8') as f:
+        base = flatten(json.load(f)['results'])
+    with open(new_path, encoding='utf-8') as f:
+        new = flatten(json.load(f)['results'])
+
+    regressions = 0
+    print(f"{'指标':<60} {'基线':>12} {'当前':>12} {'变化':>9}")
+    for metric in sorted(set(base) & set(new)):
+        direction = _direction(metric)
+        if not direction or not base[metric]:
+            continue
+        change = (new[metric] - base[metric]) / abs(base[metric])
+        regressed = change * direction < -threshold
+        improved = change * direction > threshold
+        regressions += regressed
+        mark = " 回退" if regressed else (" 提升" if improved else "")
+        print(f"{metric:<60} {base[metric]:>12} {new[metric]:>12} {change:>+8.1%}{mark}")
+    for metric in sorted(set(base) ^ set(new)):
+        print(f"{metric:<60} 仅存在于{'基线' if metric in base else '当前'}结果")
+    print(f"共 {regressions} 项回退（阈值 {threshold:.0%}）")
+    return regressions
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.child:
+        run_child(args)
+    elif args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+    else:
+        run_suites(args)
+
+
+if __name__ == "__main__":
+    main()
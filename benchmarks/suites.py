@@ -0,0 +1,212 @@
+"""
+基准测试项：每个函数在独立子进程中针对一个数据规模运行，返回可序列化的结果字典
+"""
+import json
+import os
+import sqlite3
+import time
+
+from . import generators
+from .generators import HashingEncoder
+from .metrics import LatencyRecorder, instrument, run_queries, timed
+
+
+def _encoder(args):
+    """--encoder hash 时使用特征哈希编码器，只测索引本身；model 时加载真实模型"""
+    return HashingEncoder() if args.encoder == "hash" else None
+
+
+def vector_suite(size, args, workdir):
+    """VectorDB：构建吞吐、保存/加载耗时、稠密/混合/过滤/重排序检索延迟"""
+    from cherry_plugin.retriever.vector_db import VectorDB
+
+    db, model_seconds = timed(VectorDB, model=_encoder(args), max_shard_size=args.shard_size)
+    docs = generators.documents(size, args.lang)
+    metadata = generators.document_metadata(size)
+
+    started = time.perf_counter()
+    for start in range(0, size, args.batch_size):
+        db.add_documents(docs[start:start + args.batch_size], metadata[start:start + args.batch_size])
+    build_seconds = time.perf_counter() - started
+
+    path = os.path.join(workdir, "vector_db")
+    _, save_seconds = timed(db.save, path)
+    loaded = VectorDB(model=db.model, max_shard_size=args.shard_size)
+    _, load_seconds = timed(loaded.load, path)
+
+    queries = generators.queries(args.queries, args.lang)
+    results = {
+        'model_load_s': round(model_seconds, 4),
+        'build_s': round(build_seconds, 4),
+        'build_docs_per_s': round(size / build_seconds, 2) if build_seconds > 0 else None,
+        'save_s': round(save_seconds, 4),
+        'load_s': round(load_seconds, 4),
+        'shards': len(db.shards),
+        'search_dense': run_queries(lambda q: db.search(q, k=5, use_rerank=False, hybrid=False), queries),
+        'search_hybrid': run_queries(lambda q: db.search(q, k=5, use_rerank=False, hybrid=True), queries),
+        'search_filtered': run_queries(
+            lambda q: db.search(q, k=5, use_rerank=False, filters={'category': generators.TOPICS[0]}), queries),
+    }
+    if args.rerank:
+        results['search_rerank'] = run_queries(lambda q: db.search(q, k=5, use_rerank=True), queries)
+    return results
+
+
+def sql_suite(size, args, workdir):
+    """SqlDB：关键词模糊检索与词表精确检索的延迟，词表构建耗时"""
+    from cherry_plugin.retriever.sql_db import SqlDB
+    from cherry_plugin.routing.query_analyzer import QueryAnalyzer
+
+    db = SqlDB(os.path.join(workdir, "config.db"))
+    started = time.perf_counter()
+    conn = sqlite3.connect(db.db_path)
+    conn.executemany('INSERT OR REPLACE INTO config (key, value, description, category) VALUES (?, ?, ?, ?)',
+                     generators.configs(size))
+    conn.executemany('INSERT INTO rules (name, condition, action, category) VALUES (?, ?, ?, ?)',
+                     generators.rules(size))
+    conn.commit()
+    conn.close()
+    insert_seconds = time.perf_counter() - started
+
+    analyzer, analyzer_seconds = timed(QueryAnalyzer, db, cache_size=0)
+    queries = generators.queries(args.queries, args.lang)
+    return {
+        'insert_s': round(insert_seconds, 4),
+        'analyzer_build_s': round(analyzer_seconds, 4),
+        'vocabulary': len(analyzer),
+        'analyze': run_queries(analyzer.analyze, queries),
+        'search_keyword': run_queries(lambda q: db.search(q, limit=3), queries),
+        'search_analyzed': run_queries(lambda q: db.search(q, limit=3, analysis=analyzer.analyze(q)), queries),
+    }
+
+
+def graph_suite(size, args, workdir):
+    """GraphDB：加载耗时、关键词扫描、词表匹配、实体链接 + 邻接遍历的延迟"""
+    from cherry_plugin.embedding_cache import EmbeddingCache
+    from cherry_plugin.retriever.entity_linker import EntityLinker
+    from cherry_plugin.retriever.graph_db import GraphDB
+    from cherry_plugin.routing.query_analyzer import QueryAnalyzer
+
+    num_nodes = max(100, size // 10)
+    write_graph(workdir, size)
+    graph_db, load_seconds = timed(GraphDB, os.path.join(workdir, "graph_data.json"))
+    analyzer, analyzer_seconds = timed(QueryAnalyzer, graph_db=graph_db, cache_size=0)
+    queries = generators.graph_queries(args.queries, num_nodes)
+    results = {
+        'nodes': num_nodes,
+        'load_s': round(load_seconds, 4),
+        'analyzer_build_s': round(analyzer_seconds, 4),
+        'search_keyword': run_queries(lambda q: graph_db.search_relationships(q, limit=5), queries[:args.scan_queries]),
+        'search_analyzed': run_queries(
+            lambda q: graph_db.search_relationships(q, limit=5, analysis=analyzer.analyze(q)), queries),
+    }
+
+    if num_nodes <= args.max_link_nodes:
+        model = _encoder(args)
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2", device='cpu')
+        encoder = EmbeddingCache(model)
+        linker = EntityLinker(encoder, encoder.dimension)
+        _, link_build_seconds = timed(linker.add_nodes, graph_db.nodes())
+
+        def link_and_traverse(query):
+            linked = linker.link(encoder.encode_one(query))
+            return graph_db.relationships_from([node_id for node_id, _ in linked], limit=5)
+
+        results['linker_build_s'] = round(link_build_seconds, 4)
+        results['search_linked'] = run_queries(link_and_traverse, queries)
+    else:
+        results['search_linked'] = 'skipped (nodes > --max-link-nodes)'
+    return results
+
+
+def cache_suite(size, args, workdir):
+    """CacheManager：写入、命中读取、未命中读取的延迟"""
+    from cherry_plugin.cache import CacheManager
+
+    cache = CacheManager(os.path.join(workdir, "cache"), data_dir=workdir)
+    keys = [f"问题{i}" for i in range(size)]
+    payload = [{'text': generators.documents(1, seed=i)[0], 'source': 'graph', 'score': None} for i in range(3)]
+    lookups = keys[::max(1, size // args.queries)][:args.queries]
+    return {
+        'set': run_queries(lambda key: cache.set(key, "graph", payload), keys, warmup=0),
+        'get_hit': run_queries(lambda key: cache.get(key, "graph"), lookups),
+        'get_miss': run_queries(lambda key: cache.get(key + "#miss", "graph"), lookups),
+    }
+
+
+def write_graph(workdir, num_edges):
+    """写入合成图数据（需在构造插件之前，GraphDB在构造时加载）"""
+    with open(os.path.join(workdir, "graph_data.json"), 'w', encoding='utf-8') as f:
+        json.dump(generators.graph(max(100, num_edges // 10), num_edges), f, ensure_ascii=False)
+
+
+def populate(plugin, size, args):
+    """向插件写入合成文档、配置和规则"""
+    docs = generators.documents(size, args.lang)
+    for start in range(0, size, args.batch_size):
+        plugin.vector_db.add_documents(docs[start:start + args.batch_size])
+    plugin.vector_db.save(plugin.vector_path)
+    conn = sqlite3.connect(plugin.sql_db.db_path)
+    conn.executemany('INSERT OR REPLACE INTO config (key, value, description, category) VALUES (?, ?, ?, ?)',
+                     generators.configs(min(size, 10000)))
+    conn.executemany('INSERT INTO rules (name, condition, action, category) VALUES (?, ?, ?, ?)',
+                     generators.rules(min(size, 10000)))
+    conn.commit()
+    conn.close()
+
+
+def startup_suite(size, args, workdir):
+    """插件冷启动：导入耗时与构造耗时（子进程内首次导入）。始终加载真实模型，不受--encoder影响"""
+    started = time.perf_counter()
+    from cherry_plugin.plugin import CherryContextPlugin
+    import_seconds = time.perf_counter() - started
+
+    if size:
+        # 先写入数据再测一次完整启动（包括加载索引和图数据）
+        write_graph(workdir, min(size, 100000))
+        first = CherryContextPlugin(data_dir=workdir, prefetch=False)
+        populate(first, size, args)
+        first.memory.close()
+    plugin, init_seconds = timed(CherryContextPlugin, data_dir=workdir, prefetch=False)
+    plugin.memory.close()
+    return {'import_s': round(import_seconds, 4), 'init_s': round(init_seconds, 4),
+            'documents': len(plugin.vector_db)}
+
+
+def pipeline_suite(size, args, workdir):
+    """process_question端到端延迟及各阶段延迟（路由、各检索器、记忆、prompt构建）。
+    始终加载真实模型，不受--encoder影响"""
+    from cherry_plugin.plugin import CherryContextPlugin
+
+    write_graph(workdir, min(size, 100000))
+    plugin = CherryContextPlugin(data_dir=workdir, prefetch=False)
+    populate(plugin, size, args)
+
+    recorder = LatencyRecorder()
+    instrument(plugin.router, "route", recorder, "route")
+    instrument(plugin.query_analyzer, "analyze", recorder, "analyze")
+    instrument(plugin.vector_db, "search", recorder, "vector_search")
+    instrument(plugin.sql_db, "search", recorder, "sql_search")
+    instrument(plugin.graph_db, "search_relationships", recorder, "graph_search")
+    instrument(plugin.memory, "get_relevant_context", recorder, "memory_recall")
+    instrument(plugin.prompt_template, "generate_budgeted_prompt", recorder, "prompt")
+
+    queries = generators.queries(args.queries, args.lang)
+    for query in queries[:5]:
+        plugin.process_question(query)
+    recorder.samples.clear()  # 预热不计入分阶段统计
+    total = run_queries(plugin.process_question, queries, warmup=0)
+    plugin.memory.close()
+    return {'process_question': total, 'stages': recorder.summary()}
+
+
+SUITES = {
+    'vector': vector_suite,
+    'sql': sql_suite,
+    'graph': graph_suite,
+    'cache': cache_suite,
+    'startup': startup_suite,
+    'pipeline': pipeline_suite,
+}
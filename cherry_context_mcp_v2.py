@@ -1,12 +1,20 @@
 #!/usr/bin/env python3
 """
-Cherry Context MCP Server V2 - 强制重新加载
+Cherry Context MCP Server V2 - 进程内共享一个插件实例（模型和索引只加载一次）
+
+    python cherry_context_mcp_v2.py                # 单进程
+    python cherry_context_mcp_v2.py --workers 4    # 预派生4个worker进程，共享只读索引
+    python cherry_context_mcp_v2.py --transport http --port 8765   # 常驻HTTP服务，多个客户端共享
 """
+import argparse
 import asyncio
+import hmac
 import sys
 import json
-import importlib
+import logging
 import os
+import threading
+import time
 
 sys.path.append('/home/feliexw/Documents/Demo/AI/cherry_context_plugin')
 
@@ -17,6 +25,38 @@ import mcp.types as types
 
 server = Server("cherry-context-v2")
 
+_plugin = None
+_plugin_lock = threading.Lock()
+_pool = None  # 预派生多进程模式下的worker池
+_metrics_dumped = 0.0
+
+
+def get_plugin():
+    """懒加载共享的插件实例（CHERRY_DATA_DIR 可指定独立的数据目录，如压测数据）"""
+    global _plugin
+    if _plugin is None:
+        with _plugin_lock:
+            if _plugin is None:
+                from cherry_plugin.plugin import CherryContextPlugin
+                _plugin = CherryContextPlugin(data_dir=os.environ.get("CHERRY_DATA_DIR"))
+    return _plugin
+
+
+def dump_metrics():
+    """设置 CHERRY_METRICS_FILE 时定期把Prometheus文本写到该文件"""
+    global _metrics_dumped
+    path = os.environ.get("CHERRY_METRICS_FILE")
+    interval = float(os.environ.get("CHERRY_METRICS_INTERVAL", "10"))
+    if not path or time.monotonic() - _metrics_dumped < interval:
+        return
+    _metrics_dumped = time.monotonic()
+    from cherry_plugin.telemetry import telemetry
+    try:
+        (_pool.telemetry() if _pool is not None else telemetry).dump_prometheus(path)
+    except (OSError, RuntimeError) as e:
+        print(f"写入指标文件失败: {e}", file=sys.stderr)
+
+
 @server.list_tools()
 async def handle_list_tools() -> list[Tool]:
     return [
@@ -29,15 +69,80 @@ async def handle_list_tools() -> list[Tool]:
                     "question": {
                         "type": "string",
                         "description": "用户的原始问题"
+                    },
+                    "session_id": {
+                        "type": "string",
+                        "description": "会话ID（可选），不同对话的记忆相互隔离"
                     }
                 },
                 "required": ["question"]
             }
+        ),
+        Tool(
+            name="stats",
+            description="服务器运行统计：各阶段延迟分位数、缓存命中、LLM路由回退、重排序跳过等计数器和最近的请求trace",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "format": {
+                        "type": "string",
+                        "enum": ["json", "prometheus"],
+                        "description": "输出格式，默认json"
+                    },
+                    "traces": {
+                        "type": "integer",
+                        "description": "返回最近多少条请求trace（json格式），默认5"
+                    }
+                }
+            }
+        ),
+        Tool(
+            name="diagnostics",
+            description="运行时诊断：各组件内存占用、tracemalloc快照与对比、对接下来N次请求做cProfile",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "action": {
+                        "type": "string",
+                        "enum": ["memory", "tracemalloc_start", "tracemalloc_snapshot", "tracemalloc_diff",
+                                 "tracemalloc_stop", "profile", "profile_status"],
+                        "description": "诊断操作，默认memory"
+                    },
+                    "name": {
+                        "type": "string",
+                        "description": "tracemalloc_snapshot的快照名称（字母、数字、下划线、连字符）"
+                    },
+                    "before": {
+                        "type": "string",
+                        "description": "tracemalloc_diff的基准快照名称"
+                    },
+                    "after": {
+                        "type": "string",
+                        "description": "tracemalloc_diff的对比快照名称"
+                    },
+                    "count": {
+                        "type": "integer",
+                        "description": "profile：采样接下来多少次请求，默认5"
+                    },
+                    "sample_every": {
+                        "type": "integer",
+                        "description": "profile：每隔几次请求采样一次，默认1"
+                    },
+                    "top": {
+                        "type": "integer",
+                        "description": "tracemalloc结果返回的条目数，默认20"
+                    }
+                }
+            }
         )
     ]
 
 @server.call_tool()
 async def handle_call_tool(name: str, arguments: dict | None) -> list[types.TextContent | types.ImageContent | types.EmbeddedResource]:
+    if name == "stats":
+        return await handle_stats(arguments or {})
+    if name == "diagnostics":
+        return await handle_diagnostics(arguments or {})
     if name != "enhance_prompt":
         raise ValueError(f"Unknown tool: {name}")
     
@@ -45,24 +150,10 @@ async def handle_call_tool(name: str, arguments: dict | None) -> list[types.Text
         raise ValueError("Missing required argument: question")
     
     question = arguments["question"]
+    session_id = arguments.get("session_id")
     
     try:
-        # 强制重新导入模块
-        modules_to_reload = [
-            'cherry_plugin.plugin',
-            'cherry_plugin.retriever.graph_db', 
-            'cherry_plugin.retriever.sql_db',
-            'cherry_plugin.retriever.vector_db'
-        ]
-        for module in modules_to_reload:
-            if module in sys.modules:
-                importlib.reload(sys.modules[module])
-            
-        from cherry_plugin.plugin import CherryContextPlugin
-        
-        # 每次都创建新实例
-        plugin = CherryContextPlugin()
-        result = plugin.process_question(question)
+        result = await enhance(question, session_id)
         
         enhanced_prompt = result["final_prompt"]
         info = f"路由: {result['route']} | 检索: {len(result['retrieved'])}条"
@@ -70,7 +161,7 @@ async def handle_call_tool(name: str, arguments: dict | None) -> list[types.Text
         # 如果是图检索，显示具体结果
         debug_info = ""
         if result['route'] == 'graph' and result['retrieved']:
-            debug_info = f"\n检索详情: {result['retrieved']}"
+            debug_info = f"\n检索详情: {[str(item) for item in result['retrieved']]}"
         
         return [
             types.TextContent(
@@ -89,22 +180,261 @@ async def handle_call_tool(name: str, arguments: dict | None) -> list[types.Text
             )
         ]
 
-async def main():
+async def enhance(question, session_id=None):
+    """检索并生成增强prompt（MCP工具和REST接口共用），返回process_question的结果"""
+    if _pool is not None:
+        # 分发到worker进程，同一会话固定在同一个worker
+        result = await asyncio.wrap_future(_pool.submit("process_question", question, session_id,
+                                                        session_id=session_id))
+    else:
+        # 在线程中执行，检索期间事件循环仍可响应其他请求（如stats）
+        plugin = await asyncio.to_thread(get_plugin)
+        result = await asyncio.to_thread(plugin.process_question, question, session_id)
+    await asyncio.to_thread(dump_metrics)
+    return result
+
+
+async def stats_text(fmt="json", traces=5):
+    """stats工具和 /v1/stats、/metrics 接口的输出文本"""
+    from cherry_plugin.telemetry import telemetry
+    
+    if _pool is not None:
+        if fmt == "prometheus":
+            return (await asyncio.to_thread(_pool.telemetry)).prometheus()
+        stats = await asyncio.to_thread(_pool.stats, traces)
+    elif fmt == "prometheus":
+        return telemetry.prometheus()
+    elif _plugin is not None:
+        stats = _plugin.stats(traces)
+    else:
+        stats = telemetry.snapshot(traces)
+    return json.dumps(stats, ensure_ascii=False, indent=2, default=_json_default)
+
+
+def _json_default(value):
+    """numpy标量等 -> JSON可表示的值"""
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+async def handle_stats(arguments: dict) -> list[types.TextContent]:
+    text = await stats_text(arguments.get("format", "json"), int(arguments.get("traces", 5)))
+    return [types.TextContent(type="text", text=text)]
+
+
+async def handle_diagnostics(arguments: dict) -> list[types.TextContent]:
+    action = arguments.get("action", "memory")
+    options = {
+        'name': arguments.get("name"),
+        'before': arguments.get("before"),
+        'after': arguments.get("after"),
+        'count': int(arguments.get("count", 5)),
+        'sample_every': int(arguments.get("sample_every", 1)),
+        'top': int(arguments.get("top", 20)),
+    }
+    
+    try:
+        if _pool is not None:
+            # 多进程模式：在每个worker上执行，结果按worker列出
+            from cherry_plugin.diagnostics import process_memory
+            workers = await asyncio.to_thread(_pool.broadcast, "diagnostics", action, **options)
+            result = {'supervisor': {'process': process_memory()}, 'workers': workers}
+        else:
+            plugin = await asyncio.to_thread(get_plugin)
+            result = await asyncio.to_thread(plugin.diagnostics.run, action, **options)
+    except (KeyError, RuntimeError, OSError, ValueError) as e:
+        result = {'error': f"{type(e).__name__}: {e}"}
+    return [types.TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
+
+
+def protocol_stdout():
+    """把stdout留给协议：复制出协议专用的文件描述符，再把fd 1指向stderr，
+    这样print和原生库的输出都不会混进JSON-RPC消息"""
+    import anyio
+    
+    sys.stdout.flush()
+    protocol_fd = os.dup(sys.stdout.fileno())
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    return anyio.wrap_file(open(protocol_fd, 'w', encoding='utf-8', newline='\n'))
+
+
+class ASGIEndpoint:
+    """把 (scope, receive, send) 处理函数包装成ASGI应用，Starlette的Route不会再按请求-响应函数调用它"""
+    
+    def __init__(self, handler):
+        self.handler = handler
+    
+    async def __call__(self, scope, receive, send):
+        await self.handler(scope, receive, send)
+
+
+def require_token(app, token):
+    """设置了访问令牌时，除 /healthz 外的请求都需要 Authorization: Bearer <token>"""
+    from starlette.responses import JSONResponse
+    
+    expected = f"Bearer {token}".encode('utf-8')
+    
+    async def guarded(scope, receive, send):
+        # 常数时间比较，避免按响应耗时逐字节猜出令牌
+        if scope['type'] == 'http' and scope['path'] != '/healthz' and \
+                not hmac.compare_digest(dict(scope['headers']).get(b'authorization', b''), expected):
+            await JSONResponse({'error': 'unauthorized'}, status_code=401)(scope, receive, send)
+            return
+        await app(scope, receive, send)
+    return guarded
+
+
+def build_http_app(args):
+    """HTTP传输：/mcp（streamable HTTP）、/sse + /messages/（SSE）、REST接口 /v1/enhance_prompt，
+    所有连接共享同一个已预热的插件（或worker池）"""
+    from contextlib import asynccontextmanager
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, PlainTextResponse, Response
+    from starlette.routing import Mount, Route
+    from mcp.server.sse import SseServerTransport
+    from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+    
+    session_manager = StreamableHTTPSessionManager(app=server, json_response=args.json_response)
+    sse = SseServerTransport("/messages/")
+    
+    async def handle_sse(request):
+        async with sse.connect_sse(request.scope, request.receive, request._send) as (read_stream, write_stream):
+            await server.run(read_stream, write_stream, initialization_options())
+        return Response()
+    
+    async def rest_enhance(request):
+        try:
+            body = await request.json()
+        except ValueError:
+            return JSONResponse({'error': "请求体不是合法的JSON"}, status_code=400)
+        question = body.get("question") if isinstance(body, dict) else None
+        if not isinstance(question, str) or not question.strip():
+            return JSONResponse({'error': "缺少参数: question"}, status_code=400)
+        
+        started = time.perf_counter()
+        try:
+            result = await enhance(question, body.get("session_id"))
+        except Exception as e:
+            logging.getLogger("cherry_plugin").warning(f"REST请求处理失败: {e}")
+            return JSONResponse({'error': f"{type(e).__name__}: {e}"}, status_code=500)
+        
+        payload = {
+            'prompt': result['final_prompt'],
+            'route': result['route'],
+            'retrieved': len(result['retrieved']),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+        }
+        if body.get("verbose"):
+            payload['items'] = [item.to_dict() for item in result['retrieved']]
+            payload['compression'] = result['compression']
+        return Response(json.dumps(payload, ensure_ascii=False, default=_json_default),
+                        media_type="application/json")
+    
+    async def rest_stats(request):
+        fmt = request.query_params.get("format", "json")
+        text = await stats_text(fmt, int(request.query_params.get("traces", 5)))
+        if fmt == "prometheus":
+            return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+        return Response(text, media_type="application/json")
+    
+    async def metrics(request):
+        return PlainTextResponse(await stats_text("prometheus"), media_type="text/plain; version=0.0.4")
+    
+    async def health(request):
+        return JSONResponse({'status': "ok" if _plugin is not None else "loading",
+                             'workers': _pool.size if _pool is not None else 0})
+    
+    @asynccontextmanager
+    async def lifespan(app):
+        async with session_manager.run():
+            yield
+    
+    app = Starlette(routes=[
+        Route("/healthz", health),
+        Route("/metrics", metrics),
+        Route("/v1/stats", rest_stats),
+        Route("/v1/enhance_prompt", rest_enhance, methods=["POST"]),
+        Route("/mcp", ASGIEndpoint(session_manager.handle_request)),
+        Route("/sse", handle_sse),
+        Mount("/messages/", app=sse.handle_post_message),
+    ], lifespan=lifespan)
+    token = args.token or os.environ.get("CHERRY_MCP_TOKEN")
+    return require_token(app, token) if token else app
+
+
+async def serve_http(args):
+    import uvicorn
+    
+    config = uvicorn.Config(build_http_app(args), host=args.host, port=args.port,
+                            timeout_keep_alive=args.keep_alive, log_level="warning")
+    logging.getLogger("cherry_plugin").info(
+        f"HTTP服务已启动: http://{args.host}:{args.port}/mcp （SSE: /sse，REST: /v1/enhance_prompt）")
+    await uvicorn.Server(config).serve()
+
+
+def initialization_options():
+    return InitializationOptions(
+        server_name="cherry-context-v2",
+        server_version="2.0.0",
+        capabilities=server.get_capabilities(
+            notification_options=NotificationOptions(),
+            experimental_capabilities={},
+        ),
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Cherry Context MCP Server")
+    parser.add_argument('--transport', choices=("stdio", "http"), default="stdio",
+                        help="stdio：由客户端启动的子进程；http：常驻服务，多个客户端共享（streamable HTTP、SSE和REST）")
+    parser.add_argument('--host', default="127.0.0.1", help="HTTP监听地址（局域网共享时设为0.0.0.0）")
+    parser.add_argument('--port', type=int, default=8765, help="HTTP监听端口")
+    parser.add_argument('--keep-alive', type=int, default=75, help="HTTP keep-alive空闲超时（秒）")
+    parser.add_argument('--json-response', action='store_true', help="streamable HTTP直接返回JSON而不是SSE流")
+    parser.add_argument('--token', help="HTTP访问令牌（也可用环境变量CHERRY_MCP_TOKEN），客户端需带 Authorization: Bearer")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="预派生的worker进程数（0为单进程）；主进程加载模型和索引后fork，worker共享只读内存页")
+    parser.add_argument('--threads-per-worker', type=int, default=1, help="每个worker的FAISS/torch计算线程数")
+    parser.add_argument('--mmap-shards', action='store_true', help="多进程模式下以内存映射方式加载全部向量分片")
+    return parser
+
+
+def start_pool(args):
+    """启动预派生worker池；平台不支持fork时退回单进程"""
+    global _pool
+    from cherry_plugin.prefork import PreforkPool, fork_supported
+    
+    if not fork_supported():
+        logging.getLogger("cherry_plugin").warning("当前平台不支持fork，--workers 被忽略，以单进程模式运行")
+        return
+    _pool = PreforkPool(get_plugin(), args.workers, args.threads_per_worker, args.mmap_shards).start()
+
+
+async def main(args=None):
     from mcp.server.stdio import stdio_server
+    from cherry_plugin.telemetry import configure_logging
     
-    async with stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            InitializationOptions(
-                server_name="cherry-context-v2",
-                server_version="2.0.0",
-                capabilities=server.get_capabilities(
-                    notification_options=NotificationOptions(),
-                    experimental_capabilities={},
-                ),
-            ),
-        )
+    args = args or build_parser().parse_args([])
+    configure_logging()
+    stdout = protocol_stdout() if args.transport == "stdio" else None
+    if args.workers > 0:
+        # fork前完成加载和预热，之后再启动事件循环中的其他线程
+        start_pool(args)
+    else:
+        # 后台预热插件，首个请求不用等待模型和索引加载
+        threading.Thread(target=get_plugin, daemon=True).start()
+    
+    try:
+        if args.transport == "http":
+            await serve_http(args)
+        else:
+            async with stdio_server(stdout=stdout) as (read_stream, write_stream):
+                await server.run(read_stream, write_stream, initialization_options())
+    finally:
+        if _pool is not None:
+            _pool.close()
+        if _plugin is not None:
+            _plugin.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main(build_parser().parse_args()))
@@ -1,19 +1,26 @@
 """
 缓存模块：提升检索性能
 """
+import logging
 import json
 import os
 import hashlib
 from datetime import datetime, timedelta
+from .persistence import atomic_write_json
+from .telemetry import telemetry
+
+logger = logging.getLogger(__name__)
 
 class CacheManager:
-    def __init__(self, cache_dir="cherry_plugin/data/cache", expire_hours=24):
+    def __init__(self, cache_dir="cherry_plugin/data/cache", expire_hours=24, data_dir=None):
         # 如果是相对路径，转换为绝对路径
         if not os.path.isabs(cache_dir):
             base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
             cache_dir = os.path.join(base_dir, cache_dir)
         self.cache_dir = cache_dir
         self.expire_hours = expire_hours
+        # 数据文件所在目录（用于判断缓存后数据是否更新），默认为缓存目录的上一级
+        self.data_dir = data_dir or os.path.dirname(cache_dir)
         os.makedirs(cache_dir, exist_ok=True)
     
     def _get_cache_key(self, query, route_type):
@@ -31,39 +38,50 @@ class CacheManager:
         cache_path = self._get_cache_path(cache_key)
         
         if not os.path.exists(cache_path):
+            telemetry.incr("cache_requests", tier="file", route=route_type, result="miss")
             return None
         
         try:
             with open(cache_path, 'r', encoding='utf-8') as f:
                 cache_data = json.load(f)
             
-            # 检查时间过期
+            # 检查时间过期或数据文件是否更新
             cached_time = datetime.fromisoformat(cache_data['timestamp'])
-            if datetime.now() - cached_time > timedelta(hours=self.expire_hours):
-                os.remove(cache_path)
-                return None
-            
-            # 检查数据文件是否更新
-            if self._is_data_updated(route_type, cached_time):
-                os.remove(cache_path)
+            if (datetime.now() - cached_time > timedelta(hours=self.expire_hours)
+                    or self._is_data_updated(route_type, cached_time)):
+                self._remove(cache_path)
+                telemetry.incr("cache_requests", tier="file", route=route_type, result="expired")
                 return None
             
+            telemetry.incr("cache_requests", tier="file", route=route_type, result="hit")
             return cache_data['result']
         
         except Exception as e:
-            print(f"读取缓存失败: {e}")
+            # 读取失败只视为未命中，不删除文件（可能是其他进程的旧版本格式）
+            logger.warning(f"读取缓存失败: {e}")
+            telemetry.incr("cache_requests", tier="file", route=route_type, result="error")
             return None
     
+    def _remove(self, cache_path):
+        """删除缓存文件（并发删除时忽略文件不存在）"""
+        try:
+            os.remove(cache_path)
+        except FileNotFoundError:
+            pass
+    
     def _is_data_updated(self, route_type, cached_time):
         """检查数据文件是否在缓存后更新"""
         data_files = {
-            'graph': 'cherry_plugin/data/graph_data.json',
-            'sql': 'cherry_plugin/data/config.db', 
-            'vdb': 'cherry_plugin/data/vector_db.index'
+            'graph': 'graph_data.json',
+            'sql': 'config.db', 
+            'vdb': 'vector_db.manifest.json'
         }
         
         data_file = data_files.get(route_type)
-        if not data_file or not os.path.exists(data_file):
+        if not data_file:
+            return False
+        data_file = os.path.join(self.data_dir, data_file)
+        if not os.path.exists(data_file):
             return False
             
         file_mtime = datetime.fromtimestamp(os.path.getmtime(data_file))
@@ -82,10 +100,9 @@ class CacheManager:
         }
         
         try:
-            with open(cache_path, 'w', encoding='utf-8') as f:
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
+            atomic_write_json(cache_path, cache_data, indent=2)
         except Exception as e:
-            print(f"写入缓存失败: {e}")
+            logger.warning(f"写入缓存失败: {e}")
     
     def clear_expired(self):
         """清理过期缓存"""
@@ -102,12 +119,12 @@ class CacheManager:
                     
                     cached_time = datetime.fromisoformat(cache_data['timestamp'])
                     if datetime.now() - cached_time > timedelta(hours=self.expire_hours):
-                        os.remove(filepath)
+                        self._remove(filepath)
                         expired_count += 1
                 
                 except Exception:
-                    # 删除损坏的缓存文件
-                    os.remove(filepath)
+                    # 删除损坏的缓存文件（写入是原子的，解析失败即确实损坏）
+                    self._remove(filepath)
                     expired_count += 1
         
-        print(f"清理了 {expired_count} 个过期缓存文件")
\ No newline at end of file
+        logger.info(f"清理了 {expired_count} 个过期缓存文件")
\ No newline at end of file
@@ -0,0 +1,331 @@
+"""
+诊断模块：按组件估算内存占用、tracemalloc快照与对比、对接下来N次请求做cProfile采样
+"""
+import cProfile
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_MB = 2 ** 20
+
+# 快照名称只允许字母、数字、下划线和连字符（名称直接用作文件名）
+_SNAPSHOT_NAME = re.compile(r'[\w-]+', re.ASCII)
+
+
+def process_memory():
+    """进程常驻内存与峰值（MB）；优先psutil，其次/proc和resource"""
+    result = {}
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        result['rss_mb'] = round(info.rss / _MB, 1)
+    except ImportError:
+        try:
+            with open("/proc/self/status", encoding='utf-8') as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        result['rss_mb'] = round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result['peak_rss_mb'] = round(peak / _MB if sys.platform == "darwin" else peak / 1024, 1)
+    except ImportError:
+        pass
+    return result
+
+
+def deep_size(obj, sample=1000, _seen=None):
+    """对象的近似深层大小（字节）。大容器只遍历前sample个元素再按比例外推；
+    numpy数组按nbytes计（内存映射数组不计入，由映射文件单独统计）"""
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.memmap):
+        return sys.getsizeof(obj)
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (obj.nbytes if obj.base is None else 0)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+
+    if isinstance(obj, dict):
+        items = obj.items()
+        count = len(obj)
+    elif isinstance(obj, (list, tuple, set, frozenset)) or type(obj).__name__ == "deque":
+        items = obj
+        count = len(obj)
+    elif hasattr(obj, '__dict__'):
+        return size + deep_size(vars(obj), sample, seen)
+    else:
+        return size
+
+    measured, visited = 0, 0
+    for item in items:
+        if visited >= sample:
+            break
+        if isinstance(obj, dict):
+            measured += deep_size(item[0], sample, seen) + deep_size(item[1], sample, seen)
+        else:
+            measured += deep_size(item, sample, seen)
+        visited += 1
+    if visited and count > visited:
+        measured = measured * count / visited
+    return int(size + measured)
+
+
+def model_size(model):
+    """模型参数与缓冲区占用（字节）；非torch模型返回None"""
+    parameters = getattr(model, "parameters", None)
+    if parameters is None:
+        inner = getattr(model, "model", None)
+        return model_size(inner) if inner is not None and inner is not model else None
+    try:
+        total = sum(p.numel() * p.element_size() for p in model.parameters())
+        total += sum(b.numel() * b.element_size() for b in model.buffers())
+        return total
+    except Exception:
+        return None
+
+
+def faiss_size(index):
+    """FAISS索引的条目数与估算字节数（编码大小 × 条目数）"""
+    if index is None:
+        return {'ntotal': 0, 'bytes': 0}
+    ntotal = int(index.ntotal)
+    try:
+        code_size = index.sa_code_size()
+    except Exception:
+        code_size = index.d * 4
+    return {'ntotal': ntotal, 'dimension': int(index.d), 'type': type(index).__name__,
+            'bytes': int(code_size * ntotal)}
+
+
+def _mb(value):
+    return round(value / _MB, 2) if value is not None else None
+
+
+def directory_size(path):
+    """目录下文件总大小（字节）"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def memory_report(plugin):
+    """按组件估算内存（MB）；同一模型被多个组件共享时只统计一次。各组件的统计在其自身的锁内采集"""
+    report = {'process': process_memory()}
+    vector_stats = plugin.vector_db.memory_stats()
+    reranker = vector_stats['reranker']
+
+    models, seen_models = {}, set()
+    for name, model in [("router", getattr(plugin.router, "embed_model", None)),
+                        ("vector_db", plugin.vector_db.model)]:
+        if model is None:
+            continue
+        if id(model) in seen_models:
+            models[name] = "shared"
+            continue
+        seen_models.add(id(model))
+        models[name] = {'type': type(model).__name__, 'mb': _mb(model_size(model))}
+    if reranker is not None and 'model' in reranker:
+        models['reranker'] = {'type': reranker['model']['type'], 'mb': _mb(reranker['model']['bytes'])}
+    report['models'] = models
+
+    report['vector_shards'] = [{
+        'name': shard['name'],
+        'cold': shard['cold'],
+        'index': dict(shard['index'], mb=_mb(shard['index']['bytes'])),
+        'documents_mb': _mb(shard['documents_bytes']),
+        'bm25_mb': _mb(shard['bm25_bytes']),
+        'metadata_mb': _mb(shard['metadata_bytes']),
+    } for shard in vector_stats['shards']]
+    report['embedding_stores'] = {
+        key: {'rows': store['rows'], 'dtype': store['dtype'], 'mapped_mb': _mb(store['mapped_bytes'])}
+        for key, store in vector_stats['embedding_stores'].items()
+    }
+
+    graph = plugin.graph_db.memory_stats()
+    report['graph'] = {
+        'nodes': graph['nodes'],
+        'relationships': graph['relationships'],
+        'graph_data_mb': _mb(graph['graph_data_bytes']),
+        'indexes_mb': _mb(graph['indexes_bytes']),
+    }
+
+    embedding_cache = plugin.encoder.memory_stats()
+    query_analyzer = plugin.query_analyzer.memory_stats()
+    entity_linker = plugin.entity_linker.memory_stats()
+    caches = {
+        'embedding_cache': {'entries': embedding_cache['entries'], 'mb': _mb(embedding_cache['bytes'])},
+        'file_cache': {'disk_mb': _mb(directory_size(plugin.cache.cache_dir))},
+        'query_analyzer': {'terms': query_analyzer['terms'], 'mb': _mb(query_analyzer['bytes'])},
+        'entity_linker': dict(entity_linker, mb=_mb(entity_linker['bytes'])),
+    }
+    if reranker is not None:
+        caches['rerank_scores'] = {'entries': reranker['score_cache_entries'],
+                                   'mb': _mb(reranker['score_cache_bytes'])}
+    memory_index = plugin.memory.memory_index
+    if memory_index is not None:
+        stats = memory_index.memory_stats()
+        caches['memory_index'] = {'sessions_loaded': stats['sessions_loaded'],
+                                  'sessions_dirty': stats['sessions_dirty'], 'mb': _mb(stats['bytes'])}
+    if plugin.unified_index is not None:
+        stats = plugin.unified_index.memory_stats()
+        caches['unified_index'] = dict(stats, mb=_mb(stats['bytes'] + stats['entries_bytes']))
+    report['caches'] = caches
+    return report
+
+
+class TracemallocRecorder:
+    """tracemalloc快照：保存到文件，按名称对比两次快照的分配差异"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.snapshots = {}  # 名称 -> 文件路径
+
+    def start(self, frames=25):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        return self.status()
+
+    def stop(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        return self.status()
+
+    def status(self):
+        status = {'tracing': tracemalloc.is_tracing(), 'snapshots': dict(self.snapshots)}
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            status.update(traced_mb=_mb(current), traced_peak_mb=_mb(peak))
+        return status
+
+    def snapshot(self, name=None, top=20):
+        """拍摄快照并保存（需先start），返回分配最多的代码位置"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc未启动")
+        name = name or time.strftime("snapshot_%Y%m%d_%H%M%S")
+        if not _SNAPSHOT_NAME.fullmatch(name):
+            raise ValueError(f"快照名称只能包含字母、数字、下划线和连字符: {name!r}")
+        snapshot = tracemalloc.take_snapshot()
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"{name}.tracemalloc")
+        snapshot.dump(path)
+        self.snapshots[name] = path
+        stats = snapshot.statistics('lineno')[:top]
+        return {'name': name, 'path': path, 'top': [str(stat) for stat in stats]}
+
+    def diff(self, before, after, top=20):
+        """对比两个本进程保存过的快照（after相对before的分配增长）。
+        只按名称加载已登记的快照文件：Snapshot.load基于pickle，不能加载任意路径"""
+        for name in (before, after):
+            if name not in self.snapshots:
+                raise ValueError(f"未知的快照: {name!r}（可用: {sorted(self.snapshots)}）")
+        old = tracemalloc.Snapshot.load(self.snapshots[before])
+        new = tracemalloc.Snapshot.load(self.snapshots[after])
+        stats = new.compare_to(old, 'lineno')[:top]
+        return {'before': before, 'after': after, 'top': [str(stat) for stat in stats]}
+
+
+class RequestProfiler:
+    """对接下来N次请求做cProfile（每sample_every次取一次），每次写一个.prof文件，
+    可用 python -m pstats / snakeviz 等工具加载"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.remaining = 0
+        self.sample_every = 1
+        self.files = []
+        self._seen = 0
+        self._lock = threading.Lock()
+        self._busy = False  # cProfile同一时刻只能有一个活动的profiler
+
+    def arm(self, count, sample_every=1):
+        with self._lock:
+            self.remaining = count
+            self.sample_every = max(1, sample_every)
+            self._seen = 0
+            self.files = []
+        return self.status()
+
+    def status(self):
+        with self._lock:
+            return {'remaining': self.remaining, 'sample_every': self.sample_every, 'files': list(self.files)}
+
+    def call(self, name, func, *args, **kwargs):
+        """执行func；被采样时在cProfile下执行并保存结果"""
+        with self._lock:
+            sampled = self.remaining > 0 and not self._busy and self._seen % self.sample_every == 0
+            if self.remaining > 0:
+                self._seen += 1
+            if sampled:
+                self._busy = True
+                self.remaining -= 1
+        if not sampled:
+            return func(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+                                                 f"_{len(self.files)}.prof")
+            try:
+                profiler.dump_stats(path)
+            except OSError as e:
+                logger.warning(f"保存profile失败: {e}")
+                path = None
+            with self._lock:
+                self._busy = False
+                if path:
+                    self.files.append(path)
+
+
+class Diagnostics:
+    """插件的诊断入口：内存报告、tracemalloc、请求profile，输出文件写到output_dir"""
+
+    def __init__(self, plugin, output_dir):
+        self.plugin = plugin
+        self.output_dir = output_dir
+        self.tracemalloc = TracemallocRecorder(os.path.join(output_dir, "tracemalloc"))
+        self.profiler = RequestProfiler(os.path.join(output_dir, "profiles"))
+
+    def memory(self):
+        return memory_report(self.plugin)
+
+    def run(self, action="memory", name=None, before=None, after=None, count=5, sample_every=1, top=20):
+        """按名称执行诊断操作（MCP工具和预派生worker共用）"""
+        if action == "memory":
+            return self.memory()
+        if action == "tracemalloc_start":
+            return self.tracemalloc.start()
+        if action == "tracemalloc_snapshot":
+            return self.tracemalloc.snapshot(name, top)
+        if action == "tracemalloc_diff":
+            if not before or not after:
+                raise ValueError("tracemalloc_diff需要before和after")
+            return self.tracemalloc.diff(before, after, top)
+        if action == "tracemalloc_stop":
+            return self.tracemalloc.stop()
+        if action == "profile":
+            return self.profiler.arm(count, sample_every)
+        if action == "profile_status":
+            return self.profiler.status()
+        raise ValueError(f"Unknown diagnostics action: {action}")
@@ -0,0 +1,87 @@
+"""
+向量缓存模块：共享编码器并缓存文本向量
+"""
+import threading
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+
+from .diagnostics import deep_size
+from .telemetry import telemetry
+
+class EmbeddingCache:
+    def __init__(self, model, cache_size=4096):
+        self.model = model
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def reset(self, model=None):
+        """清空缓存；传入model时同时切换编码模型（旧模型的向量不能与新模型混用）"""
+        with self._lock:
+            if model is not None:
+                self.model = model
+            self._cache.clear()
+
+    def get_stats(self) -> dict:
+        """命中/未命中次数与命中率"""
+        with self._lock:
+            stats = dict(self.stats, size=len(self._cache))
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / total if total else 0.0
+        return stats
+
+    def memory_stats(self) -> dict:
+        """缓存条目数与估算内存（字节）"""
+        with self._lock:
+            return {'entries': len(self._cache), 'bytes': deep_size(self._cache)}
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """批量编码文本，返回L2归一化的float32矩阵（未命中的文本一次性编码）"""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype='float32')
+
+        vectors = [None] * len(texts)
+        missing = {}
+        with self._lock:
+            for i, text in enumerate(texts):
+                cached = self._cache.get(text)
+                if cached is not None:
+                    self._cache.move_to_end(text)
+                    vectors[i] = cached
+                else:
+                    missing.setdefault(text, []).append(i)
+            hits = len(texts) - sum(len(indices) for indices in missing.values())
+            self.stats['hits'] += hits
+            self.stats['misses'] += len(texts) - hits
+        telemetry.incr("embedding_cache", hits, result="hit")
+        telemetry.incr("embedding_cache", len(texts) - hits, result="miss")
+
+        if missing:
+            new_texts = list(missing.keys())
+            with telemetry.span("encode", texts=len(new_texts)):
+                embeddings = np.asarray(self.model.encode(new_texts), dtype='float32')
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.maximum(norms, 1e-12)
+
+            with self._lock:
+                for text, embedding in zip(new_texts, embeddings):
+                    for i in missing[text]:
+                        vectors[i] = embedding
+                    self._cache[text] = embedding
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return np.vstack(vectors)
+
+    def encode_one(self, text: str) -> np.ndarray:
+        """编码单个文本"""
+        return self.encode([text])[0]
+
+    @property
+    def dimension(self) -> int:
+        """向量维度"""
+        getter = getattr(self.model, "get_sentence_embedding_dimension", None)
+        return getter() if getter else 384
@@ -0,0 +1,154 @@
+"""
+记忆向量索引模块：按会话的FAISS索引，用于按相关性召回历史对话
+"""
+import logging
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+from ..diagnostics import faiss_size
+from ..persistence import atomic_write_index, read_locked, write_locked
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryIndex:
+    """每个会话一个 IndexIDMap2(IndexFlatIP)，向量ID即对话轮次ID
+
+    新增的向量先只写内存并标记会话为脏，save_interval秒内最多落盘一次（换出会话和关闭时也会落盘），
+    避免每轮对话都重写整个会话索引文件
+    """
+
+    def __init__(self, index_dir, dimension=384, max_loaded_sessions=64, save_interval=30.0):
+        self.index_dir = index_dir
+        self.dimension = dimension
+        self.max_loaded_sessions = max_loaded_sessions
+        self.save_interval = save_interval
+        self._last_save = time.monotonic()
+        os.makedirs(index_dir, exist_ok=True)
+
+        self._indexes = OrderedDict()  # session_id -> index
+        self._max_ids = {}  # session_id -> 已索引的最大轮次ID
+        self._dirty = set()
+        self._lock = threading.RLock()
+
+    def _index_path(self, session_id):
+        digest = hashlib.md5(session_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.index_dir, f"{digest}.index")
+
+    def _get_index(self, session_id, create=True):
+        """获取会话索引（按需从磁盘加载，超出上限时换出最久未用的会话）"""
+        index = self._indexes.get(session_id)
+        if index is not None:
+            self._indexes.move_to_end(session_id)
+            return index
+
+        path = self._index_path(session_id)
+        if os.path.exists(path):
+            try:
+                with read_locked(path):
+                    index = faiss.read_index(path)
+            except Exception as e:
+                logger.warning(f"加载记忆索引失败: {e}")
+        if index is None:
+            if not create:
+                return None
+            index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))
+
+        self._indexes[session_id] = index
+        while len(self._indexes) > self.max_loaded_sessions:
+            evicted, evicted_index = self._indexes.popitem(last=False)
+            if evicted in self._dirty:
+                self._write(evicted, evicted_index)
+        return index
+
+    def memory_stats(self):
+        """已加载的会话索引数、未落盘的会话数和索引总大小（字节）"""
+        with self._lock:
+            return {'sessions_loaded': len(self._indexes), 'sessions_dirty': len(self._dirty),
+                    'bytes': sum(faiss_size(index)['bytes'] for index in self._indexes.values())}
+
+    def max_indexed_id(self, session_id):
+        """会话已索引的最大轮次ID（增量索引检查点）"""
+        with self._lock:
+            if session_id not in self._max_ids:
+                index = self._get_index(session_id, create=False)
+                if index is None or index.ntotal == 0:
+                    return 0
+                self._max_ids[session_id] = int(faiss.vector_to_array(index.id_map).max())
+            return self._max_ids[session_id]
+
+    def add(self, session_id, turn_ids, embeddings):
+        """添加对话轮次向量（已归一化）"""
+        if len(turn_ids) == 0:
+            return
+        with self._lock:
+            index = self._get_index(session_id)
+            index.add_with_ids(np.ascontiguousarray(embeddings, dtype='float32'),
+                               np.asarray(turn_ids, dtype='int64'))
+            self._dirty.add(session_id)
+            self._max_ids[session_id] = max(self._max_ids.get(session_id, 0), int(np.max(turn_ids)))
+
+    def search(self, session_id, query_embedding, k):
+        """返回 [(turn_id, 相似度)]"""
+        with self._lock:
+            index = self._get_index(session_id, create=False)
+            if index is None or index.ntotal == 0:
+                return []
+            k = min(k, index.ntotal)
+            query = np.ascontiguousarray(query_embedding, dtype='float32').reshape(1, -1)
+            scores, ids = index.search(query, k)
+        return [(int(i), float(s)) for s, i in zip(scores[0], ids[0]) if i >= 0]
+
+    def remove_session(self, session_id):
+        """删除会话索引"""
+        with self._lock:
+            self._indexes.pop(session_id, None)
+            self._max_ids.pop(session_id, None)
+            self._dirty.discard(session_id)
+            path = self._index_path(session_id)
+            with write_locked(path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def reset(self, dimension):
+        """删除全部会话索引并切换维度（编码模型切换后调用，之后需重新索引各会话）"""
+        with self._lock:
+            self.dimension = dimension
+            self._indexes.clear()
+            self._max_ids.clear()
+            self._dirty.clear()
+            for name in os.listdir(self.index_dir):
+                if name.endswith(".index"):
+                    path = os.path.join(self.index_dir, name)
+                    with write_locked(path):
+                        os.remove(path)
+
+    def _write(self, session_id, index):
+        try:
+            path = self._index_path(session_id)
+            with write_locked(path):
+                atomic_write_index(index, path)
+            self._dirty.discard(session_id)
+        except Exception as e:
+            logger.warning(f"保存记忆索引失败: {e}")
+
+    def save(self):
+        """保存所有有改动的会话索引"""
+        with self._lock:
+            for session_id in list(self._dirty):
+                index = self._indexes.get(session_id)
+                if index is not None:
+                    self._write(session_id, index)
+            self._last_save = time.monotonic()
+
+    def maybe_save(self):
+        """距上次保存超过save_interval时保存有改动的会话索引"""
+        with self._lock:
+            if self._dirty and time.monotonic() - self._last_save >= self.save_interval:
+                self.save()
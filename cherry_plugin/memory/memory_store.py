@@ -1,132 +1,393 @@
 """
-记忆存储模块：短期记忆和长期摘要
+记忆存储模块：短期记忆和长期摘要（SQLite存储，按会话隔离）
 """
+import logging
 import json
 import os
-from datetime import datetime, timedelta
-from collections import deque
+import sqlite3
+import threading
+from datetime import datetime
+
+from .summary_worker import SummaryWorker
+from .memory_index import MemoryIndex
+from ..optimization.token_budget import get_token_counter
+from ..retrieved_item import extract_keywords
+
+logger = logging.getLogger(__name__)
+
+# 含虚词/代词的中文二元组不作为话题词
+_STOP_CHARS = frozenset("的了是在和与及或我你他她它们这那个些吗呢吧啊么什怎一下有没也都就")
 
 class MemoryStore:
-    def __init__(self, data_dir="cherry_plugin/data"):
+    def __init__(self, data_dir="cherry_plugin/data", default_session="default",
+                 background=True, summary_max_tokens=120, topic_decay=0.9, max_topics=200,
+                 encoder=None, recall_half_life_hours=72):
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
-        
+
+        self.db_path = os.path.join(data_dir, "memory.db")
+        # 旧版单会话JSON文件，首次启动时迁移到默认会话
         self.short_term_file = os.path.join(data_dir, "short_term_memory.json")
         self.long_term_file = os.path.join(data_dir, "long_term_summary.json")
-        
+
         # 短期记忆设置
-        self.max_short_term = 10  # 最多保存10轮对话
-        self.short_term_memory = deque(maxlen=self.max_short_term)
-        
-        # 长期摘要
-        self.long_term_summary = ""
-        
+        self.max_short_term = 10  # 每次增量摘要最少处理的新对话轮数
+        self.default_session = default_session
+
+        # 长期摘要设置：话题计数按轮次衰减，摘要长度受token预算约束
+        self.summary_max_tokens = summary_max_tokens
+        self.topic_decay = topic_decay
+        self.max_topics = max_topics
+        self.counter = get_token_counter()
+
+        # 向量化记忆：与VectorDB共用编码器，按相关性和时间衰减召回历史对话
+        self.encoder = encoder
+        self.recall_half_life_hours = recall_half_life_hours
+        self.memory_index = None
+        if encoder is not None:
+            self.memory_index = MemoryIndex(os.path.join(data_dir, "memory_index"), encoder.dimension)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.init_db()
         self.load_memory()
-    
-    def add_conversation(self, user_input, assistant_response):
-        """添加对话到短期记忆"""
-        conversation = {
-            "timestamp": datetime.now().isoformat(),
-            "user": user_input,
-            "assistant": assistant_response
-        }
-        
-        self.short_term_memory.append(conversation)
-        self.save_short_term()
-        
-        # 如果短期记忆满了，更新长期摘要
-        if len(self.short_term_memory) >= self.max_short_term:
-            self.update_long_term_summary()
-    
-    def get_short_term_context(self, max_turns=5):
-        """获取短期对话上下文"""
-        recent_conversations = list(self.short_term_memory)[-max_turns:]
-        
+
+        self.summary_worker = SummaryWorker(self._background_update) if background else None
+
+    def init_db(self):
+        """初始化数据库"""
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+
+            # 对话轮次表：追加写入，按 (session_id, id) 索引读取最近N轮
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS turns (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    user_input TEXT NOT NULL,
+                    assistant_response TEXT NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_turns_session ON turns (session_id, id)
+            ''')
+
+            # 长期摘要表：last_turn_id为已摘要的检查点，topic_counts为衰减后的话题计数
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS summaries (
+                    session_id TEXT PRIMARY KEY,
+                    summary TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    last_turn_id INTEGER NOT NULL DEFAULT 0,
+                    topic_counts TEXT NOT NULL DEFAULT '{}'
+                )
+            ''')
+            columns = {row[1] for row in cursor.execute("PRAGMA table_info(summaries)")}
+            if 'last_turn_id' not in columns:
+                cursor.execute("ALTER TABLE summaries ADD COLUMN last_turn_id INTEGER NOT NULL DEFAULT 0")
+            if 'topic_counts' not in columns:
+                cursor.execute("ALTER TABLE summaries ADD COLUMN topic_counts TEXT NOT NULL DEFAULT '{}'")
+            self._conn.commit()
+
+    def _session(self, session_id):
+        return session_id or self.default_session
+
+    def add_conversation(self, user_input, assistant_response, session_id=None):
+        """添加对话到短期记忆（单条追加写入，摘要在后台增量更新）"""
+        session_id = self._session(session_id)
+        with self._lock:
+            self._conn.execute('''
+                INSERT INTO turns (session_id, timestamp, user_input, assistant_response)
+                VALUES (?, ?, ?, ?)
+            ''', (session_id, datetime.now().isoformat(), user_input, assistant_response))
+            self._conn.commit()
+
+        # 每轮都需要建立向量索引；否则本会话每积累max_short_term轮新对话更新一次长期摘要
+        if self.memory_index is None and not self._summary_due(session_id):
+            return
+        if self.summary_worker is not None:
+            self.summary_worker.schedule(session_id)
+        else:
+            self._background_update(session_id)
+
+    def _summary_due(self, session_id):
+        """检查点之后本会话是否已积累足够的新对话（轮次ID全局自增，须按会话计数）"""
+        last_turn_id = self._load_checkpoint(session_id)[0]
+        with self._lock:
+            new_turns = self._conn.execute(
+                "SELECT COUNT(*) FROM turns WHERE session_id = ? AND id > ?", (session_id, last_turn_id)
+            ).fetchone()[0]
+        return new_turns >= self.max_short_term
+
+    def _background_update(self, session_id):
+        """后台任务：增量索引新对话，按需更新长期摘要"""
+        if self.memory_index is not None:
+            self.index_new_turns(session_id)
+        if self._summary_due(session_id):
+            self.update_long_term_summary(session_id)
+
+    def index_new_turns(self, session_id=None, batch_size=256):
+        """将检查点之后的新对话编码并加入会话向量索引"""
+        session_id = self._session(session_id)
+        last_id = self.memory_index.max_indexed_id(session_id)
+        while True:
+            with self._lock:
+                rows = self._conn.execute('''
+                    SELECT id, user_input, assistant_response FROM turns
+                    WHERE session_id = ? AND id > ?
+                    ORDER BY id
+                    LIMIT ?
+                ''', (session_id, last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            embeddings = self.encoder.encode([f"用户: {row[1]}\n助手: {row[2]}" for row in rows])
+            self.memory_index.add(session_id, [row[0] for row in rows], embeddings)
+            last_id = rows[-1][0]
+        self.memory_index.maybe_save()
+
+    def reindex(self):
+        """编码模型切换后按新模型重建全部会话的向量索引（有后台线程时在后台进行）"""
+        if self.memory_index is None:
+            return
+        self.memory_index.reset(self.encoder.dimension)
+        for session_id in self.list_sessions():
+            if self.summary_worker is not None:
+                self.summary_worker.schedule(session_id)
+            else:
+                self.index_new_turns(session_id)
+
+    def get_recent_turns(self, max_turns=5, session_id=None):
+        """获取会话最近N轮对话（按时间正序）"""
+        with self._lock:
+            rows = self._conn.execute('''
+                SELECT id, timestamp, user_input, assistant_response FROM turns
+                WHERE session_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+            ''', (self._session(session_id), max_turns)).fetchall()
+
+        return [
+            {"id": row[0], "timestamp": row[1], "user": row[2], "assistant": row[3]}
+            for row in reversed(rows)
+        ]
+
+    def get_turns_by_ids(self, turn_ids, session_id=None):
+        """按轮次ID获取对话（按时间正序）"""
+        if not turn_ids:
+            return []
+        placeholders = ",".join("?" * len(turn_ids))
+        with self._lock:
+            rows = self._conn.execute(f'''
+                SELECT id, timestamp, user_input, assistant_response FROM turns
+                WHERE session_id = ? AND id IN ({placeholders})
+                ORDER BY id
+            ''', (self._session(session_id), *turn_ids)).fetchall()
+        return [
+            {"id": row[0], "timestamp": row[1], "user": row[2], "assistant": row[3]}
+            for row in rows
+        ]
+
+    def format_turns(self, conversations):
+        """将对话格式化为上下文文本"""
         context = []
-        for conv in recent_conversations:
+        for conv in conversations:
             context.append(f"用户: {conv['user']}")
             context.append(f"助手: {conv['assistant']}")
-        
+
         return "\n".join(context)
-    
-    def update_long_term_summary(self):
-        """更新长期摘要（简化版本）"""
-        if not self.short_term_memory:
-            return
-        
-        # 提取关键主题（简化实现）
+
+    def get_short_term_context(self, max_turns=5, session_id=None):
+        """获取短期对话上下文"""
+        return self.format_turns(self.get_recent_turns(max_turns, session_id))
+
+    def recall_relevant(self, query_embedding, k=3, session_id=None, exclude_ids=()):
+        """按与问题的相关性召回历史对话（相似度乘以时间衰减因子）"""
+        if self.memory_index is None:
+            return []
+        session_id = self._session(session_id)
+        hits = [(turn_id, score) for turn_id, score
+                in self.memory_index.search(session_id, query_embedding, k * 4)
+                if turn_id not in exclude_ids]
+        if not hits:
+            return []
+
+        turns = {t["id"]: t for t in self.get_turns_by_ids([turn_id for turn_id, _ in hits], session_id)}
+        now = datetime.now()
+        scored = []
+        for turn_id, similarity in hits:
+            turn = turns.get(turn_id)
+            if turn is None:
+                continue
+            age_hours = (now - datetime.fromisoformat(turn["timestamp"])).total_seconds() / 3600
+            decay = 0.5 ** (max(age_hours, 0) / self.recall_half_life_hours)
+            scored.append((similarity * decay, turn))
+
+        top = sorted(scored, key=lambda x: x[0], reverse=True)[:k]
+        return sorted((turn for _, turn in top), key=lambda t: t["id"])
+
+    def get_relevant_context(self, query_embedding, max_turns=3, recent_turns=1, session_id=None):
+        """相关历史对话 + 最近几轮对话；未启用向量记忆时退化为最近max_turns轮"""
+        if self.memory_index is None:
+            return self.get_short_term_context(max_turns, session_id)
+
+        recent = self.get_recent_turns(recent_turns, session_id)
+        relevant = self.recall_relevant(query_embedding, max_turns, session_id,
+                                        exclude_ids={t["id"] for t in recent})
+        return self.format_turns(relevant + recent)
+
+    def _extract_topics(self, text):
+        """提取话题词：英文单词（至少3个字符）和不含虚词的中文二元组"""
         topics = []
-        for conv in self.short_term_memory:
-            # 简单的关键词提取
-            user_words = conv['user'].split()
-            topics.extend([w for w in user_words if len(w) > 2])
-        
-        # 统计词频
-        topic_count = {}
-        for topic in topics:
-            topic_count[topic] = topic_count.get(topic, 0) + 1
-        
-        # 生成摘要
-        top_topics = sorted(topic_count.items(), key=lambda x: x[1], reverse=True)[:5]
-        
-        if top_topics:
-            summary_topics = [topic for topic, count in top_topics]
-            new_summary = f"最近讨论的主要话题: {', '.join(summary_topics)}"
-            
-            # 合并到长期摘要
-            if self.long_term_summary:
-                self.long_term_summary += f"\n{new_summary}"
-            else:
-                self.long_term_summary = new_summary
-            
-            self.save_long_term()
-    
-    def get_long_term_summary(self):
+        for keyword in extract_keywords(text):
+            if '一' <= keyword[0] <= '鿿':
+                if len(keyword) == 2 and not _STOP_CHARS.intersection(keyword):
+                    topics.append(keyword)
+            elif len(keyword) >= 3 and not keyword[0].isdigit():
+                topics.append(keyword)
+        return topics
+
+    def update_long_term_summary(self, session_id=None):
+        """增量更新长期摘要：只处理检查点之后的新对话，话题计数按轮次衰减"""
+        session_id = self._session(session_id)
+        last_turn_id, topic_count = self._load_checkpoint(session_id)
+
+        with self._lock:
+            rows = self._conn.execute('''
+                SELECT id, user_input FROM turns
+                WHERE session_id = ? AND id > ?
+                ORDER BY id
+            ''', (session_id, last_turn_id)).fetchall()
+        if not rows:
+            return
+
+        for turn_id, user_input in rows:
+            # 旧话题衰减，新话题计数
+            topic_count = {t: c * self.topic_decay for t, c in topic_count.items()}
+            for topic in self._extract_topics(user_input):
+                topic_count[topic] = topic_count.get(topic, 0) + 1
+            last_turn_id = turn_id
+
+        top_topics = sorted(topic_count.items(), key=lambda x: x[1], reverse=True)
+        topic_count = {t: c for t, c in top_topics[:self.max_topics] if c >= 0.01}
+
+        self.save_long_term(self._render_summary(top_topics), session_id,
+                            last_turn_id=last_turn_id, topic_count=topic_count)
+
+    def _render_summary(self, top_topics):
+        """在token预算内生成摘要（替换而非追加，长度不随会话增长）"""
+        prefix = "最近讨论的主要话题: "
+        summary_topics = []
+        for topic, count in top_topics:
+            candidate = prefix + ", ".join(summary_topics + [topic])
+            if self.counter.count(candidate) > self.summary_max_tokens:
+                break
+            summary_topics.append(topic)
+        return prefix + ", ".join(summary_topics) if summary_topics else ""
+
+    def _load_checkpoint(self, session_id):
+        """读取摘要检查点和话题计数"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_turn_id, topic_counts FROM summaries WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if not row:
+            return 0, {}
+        return row[0], json.loads(row[1])
+
+    def _load_summary(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary FROM summaries WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else ""
+
+    def get_long_term_summary(self, session_id=None):
         """获取长期摘要"""
-        return self.long_term_summary if self.long_term_summary else "暂无历史对话摘要"
-    
-    def save_short_term(self):
-        """保存短期记忆"""
-        try:
-            with open(self.short_term_file, 'w', encoding='utf-8') as f:
-                json.dump(list(self.short_term_memory), f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存短期记忆失败: {e}")
-    
-    def save_long_term(self):
-        """保存长期摘要"""
+        summary = self._load_summary(self._session(session_id))
+        return summary if summary else "暂无历史对话摘要"
+
+    def save_long_term(self, summary, session_id=None, last_turn_id=None, topic_count=None):
+        """保存长期摘要（可同时更新检查点）"""
+        session_id = self._session(session_id)
+        if last_turn_id is None or topic_count is None:
+            saved_turn_id, saved_count = self._load_checkpoint(session_id)
+            last_turn_id = saved_turn_id if last_turn_id is None else last_turn_id
+            topic_count = saved_count if topic_count is None else topic_count
         try:
-            with open(self.long_term_file, 'w', encoding='utf-8') as f:
-                json.dump({"summary": self.long_term_summary}, f, ensure_ascii=False, indent=2)
+            with self._lock:
+                self._conn.execute('''
+                    INSERT OR REPLACE INTO summaries
+                        (session_id, summary, updated_at, last_turn_id, topic_counts)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (session_id, summary, datetime.now().isoformat(), last_turn_id,
+                      json.dumps(topic_count, ensure_ascii=False)))
+                self._conn.commit()
         except Exception as e:
-            print(f"保存长期摘要失败: {e}")
-    
+            logger.warning(f"保存长期摘要失败: {e}")
+
     def load_memory(self):
-        """加载记忆数据"""
-        # 加载短期记忆
+        """迁移旧版JSON记忆文件到默认会话"""
         try:
             if os.path.exists(self.short_term_file):
                 with open(self.short_term_file, 'r', encoding='utf-8') as f:
                     data = json.load(f)
-                    self.short_term_memory = deque(data, maxlen=self.max_short_term)
+                with self._lock:
+                    self._conn.executemany('''
+                        INSERT INTO turns (session_id, timestamp, user_input, assistant_response)
+                        VALUES (?, ?, ?, ?)
+                    ''', [(self.default_session, conv["timestamp"], conv["user"], conv["assistant"])
+                          for conv in data])
+                    self._conn.commit()
+                os.replace(self.short_term_file, self.short_term_file + ".migrated")
         except Exception as e:
-            print(f"加载短期记忆失败: {e}")
-        
-        # 加载长期摘要
+            logger.warning(f"迁移短期记忆失败: {e}")
+
         try:
             if os.path.exists(self.long_term_file):
                 with open(self.long_term_file, 'r', encoding='utf-8') as f:
                     data = json.load(f)
-                    self.long_term_summary = data.get("summary", "")
+                if data.get("summary"):
+                    self.save_long_term(data["summary"], self.default_session)
+                os.replace(self.long_term_file, self.long_term_file + ".migrated")
         except Exception as e:
-            print(f"加载长期摘要失败: {e}")
-    
-    def clear_memory(self):
-        """清空所有记忆"""
-        self.short_term_memory.clear()
-        self.long_term_summary = ""
-        
-        # 删除文件
-        for file_path in [self.short_term_file, self.long_term_file]:
-            if os.path.exists(file_path):
-                os.remove(file_path)
\ No newline at end of file
+            logger.warning(f"迁移长期摘要失败: {e}")
+
+    def list_sessions(self):
+        """列出所有会话ID"""
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT session_id FROM turns").fetchall()
+        return [row[0] for row in rows]
+
+    def clear_memory(self, session_id=None):
+        """清空会话的所有记忆"""
+        session_id = self._session(session_id)
+        with self._lock:
+            self._conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+        if self.memory_index is not None:
+            self.memory_index.remove_session(session_id)
+
+    def flush(self, timeout=None):
+        """等待后台摘要任务完成"""
+        if self.summary_worker is not None:
+            self.summary_worker.flush(timeout)
+
+    def after_fork(self):
+        """fork出的子进程中调用：SQLite连接和后台线程不能跨fork使用，重新创建"""
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        if self.summary_worker is not None:
+            self.summary_worker = SummaryWorker(self._background_update)
+
+    def close(self):
+        """停止后台任务，保存未落盘的记忆索引并关闭数据库连接"""
+        if self.summary_worker is not None:
+            self.summary_worker.stop()
+        if self.memory_index is not None:
+            self.memory_index.save()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,55 @@
+"""
+摘要后台任务：在请求路径之外增量更新长期摘要
+"""
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SummaryWorker:
+    """单线程后台worker，按会话合并待处理的摘要任务"""
+
+    def __init__(self, handler, name="memory-summary"):
+        self.handler = handler  # handler(session_id)
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def schedule(self, session_id):
+        """登记会话，已在队列中的会话不会重复入队"""
+        with self._lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+        self._queue.put(session_id)
+
+    def flush(self, timeout=None):
+        """等待队列中的任务全部完成"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def stop(self, timeout=None):
+        """停止worker（先处理完已入队的任务）"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            if isinstance(task, threading.Event):
+                task.set()
+                continue
+
+            with self._lock:
+                self._pending.discard(task)
+            try:
+                self.handler(task)
+            except Exception as e:
+                logger.warning(f"后台更新长期摘要失败: {e}")
@@ -2,56 +2,143 @@
 上下文压缩模块：智能压缩检索结果，避免token溢出
 """
 import re
-from typing import List, Dict
+from typing import List, Dict, Union
+import numpy as np
+from .token_budget import get_token_counter
+from ..retrieved_item import RetrievedItem, extract_keywords
+
+# 句子切分：保留句末标点
+_SENTENCE_SPLIT = re.compile(r'(?<=[。！？!?；;\n])|(?<=\.\s)')
 
 class ContextCompressor:
-    def __init__(self, max_tokens=2000):
+    def __init__(self, max_tokens=2000, counter=None, encoder=None, mmr_lambda=0.7):
         self.max_tokens = max_tokens
+        self.counter = counter or get_token_counter()
+        self.encoder = encoder  # EmbeddingCache，提供时启用句子级抽取式压缩
+        self.mmr_lambda = mmr_lambda
+        self.last_stats = {}
         
-    def compress_context(self, retrieved_items: List[str], query: str) -> List[str]:
+    def compress_context(self, retrieved_items: List[Union[str, RetrievedItem]],
+                         query: str) -> List[RetrievedItem]:
         """智能压缩上下文"""
         if not retrieved_items:
+            self.last_stats = {}
             return []
+        
+        retrieved_items = [RetrievedItem.coerce(item) for item in retrieved_items]
             
         current_tokens = self._estimate_tokens(retrieved_items)
         
         if current_tokens <= self.max_tokens:
+            self._record_stats("none", current_tokens, current_tokens)
             return retrieved_items
+        
+        if self.encoder is not None:
+            result = self._extractive_compress(retrieved_items, query, self.max_tokens)
+            self._record_stats("extractive", current_tokens, self._estimate_tokens(result))
+            return result
             
         scored_items = self._score_importance(retrieved_items, query)
-        return self._dynamic_compress(scored_items, self.max_tokens)
+        result = self._dynamic_compress(scored_items, self.max_tokens)
+        self._record_stats("keyword", current_tokens, self._estimate_tokens(result))
+        return result
+    
+    def _record_stats(self, method: str, original_tokens: int, retained_tokens: int):
+        """记录压缩统计（保留token比例）"""
+        self.last_stats = {
+            'method': method,
+            'original_tokens': original_tokens,
+            'retained_tokens': retained_tokens,
+            'retained_ratio': retained_tokens / original_tokens if original_tokens else 1.0
+        }
+    
+    def _split_sentences(self, text: str) -> List[str]:
+        """将文本切分为句子"""
+        return [s for s in _SENTENCE_SPLIT.split(text) if s and s.strip()]
+    
+    def _extractive_compress(self, items: List[RetrievedItem], query: str,
+                             max_tokens: int) -> List[RetrievedItem]:
+        """句子级抽取式压缩：一次向量化打分，MMR贪心选句直到预算用完"""
+        sentences = []
+        owners = []
+        for item_idx, item in enumerate(items):
+            for sentence in self._split_sentences(item.text):
+                sentences.append(sentence)
+                owners.append(item_idx)
+        if not sentences:
+            return []
+        
+        tokens = np.array([self.counter.count(s) for s in sentences])
+        embeddings = self.encoder.encode(sentences)
+        query_embedding = self.encoder.encode_one(query)
+        relevance = embeddings @ query_embedding
+        
+        selected = self._mmr_select(embeddings, relevance, tokens, max_tokens)
+        
+        # 按原始条目和句子顺序重组
+        kept_by_item = {}
+        for idx in sorted(selected):
+            kept_by_item.setdefault(owners[idx], []).append(sentences[idx])
+        result = []
+        for item_idx in sorted(kept_by_item):
+            text = "".join(kept_by_item[item_idx])
+            item = items[item_idx]
+            result.append(item if text == item.text else item.derive(text))
+        return result
+    
+    def _mmr_select(self, embeddings: np.ndarray, relevance: np.ndarray,
+                    tokens: np.ndarray, max_tokens: int) -> List[int]:
+        """最大边际相关性（MMR）贪心选择"""
+        n = len(relevance)
+        available = np.ones(n, dtype=bool)
+        max_similarity = np.zeros(n, dtype='float32')
+        selected = []
+        remaining = max_tokens
+        
+        while True:
+            available &= tokens <= remaining
+            if not available.any():
+                break
+            mmr = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * max_similarity
+            mmr[~available] = -np.inf
+            best = int(np.argmax(mmr))
+            
+            selected.append(best)
+            available[best] = False
+            remaining -= int(tokens[best])
+            max_similarity = np.maximum(max_similarity, embeddings @ embeddings[best])
+        
+        return selected
     
-    def _estimate_tokens(self, texts: List[str]) -> int:
+    def _estimate_tokens(self, items: List[RetrievedItem]) -> int:
         """估算token数量"""
-        total_chars = sum(len(text) for text in texts)
-        return total_chars // 4
+        return sum(item.token_count for item in items)
     
-    def _score_importance(self, items: List[str], query: str) -> List[Dict]:
+    def _score_importance(self, items: List[RetrievedItem], query: str) -> List[Dict]:
         """为检索项评分"""
         scored_items = []
-        query_keywords = set(re.findall(r'\w+', query.lower()))
+        query_keywords = extract_keywords(query)
         
         for item in items:
             score = 0
-            item_keywords = set(re.findall(r'\w+', item.lower()))
             
             # 关键词匹配
-            keyword_overlap = len(query_keywords & item_keywords)
+            keyword_overlap = len(query_keywords & item.keywords)
             score += keyword_overlap * 10
             
             # 长度惩罚
-            length_penalty = min(len(item) / 200, 2)
+            length_penalty = min(len(item.text) / 200, 2)
             score -= length_penalty
             
             scored_items.append({
                 'content': item,
                 'score': score,
-                'tokens': len(item) // 4
+                'tokens': item.token_count
             })
         
         return sorted(scored_items, key=lambda x: x['score'], reverse=True)
     
-    def _dynamic_compress(self, scored_items: List[Dict], max_tokens: int) -> List[str]:
+    def _dynamic_compress(self, scored_items: List[Dict], max_tokens: int) -> List[RetrievedItem]:
         """动态压缩"""
         result = []
         used_tokens = 0
@@ -61,16 +148,14 @@ class ContextCompressor:
                 result.append(item['content'])
                 used_tokens += item['tokens']
             elif used_tokens < max_tokens * 0.8:
-                compressed = self._summarize_content(item['content'], max_tokens - used_tokens)
+                remaining = max_tokens - used_tokens - self.counter.count("[摘要] ")
+                compressed = self._summarize_content(item['content'].text, remaining)
                 if compressed:
-                    result.append(f"[摘要] {compressed}")
+                    result.append(item['content'].derive(f"[摘要] {compressed}"))
                 break
         
         return result
     
     def _summarize_content(self, content: str, max_tokens: int) -> str:
         """内容摘要"""
-        max_chars = max_tokens * 4
-        if len(content) <= max_chars:
-            return content
-        return content[:max_chars-3] + "..."
\ No newline at end of file
+        return self.counter.truncate(content, max_tokens)
\ No newline at end of file
@@ -0,0 +1,84 @@
+"""
+MinHash/LSH模块：大规模候选集的近似去重
+"""
+import re
+import zlib
+from typing import List, Set
+
+import numpy as np
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def shingles(text: str, size: int = 3) -> Set[str]:
+    """字符n-gram分片（对中文和英文都适用）"""
+    normalized = re.sub(r'\s+', ' ', text.lower().strip())
+    if len(normalized) <= size:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+
+class MinHashLSH:
+    """MinHash签名 + 分段LSH，候选对查找为亚二次复杂度"""
+
+    def __init__(self, num_perm=64, bands=16, shingle_size=3, seed=42):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm必须能被bands整除")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 31, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=num_perm).astype(np.uint64)
+
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        """计算MinHash签名矩阵 (n, num_perm)"""
+        result = np.full((len(texts), self.num_perm), _MAX_HASH, dtype=np.uint64)
+        for i, text in enumerate(texts):
+            grams = shingles(text, self.shingle_size)
+            if not grams:
+                continue
+            hashes = np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams),
+                                 dtype=np.uint64, count=len(grams))
+            permuted = (np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME
+            result[i] = permuted.min(axis=1) & _MAX_HASH
+        return result
+
+    def candidate_pairs(self, signatures: np.ndarray) -> Set[tuple]:
+        """按band分桶，返回落入同一桶的候选对 (i, j)，i < j"""
+        pairs = set()
+        for band in range(self.bands):
+            segment = signatures[:, band * self.rows:(band + 1) * self.rows]
+            _, bucket_ids = np.unique(segment, axis=0, return_inverse=True)
+            bucket_ids = bucket_ids.reshape(-1)
+            order = np.argsort(bucket_ids, kind='stable')
+            sorted_ids = bucket_ids[order]
+            boundaries = np.flatnonzero(np.diff(sorted_ids)) + 1
+            for bucket in np.split(order, boundaries):
+                if len(bucket) < 2:
+                    continue
+                # 只与桶首和前一个成员配对，避免大桶产生二次数量的候选对
+                members = sorted(bucket.tolist())
+                for x in range(1, len(members)):
+                    pairs.add((members[0], members[x]))
+                    pairs.add((members[x - 1], members[x]))
+        return pairs
+
+    def duplicate_mask(self, texts: List[str], threshold: float) -> np.ndarray:
+        """返回保留掩码：与更早保留项的估计Jaccard相似度超过阈值的文本被去除"""
+        keep = np.ones(len(texts), dtype=bool)
+        if len(texts) < 2:
+            return keep
+
+        signatures = self.signatures(texts)
+        pairs = sorted(self.candidate_pairs(signatures), key=lambda p: (p[1], p[0]))
+        for i, j in pairs:
+            if not keep[i] or not keep[j]:
+                continue
+            similarity = float(np.mean(signatures[i] == signatures[j]))
+            if similarity > threshold:
+                keep[j] = False
+        return keep
@@ -1,79 +1,104 @@
 """
 多模态融合模块：整合不同检索源的结果
 """
-from typing import List, Dict, Set
+from typing import Dict, List, Union
 import re
+import numpy as np
+from .minhash import MinHashLSH
+from ..retrieved_item import RetrievedItem, ensure_embeddings, extract_keywords
+
+ItemLike = Union[str, RetrievedItem]
 
 class MultiModalFusion:
-    def __init__(self):
-        self.similarity_threshold = 0.7
-        
-    def fuse_results(self, vdb_results: List[str], sql_results: List[str], 
-                    graph_results: List[str], query: str) -> List[str]:
+    SOURCE_WEIGHTS = {'vdb': 1.0, 'sql': 1.2, 'graph': 1.1}
+    
+    def __init__(self, encoder=None, method="rrf", rrf_k=60):
+        self.similarity_threshold = 0.85
+        self.deduplicator = ResultDeduplicator(self.similarity_threshold, encoder=encoder)
+        self.method = method  # "rrf"（倒数排名融合）或 "minmax"（分数归一化）
+        self.rrf_k = rrf_k
+        
+    def fuse_results(self, vdb_results: List[ItemLike], sql_results: List[ItemLike], 
+                    graph_results: List[ItemLike], query: str) -> List[RetrievedItem]:
         """融合多模态检索结果"""
-        all_results = []
+        by_source = {}
         
         # 标记来源
-        for result in vdb_results:
-            all_results.append({'content': result, 'source': 'vdb', 'score': 1.0})
-        for result in sql_results:
-            all_results.append({'content': result, 'source': 'sql', 'score': 1.0})
-        for result in graph_results:
-            all_results.append({'content': result, 'source': 'graph', 'score': 1.0})
-        
-        # 去重
-        deduplicated = self._semantic_deduplication(all_results)
-        
-        # 互补性分析
-        complementary = self._analyze_complementarity(deduplicated, query)
+        for source, results in (('vdb', vdb_results), ('sql', sql_results), ('graph', graph_results)):
+            by_source[source] = [RetrievedItem.coerce(result, source) for result in results]
+        all_results = [item for items in by_source.values() for item in items]
+        
+        if any(item.score is not None for item in all_results):
+            # 已有检索分数：直接融合，跳过启发式打分；去重时保留融合分数更高者
+            self._score_fusion(by_source)
+            all_results.sort(key=lambda x: x.fusion_score, reverse=True)
+            complementary = self._semantic_deduplication(all_results)
+        else:
+            # 去重
+            deduplicated = self._semantic_deduplication(all_results)
+            
+            # 互补性分析
+            complementary = self._analyze_complementarity(deduplicated, query)
         
         # 重排序
         final_results = self._cross_modal_rerank(complementary, query)
         
-        return [item['content'] for item in final_results]
+        return final_results
     
-    def _semantic_deduplication(self, results: List[Dict]) -> List[Dict]:
-        """语义去重"""
-        unique_results = []
-        seen_contents: Set[str] = set()
-        
-        for result in results:
-            content = result['content']
+    def _score_fusion(self, by_source: Dict[str, List[RetrievedItem]]) -> None:
+        """基于检索分数的融合：倒数排名融合或按来源归一化后加权"""
+        for source, items in by_source.items():
+            if not items:
+                continue
+            weight = self.SOURCE_WEIGHTS.get(source, 1.0)
             
-            # 简单文本去重
-            normalized = re.sub(r'\s+', ' ', content.lower().strip())
+            # 有分数的来源按分数排序，无分数的来源沿用检索器返回顺序
+            if all(item.score is not None for item in items):
+                ranked = sorted(items, key=lambda x: x.score, reverse=True)
+            else:
+                ranked = items
             
-            if normalized not in seen_contents:
-                seen_contents.add(normalized)
-                unique_results.append(result)
-        
-        return unique_results
+            if self.method == "minmax" and all(item.score is not None for item in items):
+                scores = np.array([item.score for item in ranked], dtype='float32')
+                span = scores.max() - scores.min()
+                normalized = (scores - scores.min()) / span if span > 0 else np.ones_like(scores)
+                for item, value in zip(ranked, normalized):
+                    item.fusion_score = weight * float(value)
+            elif self.method == "minmax":
+                for rank, item in enumerate(ranked):
+                    item.fusion_score = weight * (1 - rank / len(ranked))
+            else:
+                for rank, item in enumerate(ranked):
+                    item.fusion_score = weight / (self.rrf_k + rank + 1)
+    
+    def _semantic_deduplication(self, results: List[RetrievedItem]) -> List[RetrievedItem]:
+        """语义去重"""
+        keep = self.deduplicator.keep_mask(results)
+        return [result for result, kept in zip(results, keep) if kept]
     
-    def _analyze_complementarity(self, results: List[Dict], query: str) -> List[Dict]:
+    def _analyze_complementarity(self, results: List[RetrievedItem], query: str) -> List[RetrievedItem]:
         """分析结果互补性"""
-        query_keywords = set(re.findall(r'\w+', query.lower()))
+        query_keywords = extract_keywords(query)
         
         for result in results:
-            content_keywords = set(re.findall(r'\w+', result['content'].lower()))
-            
             # 计算覆盖度
-            coverage = len(query_keywords & content_keywords) / len(query_keywords) if query_keywords else 0
+            coverage = len(query_keywords & result.keywords) / len(query_keywords) if query_keywords else 0
             
             # 信息密度
-            info_density = len(re.findall(r'\d+|[A-Z][a-z]+', result['content']))
+            info_density = len(re.findall(r'\d+|[A-Z][a-z]+', result.text))
             
             # 来源权重
-            source_weight = {'vdb': 1.0, 'sql': 1.2, 'graph': 1.1}[result['source']]
+            source_weight = self.SOURCE_WEIGHTS.get(result.source, 1.0)
             
             # 综合评分
-            result['fusion_score'] = coverage * 0.4 + (info_density / 10) * 0.3 + source_weight * 0.3
+            result.fusion_score = coverage * 0.4 + (info_density / 10) * 0.3 + source_weight * 0.3
         
         return results
     
-    def _cross_modal_rerank(self, results: List[Dict], query: str) -> List[Dict]:
+    def _cross_modal_rerank(self, results: List[RetrievedItem], query: str) -> List[RetrievedItem]:
         """跨模态重排序"""
         # 按融合分数排序
-        ranked = sorted(results, key=lambda x: x['fusion_score'], reverse=True)
+        ranked = sorted(results, key=lambda x: x.fusion_score, reverse=True)
         
         # 确保多样性：不同来源的结果交替出现
         final_results = []
@@ -82,53 +107,72 @@ class MultiModalFusion:
         for result in ranked:
             if len(final_results) < 3:  # 前3个结果保证质量
                 final_results.append(result)
-                sources_used.append(result['source'])
+                sources_used.append(result.source)
             else:
                 # 后续结果考虑多样性
-                if result['source'] not in sources_used[-2:]:  # 避免连续相同来源
+                if result.source not in sources_used[-2:]:  # 避免连续相同来源
                     final_results.append(result)
-                    sources_used.append(result['source'])
+                    sources_used.append(result.source)
         
         return final_results[:8]  # 限制总数量
 
 class ResultDeduplicator:
-    """结果去重器"""
+    """结果去重器：小候选集用向量相似度矩阵，大候选集回退到MinHash/LSH"""
     
-    def __init__(self, similarity_threshold=0.8):
+    def __init__(self, similarity_threshold=0.8, encoder=None, lsh_min_size=200,
+                 jaccard_threshold=0.8):
         self.similarity_threshold = similarity_threshold
+        self.encoder = encoder
+        self.lsh_min_size = lsh_min_size
+        self.jaccard_threshold = jaccard_threshold
+        self.lsh = MinHashLSH()
     
-    def deduplicate(self, results: List[str]) -> List[str]:
+    def deduplicate(self, results: List[ItemLike]) -> List[ItemLike]:
         """去除重复和高度相似的结果"""
         if not results:
             return []
         
-        unique_results = [results[0]]  # 保留第一个
-        
-        for result in results[1:]:
-            is_duplicate = False
-            
-            for existing in unique_results:
-                if self._is_similar(result, existing):
-                    is_duplicate = True
-                    break
-            
-            if not is_duplicate:
-                unique_results.append(result)
-        
-        return unique_results
+        keep = self.keep_mask(results)
+        return [result for result, kept in zip(results, keep) if kept]
     
-    def _is_similar(self, text1: str, text2: str) -> bool:
-        """判断两个文本是否相似"""
-        # 简单的相似度计算
-        words1 = set(re.findall(r'\w+', text1.lower()))
-        words2 = set(re.findall(r'\w+', text2.lower()))
-        
-        if not words1 or not words2:
-            return False
-        
-        intersection = len(words1 & words2)
-        union = len(words1 | words2)
-        
-        jaccard_similarity = intersection / union if union > 0 else 0
-        
-        return jaccard_similarity > self.similarity_threshold
\ No newline at end of file
+    def keep_mask(self, results: List[ItemLike]) -> np.ndarray:
+        """返回保留掩码（先出现的结果优先保留）"""
+        items = [RetrievedItem.coerce(result) for result in results]
+        keep = self._exact_mask([item.text for item in items])
+        candidates = np.flatnonzero(keep)
+        if len(candidates) < 2:
+            return keep
+        
+        candidate_items = [items[i] for i in candidates]
+        if self.encoder is not None and len(candidates) < self.lsh_min_size:
+            sub_keep = self._embedding_mask(candidate_items)
+        else:
+            sub_keep = self.lsh.duplicate_mask([item.text for item in candidate_items],
+                                               self.jaccard_threshold)
+        
+        keep[candidates[~sub_keep]] = False
+        return keep
+    
+    def _exact_mask(self, texts: List[str]) -> np.ndarray:
+        """空白归一化后的精确去重"""
+        keep = np.ones(len(texts), dtype=bool)
+        seen = set()
+        for i, text in enumerate(texts):
+            normalized = re.sub(r'\s+', ' ', text.lower().strip())
+            if normalized in seen:
+                keep[i] = False
+            else:
+                seen.add(normalized)
+        return keep
+    
+    def _embedding_mask(self, items: List[RetrievedItem]) -> np.ndarray:
+        """批量编码后用相似度矩阵抑制近似重复"""
+        ensure_embeddings(items, self.encoder)
+        embeddings = np.vstack([item.embedding for item in items])
+        similarity = embeddings @ embeddings.T
+        
+        keep = np.ones(len(items), dtype=bool)
+        for i in range(1, len(items)):
+            if (similarity[i, :i][keep[:i]] > self.similarity_threshold).any():
+                keep[i] = False
+        return keep
@@ -0,0 +1,230 @@
+"""
+Token预算模块：基于真实分词器的token计数与分段预算分配
+"""
+import logging
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# CJK字符（含中文标点与全角符号）
+_CJK_PATTERN = re.compile(r'[　-〿㐀-䶿一-鿿豈-﫿＀-￯]')
+
+# 无分词器时的保守估算：一个中文字符约1.3个token，其余约4个字符1个token
+CJK_TOKENS_PER_CHAR = 1.3
+CHARS_PER_TOKEN = 4
+
+
+class TokenCounter:
+    """带缓存的token计数器（优先使用tiktoken，其次自定义分词器，最后启发式估算）"""
+
+    def __init__(self, encoding_name="cl100k_base", tokenizer=None, cache_size=8192):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._encode = None
+        self._decode = None
+        self.backend = "heuristic"
+
+        if tokenizer is not None:
+            self._encode = tokenizer.encode
+            self._decode = getattr(tokenizer, "decode", None)
+            self.backend = "custom"
+        else:
+            try:
+                import tiktoken
+                encoding = tiktoken.get_encoding(encoding_name)
+                self._encode = encoding.encode_ordinary
+                self._decode = encoding.decode
+                self.backend = "tiktoken"
+            except Exception:
+                logger.info("tiktoken不可用，回退到中文感知的启发式token估算")
+
+    def _raw_count(self, text: str) -> int:
+        """不经缓存的token计数"""
+        if not text:
+            return 0
+        if self._encode is not None:
+            return len(self._encode(text))
+        cjk_chars = len(_CJK_PATTERN.findall(text))
+        other_chars = len(text) - cjk_chars
+        return math.ceil(cjk_chars * CJK_TOKENS_PER_CHAR + other_chars / CHARS_PER_TOKEN)
+
+    def count(self, text: str) -> int:
+        """计算单个字符串的token数（按字符串缓存）"""
+        if not text:
+            return 0
+        with self._lock:
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                return cached
+
+        tokens = self._raw_count(text)
+
+        with self._lock:
+            self._cache[text] = tokens
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def count_many(self, texts: List[str]) -> int:
+        """计算多个字符串的token总数"""
+        return sum(self.count(str(text)) for text in texts)
+
+    def truncate(self, text: str, max_tokens: int, suffix: str = "...") -> str:
+        """按token数截断文本"""
+        if max_tokens <= 0 or not text:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+
+        budget = max(max_tokens - self._raw_count(suffix), 0)
+        if self._encode is not None and self._decode is not None:
+            return self._decode(self._encode(text)[:budget]) + suffix
+
+        # 无解码器时二分查找最长前缀
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self._raw_count(text[:mid]) <= budget:
+                low = mid
+            else:
+                high = mid - 1
+        return text[:low] + suffix
+
+
+_default_counter = None
+_default_counter_lock = threading.Lock()
+
+
+def get_token_counter() -> TokenCounter:
+    """获取进程内共享的token计数器"""
+    global _default_counter
+    if _default_counter is None:
+        with _default_counter_lock:
+            if _default_counter is None:
+                _default_counter = TokenCounter()
+    return _default_counter
+
+
+class TokenBudget:
+    """按模型上下文窗口为prompt各部分分配token预算"""
+
+    # 扣除系统指令与问题后，剩余可用预算的分配比例（其余作为缓冲）
+    DEFAULT_RATIOS = {
+        'short_term': 0.2,
+        'retrieved': 0.6,
+        'long_term': 0.1,
+    }
+    # 未用完的预算按此顺序再分配
+    PRIORITY = ('retrieved', 'short_term', 'long_term')
+
+    def __init__(self, context_window=4096, reserve_output=1024, ratios=None,
+                 max_short_term=500, counter: Optional[TokenCounter] = None):
+        self.context_window = context_window
+        self.reserve_output = reserve_output
+        self.ratios = dict(self.DEFAULT_RATIOS, **(ratios or {}))
+        self.max_short_term = max_short_term
+        self.counter = counter or get_token_counter()
+
+    @property
+    def prompt_limit(self) -> int:
+        """prompt可用的最大token数"""
+        return max(self.context_window - self.reserve_output, 0)
+
+    def allocate(self, system: str, question: str, short_term=None,
+                 retrieved=None, long_term=None, overhead: int = 0,
+                 formatter=str) -> Dict[str, int]:
+        """计算各部分的token预算"""
+        system_tokens = self.counter.count(system)
+        question_tokens = min(self.counter.count(question),
+                              max(self.prompt_limit - system_tokens - overhead, 0))
+        available = max(self.prompt_limit - system_tokens - question_tokens - overhead, 0)
+
+        demands = {
+            'short_term': self.counter.count(short_term or ""),
+            'retrieved': self.counter.count_many([formatter(item) for item in retrieved or []])
+                         + len(retrieved or []),
+            'long_term': self.counter.count(long_term or ""),
+        }
+
+        # 按比例分配，不超过实际需求
+        shares = {
+            'short_term': min(int(available * self.ratios['short_term']), self.max_short_term),
+            'retrieved': int(available * self.ratios['retrieved']),
+            'long_term': int(available * self.ratios['long_term']),
+        }
+        budget = {name: min(demands[name], shares[name]) for name in shares}
+
+        # 将未用完的预算（不含缓冲）按优先级分给仍有需求的部分
+        spare = sum(shares.values()) - sum(budget.values())
+        for name in self.PRIORITY:
+            if spare <= 0:
+                break
+            extra = min(demands[name] - budget[name], spare)
+            if extra > 0:
+                budget[name] += extra
+                spare -= extra
+
+        budget['system'] = system_tokens
+        budget['question'] = question_tokens
+        budget['available'] = available
+        return budget
+
+    def trim_items(self, items: List, max_tokens: int, formatter=str) -> List:
+        """按条目边界裁剪检索结果（保持原有顺序）"""
+        kept = []
+        used = 0
+        for item in items:
+            tokens = self.counter.count(formatter(item)) + 1  # 换行符
+            if used + tokens > max_tokens:
+                break
+            kept.append(item)
+            used += tokens
+        return kept
+
+    def trim_lines(self, text: str, max_tokens: int, keep_recent: bool = True,
+                   group_size: int = 1) -> str:
+        """按行（或行组，如一问一答）边界裁剪文本，默认保留最近的内容"""
+        if not text or max_tokens <= 0:
+            return ""
+        if self.counter.count(text) <= max_tokens:
+            return text
+
+        lines = text.split("\n")
+        groups = ["\n".join(lines[i:i + group_size]) for i in range(0, len(lines), group_size)]
+        if keep_recent:
+            groups.reverse()
+
+        kept = []
+        used = 0
+        for group in groups:
+            tokens = self.counter.count(group) + 1
+            if used + tokens > max_tokens:
+                break
+            kept.append(group)
+            used += tokens
+
+        if keep_recent:
+            kept.reverse()
+        return "\n".join(kept)
+
+    def fit(self, system: str, question: str, short_term=None, retrieved=None,
+            long_term=None, overhead: int = 0, formatter=str) -> Dict:
+        """按预算裁剪各部分，返回裁剪后的内容和预算"""
+        budget = self.allocate(system, question, short_term, retrieved, long_term, overhead, formatter)
+
+        if self.counter.count(question) > budget['question']:
+            question = self.counter.truncate(question, budget['question'])
+
+        return {
+            'question': question,
+            'short_term': self.trim_lines(short_term or "", budget['short_term'], group_size=2),
+            'retrieved': self.trim_items(retrieved or [], budget['retrieved'], formatter),
+            'long_term': self.trim_lines(long_term or "", budget['long_term']),
+            'budget': budget,
+        }
@@ -0,0 +1,172 @@
+"""
+持久化模块：原子写入、跨进程文件锁和进程内读写锁
+"""
+import json
+import os
+import pickle
+import tempfile
+import threading
+from contextlib import contextmanager
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+def atomic_write(path, writer, mode='w', encoding='utf-8'):
+    """先写临时文件再重命名，读者只会看到旧文件或完整的新文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, encoding=None if 'b' in mode else encoding) as f:
+            writer(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_json(path, data, **kwargs):
+    """原子写入JSON"""
+    kwargs.setdefault('ensure_ascii', False)
+    atomic_write(path, lambda f: json.dump(data, f, **kwargs))
+
+
+def atomic_write_pickle(path, obj):
+    """原子写入pickle"""
+    atomic_write(path, lambda f: pickle.dump(obj, f), mode='wb')
+
+
+def atomic_write_index(index, path):
+    """原子写入FAISS索引"""
+    import faiss
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class FileLock:
+    """跨进程文件锁（POSIX使用flock，Windows使用msvcrt，Windows下共享锁按独占锁处理）"""
+
+    def __init__(self, path, shared=False):
+        self.lock_path = f"{path}.lock"
+        self.shared = shared
+        self._fd = None
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.lock_path)), exist_ok=True)
+        self._fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.name == 'nt':
+            msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(self._fd, fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            if os.name == 'nt':
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class RWLock:
+    """进程内读写锁（写者优先，避免写者饥饿）"""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read_lock(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write_lock(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+
+def _reset_path_locks():
+    """fork出的子进程中调用：父进程其他线程持有的锁在子进程里永远不会释放，换用新的锁表"""
+    global _path_locks, _path_locks_guard
+    _path_locks = {}
+    _path_locks_guard = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_path_locks)
+
+
+def _rwlock_for(path):
+    key = os.path.abspath(path)
+    with _path_locks_guard:
+        lock = _path_locks.get(key)
+        if lock is None:
+            lock = _path_locks[key] = RWLock()
+        return lock
+
+
+@contextmanager
+def read_locked(path):
+    """读取文件时持有进程内读锁和跨进程共享锁"""
+    with _rwlock_for(path).read_lock(), FileLock(path, shared=True):
+        yield
+
+
+@contextmanager
+def write_locked(path):
+    """写入文件时持有进程内写锁和跨进程独占锁"""
+    with _rwlock_for(path).write_lock(), FileLock(path):
+        yield
@@ -1,39 +1,112 @@
 """
 Cherry Studio 上下文插件主入口
 """
+import logging
 import sys
 import os
+import threading
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from cherry_plugin.routing.hybrid_route import HybridRouter
+from cherry_plugin.routing.query_analyzer import QueryAnalyzer
 from cherry_plugin.retriever.vector_db import VectorDB
+from cherry_plugin.retriever.index_rebuilder import IndexRebuilder
+from cherry_plugin.retriever.unified_index import UnifiedIndex, format_config, format_relationship, format_rule
 from cherry_plugin.retriever.sql_db import SqlDB
 from cherry_plugin.retriever.graph_db import GraphDB
+from cherry_plugin.retriever.entity_linker import EntityLinker
+from cherry_plugin.retriever.embedding_store import EmbeddingStore, model_slug
 from cherry_plugin.memory.memory_store import MemoryStore
 from cherry_plugin.prompt_template import PromptTemplate
 from cherry_plugin.cache import CacheManager
+from cherry_plugin.embedding_cache import EmbeddingCache
+from cherry_plugin.retrieved_item import RetrievedItem
+from cherry_plugin.telemetry import configure_logging, telemetry
+from cherry_plugin.diagnostics import Diagnostics
+from cherry_plugin.prefetcher import Prefetcher
+
+logger = logging.getLogger(__name__)
 
 class CherryContextPlugin:
-    def __init__(self):
+    def __init__(self, unified_retrieval=False, data_dir=None, prefetch=None):
+        # 数据目录（默认 cherry_plugin/data，基准测试等场景可指向独立目录）
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.data_dir = data_dir or os.path.join(base_dir, "cherry_plugin/data")
+        configure_logging()
+        
         # 初始化各个模块
         self.router = HybridRouter()
         self.vector_db = VectorDB()
-        self.sql_db = SqlDB()
+        # 先加载向量数据库：后台重建可能已切换过模型，其余组件须与其使用同一模型
+        self.vector_path = os.path.join(self.data_dir, "vector_db")
+        self.vector_db.load(self.vector_path)
+        self.sql_db = SqlDB(os.path.join(self.data_dir, "config.db"))
         # 使用绝对路径初始化图数据库
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        graph_path = os.path.join(base_dir, "cherry_plugin/data/graph_data.json")
+        graph_path = os.path.join(self.data_dir, "graph_data.json")
         self.graph_db = GraphDB(graph_path)
-        self.memory = MemoryStore()
+        # 词表驱动的查询分析，随SQL/图数据变更增量更新
+        self.query_analyzer = QueryAnalyzer(self.sql_db, self.graph_db)
+        # 共享VectorDB的编码器，缓存查询、句子和对话向量
+        self.encoder = EmbeddingCache(self.vector_db.model)
+        self.memory = MemoryStore(data_dir=self.data_dir, encoder=self.encoder)
+        # 节点名称向量索引：问题中的实体写错或换了说法时也能链接到图节点；
+        # 表面形式的向量按模型持久化，启动时只编码新增或变更的节点
+        self.entity_linker = EntityLinker(self.encoder, self.encoder.dimension, store=self._linker_store())
+        self.entity_linker.add_nodes(self.graph_db.nodes())
+        self.graph_db.add_listener(self.entity_linker.on_graph_change)
         self.prompt_template = PromptTemplate()
-        self.cache = CacheManager()
+        self.cache = CacheManager(os.path.join(self.data_dir, "cache"), data_dir=self.data_dir)
+        
+        self.rebuilder = IndexRebuilder(self.vector_db, self.vector_path)
         
-        # 加载向量数据库
-        vector_path = os.path.join(base_dir, "cherry_plugin/data/vector_db")
-        self.vector_db.load(vector_path)
+        # 统一索引（可选）：配置、规则、图关系与文档一起检索，不经过路由
+        self.unified_index = None
+        if unified_retrieval:
+            self.unified_index = UnifiedIndex(self.vector_db.model, self.vector_db.dimension,
+                                              os.path.join(self.data_dir, "unified_index"))
+            self.unified_index.load()
+            self.unified_index.sync(self.sql_db, self.graph_db)
+            self.sql_db.add_listener(self.unified_index.on_sql_change)
+            self.graph_db.add_listener(self.unified_index.on_graph_change)
+        
+        # 后台重建换了编码模型时，共享编码器和依赖它的索引一起切换（先于预取失效回调执行）
+        self.rebuilder.add_listener(self._on_index_swap)
+        
+        # 预测性预取：空闲时按会话历史和图邻居预取可能的追问（默认关闭，prefetch=True或CHERRY_PREFETCH=1开启）
+        if prefetch is None:
+            prefetch = os.environ.get("CHERRY_PREFETCH", "0") == "1"
+        self.prefetcher = Prefetcher(self, enabled=prefetch)
+        self.sql_db.add_listener(self.prefetcher.on_data_change)
+        self.graph_db.add_listener(self.prefetcher.on_data_change)
+        self.rebuilder.add_listener(self.prefetcher.on_data_change)
+        
+        # 诊断：内存报告、tracemalloc快照、请求profile（输出文件默认写到数据目录下）
+        self.diagnostics = Diagnostics(self, os.environ.get("CHERRY_DIAGNOSTICS_DIR")
+                                       or os.path.join(self.data_dir, "diagnostics"))
         
 
         
-        print("Cherry上下文插件初始化完成")
+        logger.info("Cherry上下文插件初始化完成")
+    
+    def _linker_store(self):
+        """当前模型对应的实体表面形式向量存储"""
+        return EmbeddingStore(
+            os.path.join(self.data_dir, "entity_embeddings", model_slug(self.vector_db.model_name)),
+            self.vector_db.model_name, self.encoder.dimension)
+    
+    def _on_index_swap(self, generation):
+        """索引切换回调：模型变化时重新指向新模型，清空向量缓存并按新模型重建记忆、实体和统一索引"""
+        model = self.vector_db.model
+        if model is self.encoder.model:
+            return
+        logger.info(f"编码模型已切换为 {self.vector_db.model_name}，重建依赖该模型的索引")
+        self.encoder.reset(model)
+        self.memory.reindex()
+        self.entity_linker.reset(self.encoder.dimension, self._linker_store())
+        self.entity_linker.add_nodes(self.graph_db.nodes())
+        if self.unified_index is not None:
+            self.unified_index.reset(model, self.vector_db.dimension)
+            self.unified_index.sync(self.sql_db, self.graph_db)
     
     def build_prompt(self, short_term, retrieved, long_term, user_question):
         """构建最终的prompt"""
@@ -53,43 +126,141 @@ class CherryContextPlugin:
         
         return "\n\n".join(prompt_parts)
     
-    def process_question(self, user_question):
-        """处理用户问题的主流程"""
-        print(f"\n=== 处理问题: {user_question} ===")
+    def process_question(self, user_question, session_id=None):
+        """处理用户问题的主流程（各阶段耗时记录在telemetry中）"""
+        self.prefetcher.begin()
+        try:
+            with telemetry.trace("process_question") as attributes:
+                result = self.diagnostics.profiler.call("process_question", self._process_question,
+                                                        user_question, session_id)
+                attributes['route'] = result['route']
+                attributes['retrieved'] = len(result['retrieved'])
+                attributes['prefetched'] = result['prefetched']
+                return result
+        finally:
+            self.prefetcher.finish()
+    
+    def _process_question(self, user_question, session_id=None):
+        logger.debug(f"=== 处理问题: {user_question} ===")
+        
+        # 1. 获取记忆（按与问题的相关性召回历史对话）
+        with telemetry.span("embed"):
+            query_embedding = self.encoder.encode_one(user_question)
+        with telemetry.span("memory"):
+            short_term = self.memory.get_relevant_context(query_embedding, max_turns=3, session_id=session_id)
+            long_term = self.memory.get_long_term_summary(session_id=session_id)
+        
+        # 2. 动态路由（启用统一索引时跳过路由，一次检索返回多源候选）
+        with telemetry.span("analyze"):
+            analysis = self.query_analyzer.analyze(user_question)
+        # 追问命中预取结果时直接复用其路由和检索结果
+        with telemetry.span("prefetch.lookup"):
+            prefetched = self.prefetcher.lookup(session_id, query_embedding, analysis)
+        if prefetched is not None:
+            route, scores, retrieved = prefetched
+        else:
+            if self.unified_index is not None:
+                route, scores = "unified", {}
+            else:
+                with telemetry.span("route"):
+                    route, scores = self.router.route(user_question, analysis=analysis)
+            logger.debug(f"路由结果: {route}")
+            
+            # 3. 检索相关信息
+            with telemetry.span(f"retrieve.{route}") as span:
+                retrieved = self._retrieve(user_question, route, analysis, query_embedding)
+                span['results'] = len(retrieved)
+        self.prefetcher.observe(session_id, user_question, analysis, query_embedding)
+        
+        # 4. 多模态融合与上下文压缩
+        from .optimization.multimodal_fusion import MultiModalFusion
+        from .optimization.context_compressor import ContextCompressor
+        
+        # 融合不同源的结果
+        with telemetry.span("fusion"):
+            fusion = MultiModalFusion(encoder=self.encoder)
+            vdb_items = [item for item in retrieved if item.source == "vdb"]
+            sql_items = [item for item in retrieved if item.source == "sql"]
+            graph_items = [item for item in retrieved if item.source == "graph"]
+            
+            fused_results = fusion.fuse_results(vdb_items, sql_items, graph_items, user_question)
         
-        # 1. 获取记忆
-        short_term = self.memory.get_short_term_context(max_turns=3)
-        long_term = self.memory.get_long_term_summary()
+        # 按token预算压缩上下文
+        with telemetry.span("compression"):
+            template_type = "with_memory" if short_term else "default"
+            budget = self.prompt_template.allocate_budget(
+                user_question, short_term, fused_results, long_term, template_type
+            )
+            format_overhead = self.prompt_template.format_overhead(fused_results)
+            compressor = ContextCompressor(max_tokens=max(budget['retrieved'] - format_overhead, 0),
+                                           encoder=self.encoder)
+            compressed_results = compressor.compress_context(fused_results, user_question)
         
-        # 2. 动态路由
-        route, scores = self.router.route(user_question)
-        print(f"路由结果: {route}")
+        # 5. 构建最终prompt（各部分按预算在条目/段落边界裁剪）
+        with telemetry.span("prompt"):
+            final_prompt = self.prompt_template.generate_budgeted_prompt(
+                user_question, short_term, compressed_results, long_term, template_type
+            )
         
-        # 3. 检索相关信息
+        # 更新retrieved为压缩后的结果
+        retrieved = compressed_results
+        
+        return {
+            "route": route,
+            "route_scores": scores,
+            "retrieved": retrieved,
+            "short_term": short_term,
+            "long_term": long_term,
+            "final_prompt": final_prompt,
+            "compression": compressor.last_stats,
+            "prefetched": prefetched is not None
+        }
+    
+    def _retrieve(self, user_question, route, analysis, query_embedding):
+        """按路由结果检索，返回RetrievedItem列表"""
         retrieved = []
         
-        if route == "vdb":
+        if route == "unified":
+            vdb_results = self.vector_db.search(user_question, k=3, use_rerank=True)
+            retrieved = [RetrievedItem(r['document'], "vdb", r['score'],
+                                       {'kind': 'document', 'reranked': bool(r.get('reranked'))})
+                        for r in vdb_results]
+            retrieved.extend(RetrievedItem(r['text'], r['source'], r['score'], {'kind': r['kind']})
+                             for r in self.unified_index.search(query_embedding, k=6))
+        
+        elif route == "vdb":
             # 向量检索（启用重排序）
             vdb_results = self.vector_db.search(user_question, k=3, use_rerank=True)
-            retrieved = [f"文档: {r['document']} (分数: {r['score']:.3f}{'*' if r.get('reranked') else ''})" 
+            retrieved = [RetrievedItem(r['document'], "vdb", r['score'],
+                                       {'kind': 'document', 'reranked': bool(r.get('reranked'))})
                         for r in vdb_results]
             
         elif route == "sql":
             # SQL检索
-            sql_results = self.sql_db.search(user_question, limit=3)
+            sql_results = self.sql_db.search(user_question, limit=3, analysis=analysis)
             for result in sql_results:
                 if result['type'] == 'config':
-                    retrieved.append(f"配置: {result['key']} = {result['value']} ({result['description']})")
+                    text = format_config(result)
                 else:
-                    retrieved.append(f"规则: {result['name']} - {result['condition']} -> {result['action']}")
+                    text = format_rule(result)
+                retrieved.append(RetrievedItem(text, "sql", result.get('score'), {'kind': result['type']}))
         
         elif route == "graph":
             # 图检索
-            cached_result = self.cache.get(user_question, "graph")
+            with telemetry.span("cache.get"):
+                cached_result = self.cache.get(user_question, "graph")
             if cached_result is not None and len(cached_result) > 0:
-                retrieved = cached_result
+                retrieved = [RetrievedItem.coerce(item, "graph") for item in cached_result]
             else:
-                graph_results = self.graph_db.search_relationships(user_question, limit=5)
+                # 问题精确命中节点ID时按词表匹配；否则先做实体链接，从链接到的节点出发遍历
+                linked = []
+                if not analysis.has("node"):
+                    with telemetry.span("entity_link"):
+                        linked = self.entity_linker.link(query_embedding)
+                if linked:
+                    graph_results = self.graph_db.relationships_from([node_id for node_id, _ in linked], limit=5)
+                else:
+                    graph_results = self.graph_db.search_relationships(user_question, limit=5, analysis=analysis)
                 # 去重处理
                 unique_results = []
                 seen = set()
@@ -99,62 +270,115 @@ class CherryContextPlugin:
                         seen.add(key)
                         unique_results.append(r)
                 
-                retrieved = [f"关系: {r['from']['id']}({r['from']['properties'].get('职位', '')}) -[{r['relationship']}]-> {r['to']['id']}({r['to']['properties'].get('职位', '')})" 
+                retrieved = [RetrievedItem(format_relationship(r['from'], r['relationship'], r['to']),
+                                           "graph", r.get('score'), {'kind': 'relationship'})
                            for r in unique_results[:3]]
                 if retrieved:
-                    self.cache.set(user_question, "graph", retrieved)
-        
-        # 4. 多模态融合与上下文压缩
-        from .optimization.multimodal_fusion import MultiModalFusion
-        from .optimization.context_compressor import ContextCompressor
-        
-        # 融合不同源的结果
-        fusion = MultiModalFusion()
-        vdb_items = retrieved if route == "vdb" else []
-        sql_items = retrieved if route == "sql" else []
-        graph_items = retrieved if route == "graph" else []
+                    self.cache.set(user_question, "graph", [item.to_dict() for item in retrieved])
         
-        fused_results = fusion.fuse_results(vdb_items, sql_items, graph_items, user_question)
-        
-        # 压缩上下文
-        compressor = ContextCompressor(max_tokens=1500)
-        compressed_results = compressor.compress_context(fused_results, user_question)
-        
-        # 5. 构建最终prompt
-        final_prompt = self.prompt_template.generate_prompt(
-            user_question, short_term, compressed_results, long_term, 
-            template_type="with_memory" if short_term else "default"
-        )
-        final_prompt = self.prompt_template.optimize_prompt_length(final_prompt)
-        
-        # 更新retrieved为压缩后的结果
-        retrieved = compressed_results
-        
-        return {
-            "route": route,
-            "route_scores": scores,
-            "retrieved": retrieved,
-            "short_term": short_term,
-            "long_term": long_term,
-            "final_prompt": final_prompt
+        return retrieved
+    
+    def stats(self, traces=10):
+        """遥测快照（各阶段延迟分位数、计数器、最近请求trace）及组件统计"""
+        snapshot = telemetry.snapshot(traces)
+        snapshot['components'] = {
+            'documents': len(self.vector_db),
+            'rerank': self.vector_db.rerank_stats(),
+            'embedding_cache': self.encoder.get_stats(),
+            'index_rebuild': dict(self.rebuilder.status),
+            'prefetch': self.prefetcher.get_stats(),
         }
+        return snapshot
+    
+    def warm_up(self):
+        """提前加载懒加载的组件（重排序模型）并各运行一次编码；
+        预派生多进程服务在fork前调用，使这些内存由各worker共享"""
+        self.vector_db.get_reranker()
+        self.router.embedding_route("warm up")
+        self.vector_db.model.encode(["warm up"])
+    
+    def after_fork(self, threads=None):
+        """预派生的worker进程启动时调用：重建不能跨fork使用的线程池、连接和锁；
+        threads限制每个worker的计算线程数，避免N个worker各自占满所有核"""
+        telemetry.after_fork()
+        self.vector_db.after_fork()
+        self.memory.after_fork()
+        self.prefetcher.after_fork()
+        if self.unified_index is not None:
+            self.unified_index.after_fork()
+        # 各worker的诊断输出（tracemalloc快照、profile）写到各自的子目录，互不覆盖
+        self.diagnostics = Diagnostics(self, os.path.join(self.diagnostics.output_dir, f"worker-{os.getpid()}"))
+        if threads:
+            import faiss
+            faiss.omp_set_num_threads(threads)
+            torch = sys.modules.get("torch")
+            if torch is not None:
+                torch.set_num_threads(threads)
+    
+    def apply_changes(self, changes):
+        """应用主进程已持久化的写操作，只更新本进程内存中的索引（不再保存）
+        
+        changes: [(kind, item)]，kind为documents / config / rule / node / relationship
+        """
+        for kind, item in changes:
+            if kind == "documents":
+                self.vector_db.add_documents(*item)
+                self.prefetcher.clear()
+            elif kind in ("config", "rule"):
+                self.sql_db.apply_change(kind, item)
+            else:
+                self.graph_db.apply_change(kind, item)
     
-    def add_conversation(self, user_input, assistant_response):
+    def add_conversation(self, user_input, assistant_response, session_id=None):
         """添加对话到记忆"""
-        self.memory.add_conversation(user_input, assistant_response)
+        self.memory.add_conversation(user_input, assistant_response, session_id=session_id)
     
-    def add_documents(self, documents):
-        """添加文档到向量数据库"""
-        self.vector_db.add_documents(documents)
-        self.vector_db.save("cherry_plugin/data/vector_db")
+    def add_documents(self, documents, metadata=None):
+        """添加文档到向量数据库（metadata可选，用于按类别/来源/时间过滤检索）"""
+        self.vector_db.add_documents(documents, metadata)
+        self.vector_db.save(self.vector_path)
+        self.prefetcher.clear()
+    
+    def rebuild_index(self, model_name=None, index_factory=None, wait=False):
+        """后台重建向量索引（可换模型或索引类型），查询不中断，校验通过后原子切换"""
+        started = self.rebuilder.start(model_name, index_factory)
+        if wait:
+            return self.rebuilder.wait()
+        return dict(self.rebuilder.status, started=started)
     
     def add_config(self, key, value, description="", category="general"):
         """添加配置到SQL数据库"""
         self.sql_db.add_config(key, value, description, category)
+    
+    def add_rule(self, name, condition, action, category="general"):
+        """添加规则到SQL数据库"""
+        self.sql_db.add_rule(name, condition, action, category)
+    
+    def add_relationship(self, from_id, to_id, relation_type, properties=None):
+        """添加关系到图数据库"""
+        self.graph_db.add_relationship(from_id, to_id, relation_type, properties)
+    
+    def close(self):
+        """等待并停止后台摘要任务，关闭记忆数据库连接，保存统一索引尚未写入的变更"""
+        self.memory.close()
+        if self.unified_index is not None:
+            self.unified_index.flush()
+
+_shared_plugin = None
+_shared_lock = threading.Lock()
+
+def get_shared_plugin():
+    """进程内共享的插件实例（模型、索引、缓存和记忆后台线程只创建一次）"""
+    global _shared_plugin
+    if _shared_plugin is None:
+        with _shared_lock:
+            if _shared_plugin is None:
+                _shared_plugin = CherryContextPlugin()
+    return _shared_plugin
 
 # Cherry Studio插件接口函数
 def cherry_pipeline(user_question):
     """Cherry Studio调用的主函数"""
-    plugin = CherryContextPlugin()
+    plugin = get_shared_plugin()
     result = plugin.process_question(user_question)
     return result["final_prompt"]
\ No newline at end of file
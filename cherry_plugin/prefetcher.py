@@ -0,0 +1,281 @@
+"""
+预测性预取模块：根据会话历史和刚提到的实体的图邻居预测可能的追问，
+在空闲时以低优先级、受CPU预算限制地提前完成路由和检索（同时预热文件缓存、向量缓存和图邻域），
+追问与预测语义相近且涉及的实体集合完全相同时直接复用预取结果（默认关闭），跳过路由和检索
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from .retrieved_item import RetrievedItem
+from .telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+# 实体类别 -> 预测追问模板
+TEMPLATES = {
+    'node': ("{value}和谁有关系", "{value}的{relation}"),
+    'config': ("{value}是多少",),
+    'rule': ("{value}规则是什么",),
+}
+
+
+def _entities(analysis):
+    """问题中命中的实体（节点、配置键、规则名），用于判断预取结果是否适用"""
+    return frozenset(analysis.values("node") | analysis.values("config") | analysis.values("rule"))
+
+
+class Prefetcher:
+    """按会话保存预取结果（问题向量、路由、检索结果），后台线程在请求间隙执行预测的查询
+
+    similarity: 追问与预取查询的最低余弦相似度
+    cpu_budget: 后台线程最多占用单核的时间比例（按墙钟时间计，包括等待I/O的时间）
+    idle_seconds: 最近一次请求结束后至少空闲多久才开始预取
+    """
+
+    def __init__(self, plugin, enabled=True, similarity=0.85, max_predictions=8, max_seeds=3, neighbours=3,
+                 history_size=5, history_decay=0.5, cpu_budget=0.25, idle_seconds=0.3, ttl_seconds=600,
+                 max_entries=512):
+        self.plugin = plugin
+        self.enabled = enabled
+        self.similarity = similarity
+        self.max_predictions = max_predictions
+        self.max_seeds = max_seeds
+        self.neighbours = neighbours
+        self.history_size = history_size
+        self.history_decay = history_decay
+        self.cpu_budget = cpu_budget
+        self.idle_seconds = idle_seconds
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.after_fork()
+
+    def after_fork(self):
+        """初始化（或在fork出的子进程中重置）状态；后台线程在第一次预测时才启动"""
+        self._entries = OrderedDict()  # (会话, 查询) -> 预取结果
+        self._history = {}  # 会话 -> deque[最近问题的实体 {(类别, 值)}]
+        self._tasks = OrderedDict()  # 会话 -> 最新一次的预测任务（旧任务被覆盖）
+        self._active = 0
+        self._last_request = 0.0
+        self._cond = threading.Condition(threading.Lock())
+        self._thread = None
+        self.stats = {'lookups': 0, 'hits': 0, 'predicted': 0, 'prefetched': 0, 'skipped': 0,
+                      'skipped_llm': 0, 'evicted': 0, 'evicted_unused': 0, 'errors': 0, 'cpu_seconds': 0.0}
+
+    # ---- 请求线程 ----
+
+    def begin(self):
+        """请求开始：后台预取让出CPU"""
+        with self._cond:
+            self._active += 1
+
+    def finish(self):
+        with self._cond:
+            self._active -= 1
+            self._last_request = time.monotonic()
+            self._cond.notify_all()
+
+    def lookup(self, session_id, query_embedding, analysis):
+        """查找与问题语义相近、实体相同的预取结果，返回 (路由, 路由分数, [RetrievedItem]) 或None"""
+        if not self.enabled:
+            return None
+        entities = _entities(analysis)
+        now = time.monotonic()
+        with self._cond:
+            candidates = [entry for (session, _), entry in self._entries.items()
+                          if session == session_id and now - entry['created'] <= self.ttl_seconds]
+            self.stats['lookups'] += 1
+        best = None
+        if candidates:
+            matrix = np.vstack([entry['embedding'] for entry in candidates])
+            scores = matrix @ np.asarray(query_embedding, dtype='float32')
+            for index in np.argsort(-scores):
+                if scores[index] < self.similarity:
+                    break
+                # 只复用实体集合完全相同的预取（相近的问法换了实体或去掉实体，答案都不同）
+                if candidates[index]['entities'] == entities:
+                    best = candidates[index]
+                    break
+        telemetry.incr("prefetch_lookups", result="hit" if best else "miss")
+        if best is None:
+            return None
+        with self._cond:
+            self.stats['hits'] += 1
+            best['hits'] += 1
+        return best['route'], best['scores'], [RetrievedItem.from_dict(item) for item in best['retrieved']]
+
+    def observe(self, session_id, question, analysis, query_embedding):
+        """记录本次问题的实体，并登记一次预测任务（同一会话只保留最新的任务）"""
+        if not self.enabled:
+            return
+        mentioned = {(kind, value) for kind in TEMPLATES for value in analysis.values(kind)}
+        with self._cond:
+            history = self._history.setdefault(session_id, deque(maxlen=self.history_size))
+            self._tasks.pop(session_id, None)
+            self._tasks[session_id] = (question, set(mentioned), query_embedding, list(history))
+            history.append(mentioned)
+            while len(self._history) > self.max_entries:
+                self._history.pop(next(iter(self._history)))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="prefetcher", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def clear(self):
+        """数据变更后丢弃全部预取结果"""
+        with self._cond:
+            self._entries.clear()
+
+    def on_data_change(self, *args):
+        """SQL/图数据变更、向量索引切换到新一代时的回调"""
+        self.clear()
+
+    # ---- 预测 ----
+
+    def predict(self, session_id, question, mentioned, query_embedding, history):
+        """预测可能的追问：本次及近几轮提到的实体（越近权重越高）及其图邻居，按权重套用模板"""
+        plugin = self.plugin
+        weights = {}
+        relations = {}
+
+        def add(entity, weight):
+            weights[entity] = max(weights.get(entity, 0.0), weight)
+
+        for entity in mentioned:
+            add(entity, 1.0)
+        for node_id, _ in plugin.entity_linker.link(query_embedding):
+            add(('node', node_id), 0.9)
+        # 会话历史：预取器记录的近几轮问题，以及记忆中的近几轮对话
+        for age, past in enumerate(reversed(history)):
+            for entity in past:
+                add(entity, self.history_decay ** (age + 1))
+        for age, turn in enumerate(reversed(plugin.memory.get_recent_turns(self.history_size, session_id))):
+            past = plugin.query_analyzer.analyze(turn['user'])
+            for kind in TEMPLATES:
+                for value in past.values(kind):
+                    add((kind, value), self.history_decay ** (age + 1))
+
+        # 图邻居：权重最高的几个节点各取若干相邻节点
+        seeds = sorted(((weight, value) for (kind, value), weight in weights.items() if kind == 'node'),
+                       reverse=True)[:self.max_seeds]
+        for weight, node_id in seeds:
+            for rank, rel in enumerate(plugin.graph_db.relationships_from([node_id], limit=self.neighbours)):
+                other = rel['to']['id'] if rel['from']['id'] == node_id else rel['from']['id']
+                relations.setdefault(other, rel['relationship'])
+                relations.setdefault(node_id, rel['relationship'])
+                add(('node', other), weight * 0.8 / (rank + 1))
+
+        queries = []
+        for (kind, value), weight in sorted(weights.items(), key=lambda item: -item[1]):
+            for template in TEMPLATES[kind]:
+                if "{relation}" in template and value not in relations:
+                    continue
+                query = template.format(value=value, relation=relations.get(value, ""))
+                if query != question:
+                    queries.append(query)
+        return queries[:self.max_predictions]
+
+    # ---- 后台线程 ----
+
+    def _wait_idle(self):
+        """等待没有进行中的请求且空闲足够久（调用方持有_cond）"""
+        while True:
+            idle = time.monotonic() - self._last_request
+            if self._active == 0 and idle >= self.idle_seconds:
+                return
+            self._cond.wait(timeout=max(self.idle_seconds - idle, 0.05))
+
+    def _run(self):
+        # 降低后台线程的调度优先级（Linux上nice值按线程生效）
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            with self._cond:
+                while not self._tasks:
+                    self._cond.wait()
+                session_id, task = self._tasks.popitem(last=False)
+            try:
+                with telemetry.muted():
+                    queries = self.predict(session_id, *task)
+            except Exception as e:
+                logger.warning(f"预测追问失败: {e}")
+                continue
+            with self._cond:
+                self.stats['predicted'] += len(queries)
+            for query in queries:
+                with self._cond:
+                    self._wait_idle()
+                    if session_id in self._tasks:
+                        break  # 会话有了更新的问题，按新的问题重新预测
+                    entry = self._entries.get((session_id, query))
+                    if entry is not None and time.monotonic() - entry['created'] <= self.ttl_seconds:
+                        self.stats['skipped'] += 1
+                        continue
+                self._prefetch(session_id, query)
+
+    def _prefetch(self, session_id, query):
+        """执行一次预测的查询并保存结果；之后按预算休眠。
+        需要LLM精筛路由的查询不预取：后台不占用Ollama，也不缓存与实际请求可能不同的路由"""
+        plugin = self.plugin
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            with telemetry.muted():
+                embedding = plugin.encoder.encode_one(query)
+                analysis = plugin.query_analyzer.analyze(query)
+                if plugin.unified_index is not None:
+                    route, scores = "unified", {}
+                else:
+                    route, scores, _ = plugin.router.plan(query, analysis=analysis)
+                if route is not None:
+                    retrieved = plugin._retrieve(query, route, analysis, embedding)
+        except Exception as e:
+            logger.warning(f"预取失败: {e}")
+            with self._cond:
+                self.stats['errors'] += 1
+            return
+        elapsed = time.perf_counter() - started
+        cpu = time.thread_time() - cpu_started
+        if route is None:
+            with self._cond:
+                self.stats['skipped_llm'] += 1
+                self.stats['cpu_seconds'] += cpu
+            self._throttle(elapsed)
+            return
+
+        entry = {'query': query, 'embedding': embedding, 'entities': _entities(analysis), 'route': route,
+                 'scores': scores, 'retrieved': [item.to_dict() for item in retrieved],
+                 'created': time.monotonic(), 'hits': 0}
+        with self._cond:
+            self._entries.pop((session_id, query), None)
+            self._entries[(session_id, query)] = entry
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.stats['evicted'] += 1
+                self.stats['evicted_unused'] += evicted['hits'] == 0
+            self.stats['prefetched'] += 1
+            self.stats['cpu_seconds'] += cpu
+        telemetry.incr("prefetch_queries", route=route)
+        telemetry.observe("prefetch_seconds", elapsed)
+        logger.debug(f"已预取: {query} -> {route}")
+        self._throttle(elapsed)
+
+    def _throttle(self, elapsed):
+        """按预算休眠：用墙钟耗时而不是线程CPU时间计算，编码、检索中等待锁或I/O的时间同样计入"""
+        if self.cpu_budget < 1:
+            time.sleep(elapsed * (1 - self.cpu_budget) / max(self.cpu_budget, 0.01))
+
+    def get_stats(self):
+        """预取命中率等统计：hit_rate为请求命中预取结果的比例，
+        unused_rate为被淘汰的预取结果中从未被命中的比例（预测准确度）"""
+        with self._cond:
+            stats = dict(self.stats, entries=len(self._entries), enabled=self.enabled)
+        stats['hit_rate'] = stats['hits'] / stats['lookups'] if stats['lookups'] else 0.0
+        stats['unused_rate'] = stats['evicted_unused'] / stats['evicted'] if stats['evicted'] else None
+        stats['cpu_seconds'] = round(stats['cpu_seconds'], 4)
+        return stats
@@ -0,0 +1,313 @@
+"""
+预派生（pre-fork）多进程服务：主进程加载模型和只读索引后fork出N个worker进程，
+各worker以写时复制方式共享这些内存页，查询分发到各worker并行执行，不受单进程GIL限制。
+
+- 读请求（process_question）按会话ID固定分配到同一个worker（会话记忆索引留在该worker内），
+  没有会话ID时分给待处理请求最少的worker
+- 写请求（add_documents / add_config / add_rule / add_relationship）由主进程串行执行并持久化，
+  再把变更广播给各worker只更新内存，全部确认后才返回
+- worker意外退出时由主进程的监督线程重新fork一个（读取线程只负责通知），新worker继承主进程的最新状态
+
+仅支持提供fork的平台（Linux/macOS）
+"""
+import gc
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+import zlib
+from concurrent.futures import Future, wait
+
+from .telemetry import Telemetry, telemetry
+
+logger = logging.getLogger(__name__)
+
+# 主进程执行并广播的写操作
+WRITE_METHODS = ("add_documents", "add_config", "add_rule", "add_relationship")
+
+
+def _worker_stats(plugin):
+    return {'pid': os.getpid(), 'telemetry': telemetry.export(), 'components': plugin.stats(0)['components']}
+
+
+def _worker_diagnostics(plugin, action="memory", **arguments):
+    return plugin.diagnostics.run(action, **arguments)
+
+
+# worker可执行的操作：名称 -> function(plugin, *args, **kwargs)
+WORKER_CALLS = {
+    'process_question': lambda plugin, question, session_id=None: plugin.process_question(question, session_id),
+    'add_conversation': lambda plugin, user_input, response, session_id=None:
+        plugin.add_conversation(user_input, response, session_id),
+    'apply_changes': lambda plugin, changes: plugin.apply_changes(changes),
+    'stats': _worker_stats,
+    'diagnostics': _worker_diagnostics,
+}
+
+
+def fork_supported():
+    return hasattr(os, "fork") and "fork" in multiprocessing.get_all_start_methods()
+
+
+def _serve(plugin, conn, threads, inherited):
+    """worker主循环：逐个接收 (请求ID, 操作, args, kwargs)，返回 (请求ID, 是否成功, 结果或错误)"""
+    # 关闭继承来的其他管道端，主进程退出时本worker才能读到EOF
+    for other in inherited:
+        other.close()
+    plugin.after_fork(threads)
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        request_id, method, args, kwargs = message
+        try:
+            reply = (request_id, True, WORKER_CALLS[method](plugin, *args, **kwargs))
+        except Exception as e:
+            reply = (request_id, False, f"{type(e).__name__}: {e}\n{traceback.format_exc()}")
+        try:
+            conn.send(reply)
+        except (EOFError, OSError):
+            break
+        except Exception as e:  # 结果无法pickle
+            conn.send((request_id, False, f"{type(e).__name__}: {e}"))
+    plugin.memory.flush(timeout=5)
+
+
+class _Worker:
+    """主进程侧的worker句柄：发送请求、由读取线程按请求ID完成对应的Future"""
+
+    def __init__(self, index, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.pending = {}  # 请求ID -> Future
+        self.completed = 0
+        self.started = time.monotonic()
+        self._send_lock = threading.Lock()
+        self.reader = None
+
+    def send(self, request_id, method, args, kwargs):
+        future = Future()
+        with self._send_lock:
+            self.pending[request_id] = future
+            try:
+                self.conn.send((request_id, method, args, kwargs))
+            except (OSError, ValueError) as e:
+                self.pending.pop(request_id, None)
+                future.set_exception(RuntimeError(f"worker {self.index} 不可用: {e}"))
+        return future
+
+    def fail_pending(self, message):
+        with self._send_lock:
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError(message))
+
+
+class PreforkPool:
+    """主进程持有一个已预热的插件实例，fork出workers个子进程分担请求
+
+    mmap_shards: fork前把全部向量分片按内存映射方式重新加载（只读，页面由操作系统页缓存共享，
+    新写入的文档进入新的常驻分片）
+    threads_per_worker: 每个worker的FAISS/torch计算线程数
+    """
+
+    def __init__(self, plugin, workers=None, threads_per_worker=1, mmap_shards=False):
+        if not fork_supported():
+            raise RuntimeError("当前平台不支持fork，无法使用预派生多进程模式")
+        self.plugin = plugin
+        self.size = max(1, workers or os.cpu_count() or 1)
+        self.threads_per_worker = threads_per_worker
+        self.mmap_shards = mmap_shards
+        self.workers = []
+        self.restarts = 0
+        self._ids = itertools.count()
+        self._context = multiprocessing.get_context("fork")
+        self._write_lock = threading.Lock()  # 写操作与fork互斥，fork时主进程状态一致
+        self._closing = False
+        self._exited = queue.Queue()  # 读取线程发现已退出的worker，由监督线程重新fork
+        self._supervisor = None
+        self._pid = os.getpid()
+        self._changes = []
+        # 记录主进程写操作产生的变更，写完后广播给worker；worker继承的监听器按进程号忽略
+        plugin.sql_db.add_listener(self._capture_sql)
+        plugin.graph_db.add_listener(self._capture_graph)
+
+    def _capture_sql(self, kind, row):
+        if os.getpid() == self._pid:
+            self._changes.append((kind, row))
+
+    def _capture_graph(self, kind, item, graph_db):
+        if os.getpid() == self._pid:
+            self._changes.append((kind, item))
+
+    def start(self):
+        """预热并fork全部worker"""
+        if self.mmap_shards:
+            self.plugin.vector_db.load(self.plugin.vector_path,
+                                       cold_shards={shard.name for shard in self.plugin.vector_db.shards})
+        self.plugin.warm_up()
+        with self._write_lock:
+            for index in range(self.size):
+                self.workers.append(self._spawn(index))
+        self._supervisor = threading.Thread(target=self._supervise, name="cherry-prefork-supervisor", daemon=True)
+        self._supervisor.start()
+        logger.info(f"预派生多进程服务已启动: {self.size} 个worker，每个 {self.threads_per_worker} 个计算线程")
+        return self
+
+    def _spawn(self, index):
+        """fork一个worker（调用方持有写锁）。fork前冻结GC，已有对象移入永久代，
+        子进程的垃圾回收不再遍历它们，避免仅因引用计数/GC标记就复制共享页"""
+        parent_conn, child_conn = self._context.Pipe()
+        gc.collect()
+        gc.freeze()
+        try:
+            inherited = [parent_conn] + [worker.conn for worker in self.workers]
+            process = self._context.Process(target=_serve,
+                                            args=(self.plugin, child_conn, self.threads_per_worker, inherited),
+                                            name=f"cherry-worker-{index}", daemon=True)
+            process.start()
+        finally:
+            gc.unfreeze()
+        child_conn.close()
+        worker = _Worker(index, process, parent_conn)
+        worker.reader = threading.Thread(target=self._read, args=(worker,), name=f"cherry-worker-{index}-reader",
+                                         daemon=True)
+        worker.reader.start()
+        return worker
+
+    def _read(self, worker):
+        while True:
+            try:
+                request_id, ok, payload = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            with worker._send_lock:
+                future = worker.pending.pop(request_id, None)
+            worker.completed += 1
+            if future is None or future.done():
+                continue
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+        worker.fail_pending(f"worker {worker.index} 已退出")
+        if not self._closing:
+            self._exited.put(worker)
+
+    def _supervise(self):
+        """监督循环：所有重新fork都在这一个线程中串行进行，不在各worker的读取线程里fork"""
+        while True:
+            worker = self._exited.get()
+            if worker is None or self._closing:
+                break
+            try:
+                self._respawn(worker)
+            except Exception as e:
+                logger.error(f"重新fork worker {worker.index} 失败: {e}")
+
+    def _respawn(self, worker):
+        worker.process.join(timeout=5)
+        logger.warning(f"worker {worker.index} (pid {worker.process.pid}) 退出，退出码 "
+                       f"{worker.process.exitcode}，重新fork")
+        if time.monotonic() - worker.started < 1.0:
+            time.sleep(1.0)  # 启动即退出时限制重启频率
+        with self._write_lock:
+            if self._closing:
+                return
+            self.workers[worker.index] = self._spawn(worker.index)
+            self.restarts += 1
+
+    def _pick(self, session_id):
+        workers = self.workers
+        if session_id is not None:
+            return workers[zlib.crc32(str(session_id).encode('utf-8')) % len(workers)]
+        return min(workers, key=lambda worker: len(worker.pending))
+
+    def submit(self, method, *args, session_id=None, **kwargs):
+        """提交一个操作，返回concurrent.futures.Future；写操作在调用线程中同步执行后返回已完成的Future"""
+        if method in WRITE_METHODS:
+            future = Future()
+            try:
+                future.set_result(self.write(method, *args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        if method not in WORKER_CALLS:
+            raise ValueError(f"Unknown worker method: {method}")
+        return self._pick(session_id).send(next(self._ids), method, args, kwargs)
+
+    def process_question(self, user_question, session_id=None):
+        return self.submit("process_question", user_question, session_id, session_id=session_id).result()
+
+    def add_conversation(self, user_input, assistant_response, session_id=None):
+        return self.submit("add_conversation", user_input, assistant_response, session_id,
+                           session_id=session_id).result()
+
+    def broadcast(self, method, *args, **kwargs):
+        """在每个worker上执行一次，按worker顺序返回结果"""
+        futures = [worker.send(next(self._ids), method, args, kwargs) for worker in list(self.workers)]
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def write(self, method, *args, **kwargs):
+        """主进程执行写操作并持久化，再广播给全部worker更新内存；写操作之间串行"""
+        if method not in WRITE_METHODS:
+            raise ValueError(f"Unknown write method: {method}")
+        with self._write_lock:
+            self._changes = []
+            result = getattr(self.plugin, method)(*args, **kwargs)
+            changes = self._changes
+            self._changes = []
+            if method == "add_documents":
+                documents = kwargs.get('documents', args[0] if args else None)
+                metadata = kwargs.get('metadata', args[1] if len(args) > 1 else None)
+                changes.append(("documents", (documents, metadata)))
+            if changes:
+                self.broadcast("apply_changes", changes)
+        telemetry.incr("prefork_writes", method=method)
+        return result
+
+    def telemetry(self):
+        """汇总各worker的遥测数据"""
+        merged = Telemetry()
+        for stats in self.broadcast("stats"):
+            merged.merge(stats['telemetry'])
+        return merged
+
+    def stats(self, traces=10):
+        """汇总的遥测快照，附各worker的进程号、待处理请求数和组件统计"""
+        merged = Telemetry()
+        workers = []
+        for worker, stats in zip(list(self.workers), self.broadcast("stats")):
+            merged.merge(stats['telemetry'])
+            workers.append({'index': worker.index, 'pid': stats['pid'], 'pending': len(worker.pending),
+                            'completed': worker.completed, 'components': stats['components']})
+        snapshot = merged.snapshot(traces)
+        snapshot['prefork'] = {'workers': workers, 'restarts': self.restarts,
+                               'threads_per_worker': self.threads_per_worker}
+        return snapshot
+
+    def close(self, timeout=10):
+        """通知各worker退出并等待结束"""
+        self._closing = True
+        self._exited.put(None)
+        for worker in self.workers:
+            try:
+                with worker._send_lock:
+                    worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for worker in self.workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.conn.close()
@@ -1,9 +1,13 @@
 """
 提示模板模块：动态prompt生成和优化
 """
+from .optimization.token_budget import TokenBudget
+from .retrieved_item import RetrievedItem
 
 class PromptTemplate:
-    def __init__(self):
+    def __init__(self, budget=None):
+        self.budget = budget or TokenBudget()
+        self.counter = self.budget.counter
         self.templates = {
             "default": """系统指令: 你是智能中文助手。
 
@@ -29,6 +33,29 @@ class PromptTemplate:
 请提供详细的技术解答。"""
         }
     
+    def format_item(self, item):
+        """将检索项格式化为prompt中的一行（格式化只在此处进行）"""
+        if not isinstance(item, RetrievedItem):
+            return str(item)
+        
+        metadata = item.metadata or {}
+        kind = metadata.get('kind')
+        if item.source == "vdb":
+            if item.score is None:
+                return f"文档: {item.text}"
+            marker = '*' if metadata.get('reranked') else ''
+            return f"文档: {item.text} (分数: {item.score:.3f}{marker})"
+        if item.source == "sql":
+            return f"{'规则' if kind == 'rule' else '配置'}: {item.text}"
+        if item.source == "graph":
+            return f"关系: {item.text}"
+        return item.text
+    
+    def format_overhead(self, items):
+        """格式化带来的额外token数（含换行）"""
+        return sum(self.counter.count(self.format_item(item)) - self.counter.count(str(item)) + 1
+                   for item in items)
+    
     def build_context_sections(self, short_term=None, retrieved=None, long_term=None):
         """构建上下文部分"""
         sections = []
@@ -38,9 +65,9 @@ class PromptTemplate:
         
         if retrieved:
             if isinstance(retrieved, list):
-                retrieved_text = "\n".join([str(item) for item in retrieved])
+                retrieved_text = "\n".join([self.format_item(item) for item in retrieved])
             else:
-                retrieved_text = str(retrieved)
+                retrieved_text = self.format_item(retrieved)
             sections.append(f"相关知识检索结果:\n{retrieved_text}")
         
         if long_term and long_term != "暂无历史对话摘要":
@@ -60,12 +87,49 @@ class PromptTemplate:
             user_question=user_question
         )
     
-    def optimize_prompt_length(self, prompt, max_length=4000):
-        """优化prompt长度"""
-        if len(prompt) <= max_length:
+    def _budget_inputs(self, short_term, retrieved, long_term, template_type):
+        """整理预算计算所需的系统指令、各部分内容和标题开销"""
+        template = self.templates.get(template_type, self.templates["default"])
+        system = template.format(context_sections="", user_question="")
+        # 各部分标题和分隔符的开销
+        overhead = self.counter.count("短期对话记忆:\n相关知识检索结果:\n长期摘要:\n") + 6
+
+        if long_term == "暂无历史对话摘要":
+            long_term = None
+        if retrieved is not None and not isinstance(retrieved, list):
+            retrieved = [retrieved]
+        return system, short_term, retrieved, long_term, overhead
+
+    def allocate_budget(self, user_question, short_term=None, retrieved=None,
+                        long_term=None, template_type="default"):
+        """计算各部分的token预算"""
+        system, short_term, retrieved, long_term, overhead = self._budget_inputs(
+            short_term, retrieved, long_term, template_type)
+        return self.budget.allocate(system, user_question, short_term, retrieved, long_term,
+                                    overhead, self.format_item)
+
+    def generate_budgeted_prompt(self, user_question, short_term=None, retrieved=None,
+                                 long_term=None, template_type="default"):
+        """按token预算裁剪各部分后生成prompt"""
+        system, short_term, retrieved, long_term, overhead = self._budget_inputs(
+            short_term, retrieved, long_term, template_type)
+
+        fitted = self.budget.fit(system, user_question, short_term, retrieved, long_term,
+                                 overhead, self.format_item)
+        prompt = self.generate_prompt(
+            fitted['question'], fitted['short_term'], fitted['retrieved'],
+            fitted['long_term'], template_type
+        )
+        return self.optimize_prompt_length(prompt)
+
+    def optimize_prompt_length(self, prompt, max_tokens=None):
+        """优化prompt长度（按token计算）"""
+        if max_tokens is None:
+            max_tokens = self.budget.prompt_limit
+        if self.counter.count(prompt) <= max_tokens:
             return prompt
         
-        # 简单的截断策略：保留系统指令和用户问题，压缩中间内容
+        # 保留系统指令和用户问题，按段落边界压缩中间内容
         lines = prompt.split('\n')
         system_lines = []
         user_question_lines = []
@@ -83,15 +147,12 @@ class PromptTemplate:
             else:
                 context_lines.append(line)
         
-        # 保留系统指令和用户问题，压缩上下文
         essential_text = '\n'.join(system_lines + user_question_lines)
-        remaining_length = max_length - len(essential_text) - 100  # 留一些缓冲
+        remaining_tokens = max_tokens - self.counter.count(essential_text) - 10  # 留一些缓冲
         
-        if remaining_length > 0:
-            context_text = '\n'.join(context_lines)
-            if len(context_text) > remaining_length:
-                context_text = context_text[:remaining_length] + "...(内容已截断)"
-            
+        if remaining_tokens > 0:
+            context_text = self.budget.trim_lines('\n'.join(context_lines), remaining_tokens,
+                                                  keep_recent=False)
             return '\n'.join(system_lines + [context_text] + user_question_lines)
         else:
-            return essential_text
\ No newline at end of file
+            return self.counter.truncate(essential_text, max_tokens)
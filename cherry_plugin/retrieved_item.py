@@ -0,0 +1,99 @@
+"""
+检索结果模块：在融合、压缩、缓存和prompt构建之间共享的检索项表示
+"""
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional
+
+from .optimization.token_budget import get_token_counter
+
+_WORD_PATTERN = re.compile(r'[a-z0-9_]+')
+_CJK_RUN_PATTERN = re.compile(r'[一-鿿]+')
+
+
+@lru_cache(maxsize=4096)
+def extract_keywords(text: str) -> FrozenSet[str]:
+    """中英文关键词集合：英文按单词，中文按字符二元组（避免整句被当成一个词）"""
+    lowered = text.lower()
+    keywords = set(_WORD_PATTERN.findall(lowered))
+    for run in _CJK_RUN_PATTERN.findall(lowered):
+        if len(run) == 1:
+            keywords.add(run)
+        else:
+            keywords.update(run[i:i + 2] for i in range(len(run) - 1))
+    return frozenset(keywords)
+
+
+class RetrievedItem:
+    """单个检索结果：文本、来源、原始检索分数，token数/关键词/向量按需计算一次"""
+
+    __slots__ = ('text', 'source', 'score', 'metadata', 'fusion_score',
+                 'embedding', '_tokens', '_keywords')
+
+    def __init__(self, text: str, source: str = "vdb", score: Optional[float] = None,
+                 metadata: Optional[Dict] = None):
+        self.text = text
+        self.source = source
+        self.score = score
+        self.metadata = metadata
+        self.fusion_score = None
+        self.embedding = None
+        self._tokens = None
+        self._keywords = None
+
+    @property
+    def token_count(self) -> int:
+        """token数（首次访问时计算）"""
+        if self._tokens is None:
+            self._tokens = get_token_counter().count(self.text)
+        return self._tokens
+
+    @property
+    def keywords(self) -> FrozenSet[str]:
+        """关键词集合（首次访问时计算）"""
+        if self._keywords is None:
+            self._keywords = extract_keywords(self.text)
+        return self._keywords
+
+    def derive(self, text: str) -> "RetrievedItem":
+        """基于新文本（如压缩后的内容）派生检索项，保留来源和分数"""
+        return RetrievedItem(text, self.source, self.score, self.metadata)
+
+    def to_dict(self) -> Dict:
+        """转换为可JSON序列化的字典（用于缓存）"""
+        return {
+            'text': self.text,
+            'source': self.source,
+            'score': self.score,
+            'metadata': self.metadata
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RetrievedItem":
+        """从字典恢复"""
+        return cls(data['text'], data.get('source', 'vdb'), data.get('score'), data.get('metadata'))
+
+    @classmethod
+    def coerce(cls, item, source: str = "vdb") -> "RetrievedItem":
+        """将字符串、字典或检索项统一转换为检索项"""
+        if isinstance(item, cls):
+            return item
+        if isinstance(item, dict):
+            return cls.from_dict(item)
+        return cls(str(item), source)
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f"RetrievedItem(source={self.source!r}, score={self.score!r}, text={self.text[:30]!r})"
+
+
+def ensure_embeddings(items: List[RetrievedItem], encoder) -> None:
+    """为缺少向量的检索项一次性批量编码"""
+    missing = [item for item in items if item.embedding is None]
+    if not missing:
+        return
+    embeddings = encoder.encode([item.text for item in missing])
+    for item, embedding in zip(missing, embeddings):
+        item.embedding = embedding
@@ -0,0 +1,171 @@
+"""
+BM25稀疏检索模块：中文字符n-gram分词 + 数组化倒排表
+"""
+import re
+from collections import Counter
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from ..persistence import atomic_write
+
+_WORD_PATTERN = re.compile(r'[a-z0-9_]+|[一-鿿]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """英文/数字/标识符按完整单词（含下划线拆分后的部分），中文按单字和二元组"""
+    tokens = []
+    for run in _WORD_PATTERN.findall(text.lower()):
+        if '一' <= run[0] <= '鿿':
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+            if '_' in run:
+                tokens.extend(part for part in run.split('_') if part)
+    return tokens
+
+
+class BM25Index:
+    """BM25倒排索引：倒排表以CSR数组存储（offsets/doc_ids/tfs）。
+
+    新增文档的倒排先写入按词项排序的增量段（delta），检索时同时查主段和增量段；
+    增量段超过主段的compact_ratio（且不少于min_delta条）时才合并进CSR，
+    避免每次新增都对全部倒排重新排序。
+
+    add_documents/compact修改索引，调用方需独占访问（VectorShard在写锁下调用）；
+    search/save只读，可在读锁下并发执行"""
+
+    def __init__(self, k1=1.5, b=0.75, compact_ratio=0.1, min_delta=4096):
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = compact_ratio
+        self.min_delta = min_delta
+        self.vocab = {}
+        self.doc_lengths = np.zeros(0, dtype=np.int32)
+
+        # CSR倒排表：词项t的倒排为 doc_ids[offsets[t]:offsets[t+1]]
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.float32)
+
+        # 增量段：按词项ID排序的 (词项, 文档, 词频)
+        self.delta_terms = np.zeros(0, dtype=np.int64)
+        self.delta_doc_ids = np.zeros(0, dtype=np.int32)
+        self.delta_tfs = np.zeros(0, dtype=np.float32)
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_lengths)
+
+    def add_documents(self, texts: List[str]) -> None:
+        """添加文档（文档ID按添加顺序连续编号，与向量索引保持一致）"""
+        start = self.num_docs
+        lengths = np.zeros(len(texts), dtype=np.int32)
+        term_ids, doc_ids, tfs = [], [], []
+        for offset, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[offset] = sum(counts.values())
+            for term, tf in counts.items():
+                term_id = self.vocab.setdefault(term, len(self.vocab))
+                term_ids.append(term_id)
+                doc_ids.append(start + offset)
+                tfs.append(tf)
+
+        term_ids = np.concatenate([self.delta_terms, np.array(term_ids, dtype=np.int64)])
+        doc_ids = np.concatenate([self.delta_doc_ids, np.array(doc_ids, dtype=np.int32)])
+        tfs = np.concatenate([self.delta_tfs, np.array(tfs, dtype=np.float32)])
+        order = np.argsort(term_ids, kind='stable')
+        self.delta_terms, self.delta_doc_ids, self.delta_tfs = term_ids[order], doc_ids[order], tfs[order]
+        self.doc_lengths = np.concatenate([self.doc_lengths, lengths])
+        if len(self.delta_terms) >= max(self.min_delta, self.compact_ratio * len(self.doc_ids)):
+            self.compact()
+
+    def _compacted(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """主段与增量段合并后的CSR数组（不修改索引）"""
+        existing_terms = np.repeat(np.arange(len(self.offsets) - 1, dtype=np.int64),
+                                   np.diff(self.offsets))
+        term_ids = np.concatenate([existing_terms, self.delta_terms])
+        doc_ids = np.concatenate([self.doc_ids, self.delta_doc_ids])
+        tfs = np.concatenate([self.tfs, self.delta_tfs])
+
+        order = np.argsort(term_ids, kind='stable')
+        counts = np.bincount(term_ids, minlength=len(self.vocab))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return offsets, doc_ids[order], tfs[order]
+
+    def compact(self) -> None:
+        """将增量段合并进CSR数组（新数组构建完成后再整体替换）"""
+        if len(self.delta_terms) == 0:
+            return
+        self.offsets, self.doc_ids, self.tfs = self._compacted()
+        self.delta_terms = np.zeros(0, dtype=np.int64)
+        self.delta_doc_ids = np.zeros(0, dtype=np.int32)
+        self.delta_tfs = np.zeros(0, dtype=np.float32)
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """词项在主段和增量段中的 (文档, 词频)"""
+        docs, tf = self.doc_ids[:0], self.tfs[:0]
+        if term_id + 1 < len(self.offsets):
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs, tf = self.doc_ids[start:end], self.tfs[start:end]
+        start, end = np.searchsorted(self.delta_terms, [term_id, term_id + 1])
+        if start < end:
+            docs = np.concatenate([docs, self.delta_doc_ids[start:end]])
+            tf = np.concatenate([tf, self.delta_tfs[start:end]])
+        return docs, tf
+
+    def search(self, query: str, k: int = 10,
+               mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 (doc_ids, scores)，按分数降序；mask为可选的文档布尔过滤掩码"""
+        n = self.num_docs
+        if n == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        avg_length = max(float(self.doc_lengths.mean()), 1.0)
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / avg_length)
+        scores = np.zeros(n, dtype=np.float32)
+
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            docs, tf = self._postings(term_id)
+            df = len(docs)
+            if df == 0:
+                continue
+            idf = np.log(1 + (n - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm[docs])
+
+        if mask is not None:
+            scores[~mask[:n]] = 0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        order = np.argsort(-scores[candidates], kind='stable')
+        return candidates[order].astype(np.int64), scores[candidates[order]]
+
+    def save(self, path: str) -> None:
+        """保存为npz（原子写入；增量段合并后写出，不修改内存中的索引）"""
+        terms = np.array(sorted(self.vocab, key=self.vocab.get), dtype=object)
+        offsets, doc_ids, tfs = self.offsets, self.doc_ids, self.tfs
+        if len(self.delta_terms):
+            offsets, doc_ids, tfs = self._compacted()
+        atomic_write(path, lambda f: np.savez(
+            f, terms=terms.astype(str), doc_lengths=self.doc_lengths,
+            offsets=offsets, doc_ids=doc_ids, tfs=tfs,
+            params=np.array([self.k1, self.b])
+        ), mode='wb')
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """从npz加载"""
+        with np.load(path) as data:
+            k1, b = data['params'].tolist()
+            index = cls(k1, b)
+            index.vocab = {term: i for i, term in enumerate(data['terms'].tolist())}
+            index.doc_lengths = data['doc_lengths']
+            index.offsets = data['offsets']
+            index.doc_ids = data['doc_ids']
+            index.tfs = data['tfs']
+        return index
@@ -0,0 +1,208 @@
+"""
+向量持久化模块：按模型保存文档原始向量，重建索引时直接读取，只编码新增或变更的文档
+"""
+import hashlib
+import json
+import os
+import re
+from contextlib import nullcontext
+
+import numpy as np
+
+from ..diagnostics import directory_size
+from ..persistence import RWLock, atomic_write, atomic_write_json, read_locked, write_locked
+
+
+def content_hash(text: str) -> str:
+    """文档内容哈希（文档没有独立ID，内容哈希即文档键；内容变更即视为新文档）"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def model_slug(model_name: str) -> str:
+    """模型名转为可用作目录名的字符串"""
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', model_name)
+
+
+class EmbeddingStore:
+    """按段存储的向量矩阵：每次追加写一个新的 .npy 段，读取时内存映射
+
+    目录结构: manifest.json（版本号、段列表）+ seg_<n>.npy（向量）+ seg_<n>.keys.npy（内容哈希）
+    dtype: "float32" / "float16"（占用减半）/ "int8"（按行对称标量量化，占用约四分之一，
+    额外保存 seg_<n>.scales.npy）
+    """
+
+    def __init__(self, directory, model_name, dimension, dtype="float16", max_segments=16):
+        if dtype not in ("float32", "float16", "int8"):
+            raise ValueError(f"不支持的向量存储类型: {dtype}")
+        self.directory = directory
+        self.model_name = model_name
+        self.dimension = dimension
+        self.dtype = dtype
+        self.max_segments = max_segments  # 段数超过后合并为一段
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.version = 0
+        self.segments = []  # [{'name', 'rows'}]
+        self._vectors = []  # 与segments对应的内存映射矩阵
+        self._scales = []
+        self._positions = {}  # 内容哈希 -> (段序号, 行号)
+        self._mtime = None
+        self._lock = RWLock()
+        self._load()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _load(self, locked=False):
+        """读取清单并内存映射各段（清单未变化时跳过；locked表示调用方已持有跨进程写锁）"""
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+
+        with nullcontext() if locked else read_locked(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest['model_name'] != self.model_name or manifest['dimension'] != self.dimension:
+                raise ValueError(f"向量存储 {self.directory} 与模型 {self.model_name} 不匹配")
+            self.dtype = manifest['dtype']
+            vectors, scales, positions = [], [], {}
+            for number, segment in enumerate(manifest['segments']):
+                prefix = os.path.join(self.directory, segment['name'])
+                vectors.append(np.load(f"{prefix}.npy", mmap_mode='r'))
+                scales.append(np.load(f"{prefix}.scales.npy") if self.dtype == "int8" else None)
+                for row, key in enumerate(np.load(f"{prefix}.keys.npy").tolist()):
+                    positions[key] = (number, row)
+
+        self.version = manifest['version']
+        self.segments = manifest['segments']
+        self._vectors, self._scales, self._positions = vectors, scales, positions
+        self._mtime = mtime
+
+    def _quantize(self, embeddings):
+        if self.dtype == "int8":
+            scales = np.abs(embeddings).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            return np.round(embeddings / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return embeddings.astype(self.dtype), None
+
+    def _dequantize(self, segment, rows):
+        vectors = np.asarray(self._vectors[segment][rows], dtype=np.float32)
+        if self._scales[segment] is not None:
+            vectors *= self._scales[segment][rows][:, None]
+        return vectors
+
+    def memory_stats(self):
+        """存储的向量行数、精度和映射文件总大小（字节）"""
+        with self._lock.read_lock():
+            rows = sum(segment['rows'] for segment in self.segments)
+        return {'rows': rows, 'dtype': self.dtype, 'mapped_bytes': directory_size(self.directory)}
+
+    def get(self, keys):
+        """按内容哈希读取向量（float32，已归一化）；返回 (矩阵, 是否命中的布尔数组)"""
+        with self._lock.read_lock():
+            found = np.array([key in self._positions for key in keys], dtype=bool)
+            result = np.zeros((len(keys), self.dimension), dtype=np.float32)
+            by_segment = {}
+            for i, key in enumerate(keys):
+                position = self._positions.get(key)
+                if position is not None:
+                    by_segment.setdefault(position[0], []).append((i, position[1]))
+            for segment, pairs in by_segment.items():
+                targets, rows = zip(*pairs)
+                result[list(targets)] = self._dequantize(segment, list(rows))
+
+        # 低精度存储会带来微小误差，重新归一化保证内积即余弦相似度
+        norms = np.linalg.norm(result, axis=1, keepdims=True)
+        np.divide(result, norms, out=result, where=norms > 0)
+        return result, found
+
+    def add(self, keys, embeddings):
+        """追加一段向量（已存在的键跳过）"""
+        with self._lock.write_lock(), write_locked(self.manifest_path):
+            self._load(locked=True)
+            fresh = {}
+            for key, vector in zip(keys, embeddings):
+                if key not in self._positions and key not in fresh:
+                    fresh[key] = vector
+            if not fresh:
+                return
+            self._write_segment(list(fresh), np.vstack(list(fresh.values())))
+            if len(self.segments) > self.max_segments:
+                self._compact()
+
+    def _write_segment(self, keys, embeddings):
+        """写入新段并原子替换清单（调用方持有锁）"""
+        vectors, scales = self._quantize(np.asarray(embeddings, dtype=np.float32))
+        name = f"seg_{self.version + 1:06d}"
+        prefix = os.path.join(self.directory, name)
+        atomic_write(f"{prefix}.npy", lambda f: np.save(f, vectors), mode='wb')
+        atomic_write(f"{prefix}.keys.npy", lambda f: np.save(f, np.array(keys, dtype='U40')), mode='wb')
+        if scales is not None:
+            atomic_write(f"{prefix}.scales.npy", lambda f: np.save(f, scales), mode='wb')
+        self._commit(self.segments + [{'name': name, 'rows': len(keys)}])
+
+    def _commit(self, segments):
+        """写清单并重新映射（调用方持有锁）"""
+        atomic_write_json(self.manifest_path, {
+            'version': self.version + 1,
+            'model_name': self.model_name,
+            'dimension': self.dimension,
+            'dtype': self.dtype,
+            'segments': segments
+        }, indent=2)
+        self._mtime = None
+        self._load(locked=True)
+
+    def compact(self, keep=None):
+        """合并所有段为一段；keep为需要保留的内容哈希集合（None表示全部保留）"""
+        with self._lock.write_lock(), write_locked(self.manifest_path):
+            self._load(locked=True)
+            self._compact(keep)
+
+    def _compact(self, keep=None):
+        old_names = [segment['name'] for segment in self.segments]
+        rows_by_segment = [[] for _ in self.segments]
+        for key, (segment, row) in self._positions.items():
+            if keep is None or key in keep:
+                rows_by_segment[segment].append((row, key))
+        keys, parts = [], []
+        for segment, pairs in enumerate(rows_by_segment):
+            if pairs:
+                rows, segment_keys = zip(*sorted(pairs))
+                keys.extend(segment_keys)
+                parts.append(self._dequantize(segment, list(rows)))
+        if keys:
+            self.segments = []
+            self._write_segment(keys, np.vstack(parts))
+        else:
+            self._commit([])
+
+        # 旧段已不在清单中（其他进程已映射的文件在POSIX下删除后仍可读）
+        for name in old_names:
+            for suffix in (".npy", ".keys.npy", ".scales.npy"):
+                path = os.path.join(self.directory, name + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def encode(self, texts, encoder, batch_size=256):
+        """返回texts的归一化向量：已存储的直接读取，只对缺失的文档调用encoder并持久化"""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        with self._lock.write_lock():
+            self._load()  # 其他进程可能追加了新段
+        keys = [content_hash(text) for text in texts]
+        embeddings, found = self.get(keys)
+
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            missing_texts = [texts[i] for i in missing]
+            parts = [np.asarray(encoder(missing_texts[i:i + batch_size]), dtype=np.float32)
+                     for i in range(0, len(missing_texts), batch_size)]
+            encoded = np.vstack(parts)
+            norms = np.linalg.norm(encoded, axis=1, keepdims=True)
+            np.divide(encoded, norms, out=encoded, where=norms > 0)
+            self.add([keys[i] for i in missing], encoded)
+            embeddings[missing] = encoded
+        return embeddings
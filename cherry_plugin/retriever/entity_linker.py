@@ -0,0 +1,112 @@
+"""
+实体链接模块：节点ID、别名和关键属性的向量索引，把问题链接到最相关的图节点
+"""
+import faiss
+import numpy as np
+
+from ..diagnostics import faiss_size
+from ..persistence import RWLock
+
+ALIAS_FIELDS = ("别名", "aliases", "alias", "英文名", "english_name", "name")
+
+
+class EntityLinker:
+    """每个节点编码若干表面形式（ID、别名、"ID + 属性值"描述），一次ANN检索得到候选节点"""
+
+    def __init__(self, encoder, dimension=384, min_score=0.45, relative_margin=0.1,
+                 alias_fields=ALIAS_FIELDS, store=None):
+        self.encoder = encoder  # 共享的EmbeddingCache
+        self.store = store  # 可选的EmbeddingStore：按内容哈希持久化表面形式向量，重启时不必重新编码全部节点
+        self.dimension = dimension
+        self.min_score = min_score
+        self.relative_margin = relative_margin  # 只保留与最高分相差不超过该值的候选，避免"匹配一切"
+        self.alias_fields = alias_fields
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        self._vector_nodes = {}  # 向量ID -> 节点ID
+        self._node_vectors = {}  # 节点ID -> [向量ID]
+        self._next_id = 0
+        self._lock = RWLock()
+
+    def __len__(self):
+        return len(self._node_vectors)
+
+    def reset(self, dimension=None, store=None):
+        """清空索引（编码模型切换后调用，之后需重新add_nodes）；store为新模型对应的向量存储"""
+        with self._lock.write_lock():
+            if dimension is not None:
+                self.dimension = dimension
+            self.store = store
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))
+            self._vector_nodes = {}
+            self._node_vectors = {}
+            self._next_id = 0
+
+    def memory_stats(self):
+        """已链接的节点数与向量索引大小"""
+        with self._lock.read_lock():
+            return dict(faiss_size(self.index), nodes=len(self._node_vectors))
+
+    def surface_forms(self, node):
+        """节点的表面形式：ID、别名、ID与字符串属性值拼成的描述"""
+        forms = [node["id"]]
+        properties = node.get("properties", {})
+        for field in self.alias_fields:
+            value = properties.get(field)
+            if isinstance(value, str):
+                forms.append(value)
+            elif isinstance(value, (list, tuple)):
+                forms.extend(str(v) for v in value)
+        values = [str(v) for k, v in properties.items() if k not in self.alias_fields and isinstance(v, str)]
+        if values:
+            forms.append(" ".join([node["id"]] + values))
+        return list(dict.fromkeys(form for form in forms if form))
+
+    def add_nodes(self, nodes):
+        """新增或更新节点（同ID的旧向量会被替换）"""
+        nodes = list({node["id"]: node for node in nodes}.values())
+        if not nodes:
+            return
+        forms = [(node["id"], form) for node in nodes for form in self.surface_forms(node)]
+        texts = [form for _, form in forms]
+        if self.store is not None:
+            embeddings = self.store.encode(texts, self.encoder.encode)
+        else:
+            embeddings = self.encoder.encode(texts)
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+
+        with self._lock.write_lock():
+            stale = [vector_id for node in nodes for vector_id in self._node_vectors.pop(node["id"], [])]
+            if stale:
+                self.index.remove_ids(np.array(stale, dtype=np.int64))
+                for vector_id in stale:
+                    del self._vector_nodes[vector_id]
+            ids = np.arange(self._next_id, self._next_id + len(forms), dtype=np.int64)
+            self._next_id += len(forms)
+            self.index.add_with_ids(embeddings, ids)
+            for vector_id, (node_id, _) in zip(ids.tolist(), forms):
+                self._vector_nodes[vector_id] = node_id
+                self._node_vectors.setdefault(node_id, []).append(vector_id)
+
+    def on_graph_change(self, kind, item, graph_db=None):
+        """GraphDB变更回调"""
+        if kind == "node":
+            self.add_nodes([item])
+
+    def link(self, query_embedding, k=3):
+        """返回 [(节点ID, 分数)]，按分数降序，每个节点只出现一次"""
+        with self._lock.read_lock():
+            if not self._vector_nodes:
+                return []
+            query = np.ascontiguousarray(query_embedding, dtype='float32').reshape(1, -1)
+            scores, ids = self.index.search(query, min(len(self._vector_nodes), k * 4))
+            best = {}
+            for score, vector_id in zip(scores[0], ids[0]):
+                node_id = self._vector_nodes.get(int(vector_id))
+                if node_id is not None and node_id not in best:
+                    best[node_id] = float(score)
+
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        if not ranked or ranked[0][1] < self.min_score:
+            return []
+        floor = max(self.min_score, ranked[0][1] - self.relative_margin)
+        return [(node_id, score) for node_id, score in ranked[:k] if score >= floor]
@@ -1,15 +1,41 @@
 """
 图数据库检索模块：Neo4j知识图谱（简化版本）
 """
+import logging
 import json
 import os
+from collections import Counter
+from ..diagnostics import deep_size
+from ..persistence import RWLock, atomic_write_json, read_locked, write_locked
+
+logger = logging.getLogger(__name__)
+
+def _canonical(item):
+    """节点/关系的规范化表示，用于比较内存与文件中的条目"""
+    return json.dumps(item, ensure_ascii=False, sort_keys=True)
 
 class GraphDB:
     def __init__(self, data_path="cherry_plugin/data/graph_data.json"):
         self.data_path = data_path
         self.graph_data = {"nodes": [], "relationships": []}
+        self._lock = RWLock()
+        self._nodes = {}  # 节点ID -> 节点（同ID取最后一个）
+        self._adjacency = {}  # 节点ID -> 涉及该节点的关系下标
+        self._listeners = []  # 变更回调 callback(kind, item, graph_db)，kind为"node"或"relationship"
+        self._file_signature = None  # 上次读/写时文件的 (mtime, size, inode)，未变化时写入前不必重读
         self.load_data()
     
+    def add_listener(self, callback):
+        """注册数据变更回调（如统一索引的增量更新）"""
+        self._listeners.append(callback)
+    
+    def _notify(self, kind, item):
+        for callback in self._listeners:
+            try:
+                callback(kind, item, self)
+            except Exception as e:
+                logger.warning(f"图数据变更回调失败: {e}")
+    
     def add_node(self, node_id, label, properties=None):
         """添加节点"""
         node = {
@@ -17,8 +43,7 @@ class GraphDB:
             "label": label,
             "properties": properties or {}
         }
-        self.graph_data["nodes"].append(node)
-        self.save_data()
+        self._write("node", node)
     
     def add_relationship(self, from_id, to_id, relation_type, properties=None):
         """添加关系"""
@@ -28,11 +53,69 @@ class GraphDB:
             "type": relation_type,
             "properties": properties or {}
         }
-        self.graph_data["relationships"].append(relationship)
-        self.save_data()
+        self._write("relationship", relationship)
+    
+    def _write(self, kind, item):
+        """在跨进程独占锁内读取-合并-写入：先合并其他进程已写入文件的变更，再加入新条目并保存，
+        多个进程（如每个客户端一个stdio服务）同时写入时不会互相覆盖"""
+        with write_locked(self.data_path):
+            changes = self._merge_file()
+            self._apply(kind, item)
+            self._save_locked()
+        for change in changes + [(kind, item)]:
+            self._notify(*change)
+    
+    def _apply(self, kind, item):
+        """把一个节点或关系加入内存中的图和索引"""
+        with self._lock.write_lock():
+            if kind == "node":
+                self.graph_data["nodes"].append(item)
+                self._nodes[item["id"]] = item
+            else:
+                self.graph_data["relationships"].append(item)
+                self._index_relationship(len(self.graph_data["relationships"]) - 1, item)
+    
+    def apply_change(self, kind, item):
+        """应用其他进程已写入文件的变更：只更新内存和派生索引，不再保存"""
+        self._apply(kind, item)
+        self._notify(kind, item)
+    
+    def search_relationships(self, query, limit=5, analysis=None):
+        """搜索关系（analysis为QueryAnalyzer的分析结果，命中图词表时按精确实体匹配，只扫描一遍）"""
+        with self._lock.read_lock():
+            if analysis is not None and analysis.has("node", "property", "relationship"):
+                return self._match_relationships(analysis, limit)
+            return self._search_relationships(query, limit)
+    
+    def _match_relationships(self, analysis, limit):
+        node_ids = {value.lower() for value in analysis.values("node")}
+        relation_types = {value.lower() for value in analysis.values("relationship")}
+        property_values = {value.lower() for value in analysis.values("property")}
+        nodes = self._nodes
+        
+        def node_matches(node):
+            return node["id"].lower() in node_ids or \
+                any(str(v).lower() in property_values for v in node["properties"].values())
+        
+        # 同时命中实体和关系类型的关系排在前面
+        scored = []
+        for rel in self.graph_data["relationships"]:
+            from_node, to_node = nodes.get(rel["from"]), nodes.get(rel["to"])
+            if not from_node or not to_node:
+                continue
+            score = (rel["type"].lower() in relation_types) + node_matches(from_node) + node_matches(to_node) + \
+                any(str(v).lower() in property_values for v in rel["properties"].values())
+            if score:
+                scored.append((score, {
+                    "from": from_node,
+                    "to": to_node,
+                    "relationship": rel["type"],
+                    "properties": rel["properties"]
+                }))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [result for _, result in scored[:limit]]
     
-    def search_relationships(self, query, limit=5):
-        """搜索关系"""
+    def _search_relationships(self, query, limit):
         results = []
         query_lower = query.lower()
         
@@ -93,26 +176,139 @@ class GraphDB:
         
         return results[:limit]
     
+    def _index_relationship(self, position, rel):
+        self._adjacency.setdefault(rel["from"], []).append(position)
+        if rel["to"] != rel["from"]:
+            self._adjacency.setdefault(rel["to"], []).append(position)
+    
+    def _rebuild_indexes(self):
+        """重建节点字典和邻接表（调用方持有写锁）"""
+        self._nodes = {node["id"]: node for node in self.graph_data["nodes"]}
+        self._adjacency = {}
+        for position, rel in enumerate(self.graph_data["relationships"]):
+            self._index_relationship(position, rel)
+    
+    def relationships_from(self, node_ids, limit=5):
+        """从给定节点出发取相邻关系（按邻接表直接定位，不扫描全部关系）
+        
+        node_ids按相关性排序；连接两个给定节点的关系排在最前，其余按起始节点的顺序
+        """
+        with self._lock.read_lock():
+            rank = {node_id: i for i, node_id in enumerate(node_ids)}
+            scored = {}
+            for node_id in node_ids:
+                for position in self._adjacency.get(node_id, ()):
+                    if position in scored:
+                        continue
+                    rel = self.graph_data["relationships"][position]
+                    both = rel["from"] in rank and rel["to"] in rank
+                    scored[position] = (not both, rank[node_id], position)
+            
+            results = []
+            for position in sorted(scored, key=scored.get):
+                rel = self.graph_data["relationships"][position]
+                from_node, to_node = self._nodes.get(rel["from"]), self._nodes.get(rel["to"])
+                if from_node and to_node:
+                    results.append({
+                        "from": from_node,
+                        "to": to_node,
+                        "relationship": rel["type"],
+                        "properties": rel["properties"]
+                    })
+                    if len(results) >= limit:
+                        break
+            return results
+    
+    def triples(self, node_ids=None):
+        """全部关系三元组 (from_node, type, to_node)，node_ids限定只取涉及这些节点的关系"""
+        with self._lock.read_lock():
+            nodes = self._nodes
+            result = []
+            for rel in self.graph_data["relationships"]:
+                if node_ids is not None and rel["from"] not in node_ids and rel["to"] not in node_ids:
+                    continue
+                from_node, to_node = nodes.get(rel["from"]), nodes.get(rel["to"])
+                if from_node and to_node:
+                    result.append((from_node, rel["type"], to_node))
+            return result
+    
     def get_node_by_id(self, node_id):
         """根据ID获取节点（返回最后一个匹配的节点）"""
-        matched_node = None
-        for node in self.graph_data["nodes"]:
-            if node["id"] == node_id:
-                matched_node = node  # 保存最后一个匹配的节点
-        return matched_node
+        return self._nodes.get(node_id)
+    
+    def nodes(self):
+        """全部节点（同ID取最后一个）"""
+        with self._lock.read_lock():
+            return list(self._nodes.values())
+    
+    def relationships(self):
+        """全部关系（原始记录，含属性）"""
+        with self._lock.read_lock():
+            return list(self.graph_data["relationships"])
+    
+    def memory_stats(self):
+        """节点/关系数量，图数据与内存索引的估算大小（字节）"""
+        with self._lock.read_lock():
+            return {'nodes': len(self.graph_data["nodes"]),
+                    'relationships': len(self.graph_data["relationships"]),
+                    'graph_data_bytes': deep_size(self.graph_data),
+                    'indexes_bytes': deep_size(self._nodes) + deep_size(self._adjacency)}
+    
+    def _signature(self):
+        try:
+            stat = os.stat(self.data_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+    
+    def _merge_file(self):
+        """把文件中有、内存中没有的节点和关系加入内存（调用方持有跨进程写锁），返回 [(kind, item)]"""
+        signature = self._signature()
+        if signature is None or signature == self._file_signature:
+            return []
+        with open(self.data_path, 'r', encoding='utf-8') as f:
+            file_data = json.load(f)
+        changes = []
+        with self._lock.read_lock():
+            for kind, key in (("node", "nodes"), ("relationship", "relationships")):
+                known = Counter(_canonical(item) for item in self.graph_data[key])
+                for item in file_data.get(key, []):
+                    canonical = _canonical(item)
+                    if known[canonical]:
+                        known[canonical] -= 1
+                    else:
+                        changes.append((kind, item))
+        for kind, item in changes:
+            self._apply(kind, item)
+        if changes:
+            logger.info(f"合并了其他进程写入的 {len(changes)} 条图数据")
+        return changes
+    
+    def _save_locked(self):
+        """写入文件（调用方持有跨进程写锁）"""
+        with self._lock.read_lock():
+            atomic_write_json(self.data_path, self.graph_data, indent=2)
+        self._file_signature = self._signature()
     
     def save_data(self):
-        """保存图数据"""
-        os.makedirs(os.path.dirname(self.data_path), exist_ok=True)
-        with open(self.data_path, 'w', encoding='utf-8') as f:
-            json.dump(self.graph_data, f, ensure_ascii=False, indent=2)
+        """保存图数据（先合并其他进程写入的变更）"""
+        with write_locked(self.data_path):
+            changes = self._merge_file()
+            self._save_locked()
+        for change in changes:
+            self._notify(*change)
     
     def load_data(self):
         """加载图数据"""
         if os.path.exists(self.data_path):
             try:
-                with open(self.data_path, 'r', encoding='utf-8') as f:
-                    self.graph_data = json.load(f)
+                with read_locked(self.data_path):
+                    with open(self.data_path, 'r', encoding='utf-8') as f:
+                        graph_data = json.load(f)
+                    self._file_signature = self._signature()
+                with self._lock.write_lock():
+                    self.graph_data = graph_data
+                    self._rebuild_indexes()
             except Exception as e:
-                print(f"加载图数据失败: {e}")
+                logger.warning(f"加载图数据失败: {e}")
                 self.graph_data = {"nodes": [], "relationships": []}
\ No newline at end of file
@@ -0,0 +1,182 @@
+"""
+索引重建模块：在后台构建新一代向量索引，抽样校验召回率后原子切换，并清理旧代文件
+"""
+import logging
+import heapq
+import os
+import random
+import re
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from ..persistence import write_locked
+
+logger = logging.getLogger(__name__)
+
+
+class IndexRebuilder:
+    """后台重建VectorDB：构建期间旧一代继续提供查询，新增文档在切换前补齐"""
+
+    def __init__(self, vector_db, path, batch_size=256, sample_size=20, recall_k=10,
+                 min_recall=0.9, keep_generations=1):
+        self.vector_db = vector_db
+        self.path = path
+        self.batch_size = batch_size
+        self.sample_size = sample_size  # 召回率抽检的查询数
+        self.recall_k = recall_k
+        self.min_recall = min_recall
+        self.keep_generations = keep_generations  # 除当前代外保留的旧代数
+        self.status = {'state': 'idle'}
+        self._thread = None
+        self._lock = threading.Lock()
+        self._listeners = []  # 切换到新一代后的回调 callback(generation)
+
+    def add_listener(self, callback):
+        """注册切换回调（如丢弃基于旧一代索引的预取结果）"""
+        self._listeners.append(callback)
+
+    def _notify(self, generation):
+        for callback in self._listeners:
+            try:
+                callback(generation)
+            except Exception as e:
+                logger.warning(f"索引切换回调失败: {e}")
+
+    def start(self, model_name=None, index_factory=None):
+        """启动后台重建；已有任务在运行时返回False"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._thread = threading.Thread(target=self._run, args=(model_name, index_factory),
+                                            name="index-rebuild", daemon=True)
+            self._thread.start()
+            return True
+
+    def wait(self, timeout=None):
+        """等待后台重建结束，返回最终状态"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return dict(self.status)
+
+    def _run(self, model_name, index_factory):
+        try:
+            self.rebuild(model_name, index_factory)
+        except Exception as e:
+            self.status = dict(self.status, state='failed', error=str(e))
+            logger.warning(f"后台重建索引失败: {e}")
+
+    def rebuild(self, model_name=None, index_factory=None):
+        """同步执行一次重建（换模型、换索引类型或合并碎片分片），成功切换返回True"""
+        db = self.vector_db
+        started = time.time()
+
+        if model_name and model_name != db.model_name:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(model_name, device='cpu')
+            dimension = model.get_sentence_embedding_dimension()
+        else:
+            model_name, model, dimension = db.model_name, db.model, db.dimension
+        index_factory = index_factory or db.index_factory
+
+        # 记录快照：各分片当前的文档数，快照之后的新增文档在切换前补齐
+        generation = db.generation + 1
+        snapshot = {shard.name: 0 for shard in list(db.shards)}
+        docs, metadata = db.rows_since(snapshot)
+        self.status = {'state': 'building', 'generation': generation, 'documents': len(docs)}
+        logger.info(f"开始后台重建第 {generation} 代索引，共 {len(docs)} 个文档")
+
+        def encode(texts):
+            # 向量存储中已有的文档直接读取，只编码新增或变更的文档
+            return db.encode_documents(texts, model_name, model, dimension, self.batch_size)
+
+        # 抽样查询先编码，构建过程中顺带计算精确top-k作为召回率基准
+        samples = random.sample(range(len(docs)), min(self.sample_size, len(docs)))
+        queries = encode([docs[i] for i in samples])
+        exact = [[] for _ in samples]  # 每个查询的最小堆 (score, shard, id)
+
+        shards = []
+        for start in range(0, len(docs), db.max_shard_size):
+            # 按分片大小整块编码写入，需要训练的索引类型可以用整块数据训练
+            chunk = docs[start:start + db.max_shard_size]
+            embeddings = encode(chunk)
+            db.append_to_shards(shards, chunk, embeddings, metadata[start:start + db.max_shard_size],
+                                dimension, index_factory)
+            self._update_exact(exact, queries, embeddings, shards[-1].name,
+                               len(shards[-1]) - len(chunk))
+
+        # 召回率抽检：新索引的近似检索结果与精确结果比较
+        self.status = dict(self.status, state='validating')
+        recall = self._spot_check(shards, queries, exact)
+        self.status['recall'] = recall
+        if recall < self.min_recall:
+            self.status['state'] = 'rejected'
+            logger.info(f"第 {generation} 代索引召回率 {recall:.3f} 低于阈值 {self.min_recall}，放弃切换")
+            return False
+
+        # 补齐构建期间新增的文档（无锁编码），最后一小批在切换的写锁内补齐
+        def catch_up(docs, metadata):
+            db.append_to_shards(shards, docs, encode(docs), metadata, dimension, index_factory)
+
+        while True:
+            docs, metadata = db.rows_since(snapshot)
+            if not docs:
+                break
+            catch_up(docs, metadata)
+        db.swap_generation(shards, generation, model_name, model, dimension, index_factory,
+                           snapshot=snapshot, catch_up=catch_up)
+        self._notify(generation)
+
+        # 写入新一代分片并替换清单指针，再清理旧代和不再使用的文档向量
+        db.save(self.path)
+        self.collect_garbage()
+        db.compact_embeddings()
+        self.status = dict(self.status, state='swapped', documents=sum(len(shard) for shard in shards),
+                           seconds=round(time.time() - started, 3))
+        logger.info(f"已切换到第 {generation} 代索引，召回率 {recall:.3f}")
+        return True
+
+    def _update_exact(self, exact, queries, embeddings, shard_name, offset):
+        """用本块向量更新每个抽样查询的精确top-k"""
+        if len(queries) == 0 or len(embeddings) == 0:
+            return
+        scores = queries @ embeddings.T
+        for heap, row in zip(exact, scores):
+            for idx in np.argsort(-row)[:self.recall_k]:
+                item = (float(row[idx]), shard_name, offset + int(idx))
+                if len(heap) < self.recall_k:
+                    heapq.heappush(heap, item)
+                else:
+                    heapq.heappushpop(heap, item)
+
+    def _spot_check(self, shards, queries, exact):
+        """抽样查询在新分片上的召回率（无样本时视为1.0）"""
+        if len(queries) == 0:
+            return 1.0
+        hits = total = 0
+        for query, heap in zip(queries, exact):
+            results = [r for shard in shards for r in shard.search(query, "", self.recall_k, hybrid=False)]
+            found = {(r['shard'], r['id']) for r in heapq.nlargest(self.recall_k, results, key=lambda r: r['score'])}
+            expected = {(shard_name, idx) for _, shard_name, idx in heap}
+            hits += len(found & expected)
+            total += len(expected)
+        return hits / total if total else 1.0
+
+    def collect_garbage(self):
+        """删除当前代及最近keep_generations代之外的分片目录"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        pattern = re.compile(re.escape(os.path.basename(self.path)) + r'\.shards(?:\.g(\d+))?$')
+        current = self.vector_db.generation
+        with write_locked(self.path):
+            for name in os.listdir(directory):
+                match = pattern.match(name)
+                if not match:
+                    continue
+                generation = int(match.group(1) or 0)
+                if current - self.keep_generations <= generation <= current:
+                    continue
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+                logger.info(f"已清理第 {generation} 代索引文件")
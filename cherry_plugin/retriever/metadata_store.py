@@ -0,0 +1,129 @@
+"""
+元数据模块：按列存储文档元数据，并将过滤条件编译为位图
+"""
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from ..persistence import atomic_write
+
+
+def _to_timestamp(value) -> float:
+    """将datetime、ISO字符串或数字转换为Unix时间戳"""
+    if value is None:
+        return np.nan
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp()
+    return float(value)
+
+
+class MetadataStore:
+    """列式元数据：分类字段存为int32编码（-1表示缺失），时间字段存为float64时间戳（NaN表示缺失）"""
+
+    def __init__(self, time_fields=("timestamp",)):
+        self.time_fields = tuple(time_fields)
+        self.size = 0
+        self.categorical = {}  # 字段 -> int32编码数组
+        self.vocabularies = {}  # 字段 -> {值: 编码}
+        self.values = {}  # 字段 -> 按编码排列的值
+        self.times = {field: np.zeros(0, dtype=np.float64) for field in self.time_fields}
+
+    def append(self, metadata_list: List[Optional[Dict]], stamp_missing: bool = True) -> None:
+        """追加一批文档的元数据（stamp_missing为True时，未提供timestamp的文档使用当前时间）"""
+        count = len(metadata_list)
+        now = time.time()
+        columns = {}
+        for row, metadata in enumerate(metadata_list):
+            for field, value in (metadata or {}).items():
+                if field in self.time_fields or value is None:
+                    continue
+                vocabulary = self.vocabularies.setdefault(field, {})
+                code = vocabulary.get(str(value))
+                if code is None:
+                    code = vocabulary[str(value)] = len(vocabulary)
+                    self.values.setdefault(field, []).append(str(value))
+                columns.setdefault(field, np.full(count, -1, dtype=np.int32))[row] = code
+
+        for field in set(self.categorical) | set(columns):
+            existing = self.categorical.get(field, np.full(self.size, -1, dtype=np.int32))
+            new = columns.get(field, np.full(count, -1, dtype=np.int32))
+            self.categorical[field] = np.concatenate([existing, new])
+
+        for field in self.time_fields:
+            values = [(metadata or {}).get(field) for metadata in metadata_list]
+            if field == "timestamp" and stamp_missing:
+                values = [now if v is None else v for v in values]
+            new = np.array([_to_timestamp(v) for v in values], dtype=np.float64)
+            self.times[field] = np.concatenate([self.times[field], new])
+
+        self.size += count
+
+    def get(self, doc_id: int) -> Dict:
+        """获取单个文档的元数据"""
+        result = {}
+        for field, codes in self.categorical.items():
+            code = codes[doc_id]
+            if code >= 0:
+                result[field] = self.values[field][code]
+        for field, values in self.times.items():
+            if not np.isnan(values[doc_id]):
+                result[field] = float(values[doc_id])
+        return result
+
+    def compile(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """将过滤条件编译为布尔位图；无过滤条件时返回None
+
+        分类字段: {"category": "教程"} 或 {"source": ["wiki", "notes"]}
+        时间字段: {"timestamp": (start, end)}，start/end可为None、datetime、ISO字符串或时间戳
+        """
+        if not filters:
+            return None
+
+        mask = np.ones(self.size, dtype=bool)
+        for field, condition in filters.items():
+            if field in self.time_fields:
+                start, end = condition
+                values = self.times[field]
+                if start is not None:
+                    mask &= values >= _to_timestamp(start)
+                if end is not None:
+                    mask &= values <= _to_timestamp(end)
+            else:
+                if field not in self.categorical:
+                    return np.zeros(self.size, dtype=bool)
+                allowed = condition if isinstance(condition, (list, tuple, set)) else [condition]
+                vocabulary = self.vocabularies[field]
+                codes = [vocabulary[str(v)] for v in allowed if str(v) in vocabulary]
+                mask &= np.isin(self.categorical[field], codes)
+        return mask
+
+    def save(self, path: str) -> None:
+        """保存为npz（原子写入）"""
+        arrays = {'size': np.array([self.size])}
+        for field, codes in self.categorical.items():
+            arrays[f"codes/{field}"] = codes
+            arrays[f"values/{field}"] = np.array(self.values[field], dtype=str)
+        for field, values in self.times.items():
+            arrays[f"times/{field}"] = values
+        atomic_write(path, lambda f: np.savez(f, **arrays), mode='wb')
+
+    @classmethod
+    def load(cls, path: str) -> "MetadataStore":
+        """从npz加载"""
+        with np.load(path) as data:
+            time_fields = [key.split('/', 1)[1] for key in data.files if key.startswith('times/')]
+            store = cls(time_fields)
+            store.size = int(data['size'][0])
+            for key in data.files:
+                kind, _, field = key.partition('/')
+                if kind == 'codes':
+                    store.categorical[field] = data[key]
+                    store.values[field] = data[f"values/{field}"].tolist()
+                    store.vocabularies[field] = {v: i for i, v in enumerate(store.values[field])}
+                elif kind == 'times':
+                    store.times[field] = data[key]
+        return store
@@ -1,24 +1,60 @@
 """
 重排序模块：提升向量检索精度
 """
+import logging
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 import numpy as np
 from typing import List, Tuple
 
+from ..diagnostics import deep_size, model_size
+from ..telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
 class Reranker:
-    def __init__(self, method="cosine"):
+    def __init__(self, method="cosine", model_name="BAAI/bge-reranker-base", cache_size=4096):
         self.method = method
+        self.model_name = model_name
         self.rerank_model = None
         
+        # (模型, 查询哈希, 文档哈希) -> 交叉编码器分数，LRU淘汰
+        self.cache_size = cache_size
+        self._score_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.stats = {'pairs_scored': 0, 'pairs_cached': 0, 'score_seconds': 0.0}
+        
         if method == "bge":
             try:
                 from FlagEmbedding import FlagReranker
                 import os
                 os.environ['CUDA_VISIBLE_DEVICES'] = ''  # 强制使用CPU
-                self.rerank_model = FlagReranker('BAAI/bge-reranker-base', use_fp16=False)
+                self.rerank_model = FlagReranker(model_name, use_fp16=False)
             except ImportError:
-                print("FlagEmbedding未安装，回退到余弦相似度重排序")
+                logger.info("FlagEmbedding未安装，回退到余弦相似度重排序")
                 self.method = "cosine"
     
+    def memory_stats(self) -> dict:
+        """分数缓存条目数与估算内存（字节），加载了交叉编码器时包括模型大小"""
+        with self._cache_lock:
+            stats = {'score_cache_entries': len(self._score_cache),
+                     'score_cache_bytes': deep_size(self._score_cache)}
+        if self.rerank_model is not None:
+            stats['model'] = {'type': type(self.rerank_model).__name__, 'bytes': model_size(self.rerank_model)}
+        return stats
+    
+    @property
+    def seconds_per_pair(self) -> float:
+        """交叉编码器单个(查询, 文档)对的平均耗时，用于估算节省的时间"""
+        if self.stats['pairs_scored'] == 0:
+            return 0.0
+        return self.stats['score_seconds'] / self.stats['pairs_scored']
+    
     def rerank(self, query: str, docs: List[str], scores: List[float] = None, top_k: int = 5) -> List[Tuple[str, float]]:
         """重排序文档"""
         if not docs:
@@ -30,21 +66,45 @@ class Reranker:
             return self._cosine_rerank(query, docs, scores, top_k)
     
     def _bge_rerank(self, query: str, docs: List[str], top_k: int) -> List[Tuple[str, float]]:
-        """BGE重排序"""
+        """BGE重排序（已打过分的(查询, 文档)对直接取缓存）"""
         try:
-            pairs = [[query, doc] for doc in docs]
-            scores = self.rerank_model.compute_score(pairs)
+            query_hash = _text_hash(query)
+            keys = [(self.model_name, query_hash, _text_hash(doc)) for doc in docs]
+            scores = [None] * len(docs)
+            with self._cache_lock:
+                for i, key in enumerate(keys):
+                    if key in self._score_cache:
+                        self._score_cache.move_to_end(key)
+                        scores[i] = self._score_cache[key]
+            missing = [i for i, score in enumerate(scores) if score is None]
             
-            # 确保scores是列表
-            if not isinstance(scores, list):
-                scores = [scores]
+            if missing:
+                started = time.perf_counter()
+                pairs = [[query, docs[i]] for i in missing]
+                computed = self.rerank_model.compute_score(pairs)
+                
+                # 确保scores是列表
+                if not isinstance(computed, list):
+                    computed = [computed]
+                elapsed = time.perf_counter() - started
+                
+                with self._cache_lock:
+                    for i, score in zip(missing, computed):
+                        scores[i] = float(score)
+                        self._score_cache[keys[i]] = float(score)
+                    while len(self._score_cache) > self.cache_size:
+                        self._score_cache.popitem(last=False)
+                    self.stats['pairs_scored'] += len(missing)
+                    self.stats['score_seconds'] += elapsed
+            with self._cache_lock:
+                self.stats['pairs_cached'] += len(docs) - len(missing)
                 
             # 排序并返回top_k
             ranked = sorted(zip(docs, scores), key=lambda x: x[1], reverse=True)
             return ranked[:top_k]
             
         except Exception as e:
-            print(f"BGE重排序失败: {e}")
+            logger.warning(f"BGE重排序失败: {e}")
             return [(doc, 0.0) for doc in docs[:top_k]]
     
     def _cosine_rerank(self, query: str, docs: List[str], scores: List[float], top_k: int) -> List[Tuple[str, float]]:
@@ -58,31 +118,93 @@ class Reranker:
             return [(doc, 1.0) for doc in docs[:top_k]]
 
 class VectorReranker:
-    """向量检索专用重排序器"""
+    """向量检索专用重排序器
     
-    def __init__(self, embedding_model=None):
+    自适应策略：第top_k与第top_k+1名的稠密（余弦）分数差距不小于skip_margin时，重排序几乎不会改变
+    top-k，直接跳过；否则只对稠密分数不低于(第top_k名分数 - shorten_margin)的候选重排序。
+    边距按稠密分数计算：融合分数在RRF下约为1/(60+rank)，在加权融合下混入了BM25，都不适合比较边距
+    """
+    
+    def __init__(self, embedding_model=None, skip_margin=0.15, shorten_margin=0.2, cache_size=4096):
         self.embedding_model = embedding_model
-        self.reranker = Reranker("bge")
+        self.reranker = Reranker("bge", cache_size=cache_size)
+        self.skip_margin = skip_margin
+        self.shorten_margin = shorten_margin
+        self._stats_lock = threading.Lock()
+        self.stats = {'calls': 0, 'skipped': 0, 'shortened': 0, 'candidates': 0,
+                      'pairs_skipped': 0, 'rerank_seconds': 0.0}
+    
+    def memory_stats(self) -> dict:
+        """底层重排序器的分数缓存和模型内存"""
+        return self.reranker.memory_stats()
+    
+    def get_stats(self) -> dict:
+        """跳过率、缓存命中率、平均耗时和估算节省的时间"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats.update(self.reranker.stats)
+        calls = stats['calls']
+        pairs = stats['pairs_scored'] + stats['pairs_cached']
+        stats['skip_rate'] = stats['skipped'] / calls if calls else 0.0
+        stats['cache_hit_rate'] = stats['pairs_cached'] / pairs if pairs else 0.0
+        stats['avg_rerank_ms'] = stats['rerank_seconds'] * 1000 / calls if calls else 0.0
+        # 跳过的候选和缓存命中的候选都按交叉编码器平均单对耗时估算
+        stats['seconds_saved'] = (stats['pairs_skipped'] + stats['pairs_cached']) * self.reranker.seconds_per_pair
+        return stats
+    
+    @staticmethod
+    def _dense(result: dict) -> float:
+        """稠密检索分数；纯向量检索的结果没有dense_score，score即余弦分数"""
+        return result.get('dense_score', result['score'])
+    
+    def _plan(self, results: List[dict], top_k: int) -> List[dict]:
+        """按稠密分数决定需要重排序的候选（返回空列表表示跳过）"""
+        if len(results) <= top_k:
+            return []
+        ordered = sorted(results, key=self._dense, reverse=True)
+        kth = self._dense(ordered[top_k - 1])
+        if kth - self._dense(ordered[top_k]) >= self.skip_margin:
+            return []
+        return [r for r in ordered if self._dense(r) >= kth - self.shorten_margin]
     
     def rerank_vector_results(self, query: str, results: List[dict], top_k: int = 5) -> List[dict]:
         """重排序向量检索结果"""
         if not results:
             return []
         
+        started = time.perf_counter()
+        candidates = self._plan(results, top_k)
+        with self._stats_lock:
+            self.stats['calls'] += 1
+            self.stats['candidates'] += len(results)
+            self.stats['pairs_skipped'] += len(results) - len(candidates)
+            if not candidates:
+                self.stats['skipped'] += 1
+            elif len(candidates) < len(results):
+                self.stats['shortened'] += 1
+        action = "skip" if not candidates else ("shorten" if len(candidates) < len(results) else "full")
+        telemetry.incr("rerank_decisions", action=action)
+        telemetry.incr("rerank_pairs_skipped", len(results) - len(candidates))
+        if not candidates:
+            return sorted(results, key=lambda r: r['score'], reverse=True)[:top_k]
+        results = candidates
+        
         # 提取文档和分数
         docs = [r['document'] for r in results]
         scores = [r['score'] for r in results]
         
         # 重排序
-        reranked = self.reranker.rerank(query, docs, scores, top_k)
+        with telemetry.span("rerank", pairs=len(docs)):
+            reranked = self.reranker.rerank(query, docs, scores, top_k)
         
-        # 重构结果格式
+        # 重构结果格式（保留文档ID、元数据等原有字段）
+        by_document = {}
+        for r in results:
+            by_document.setdefault(r['document'], r)
         reranked_results = []
         for doc, score in reranked:
-            reranked_results.append({
-                'document': doc,
-                'score': float(score),
-                'reranked': True
-            })
+            reranked_results.append(dict(by_document[doc], score=float(score), reranked=True))
         
+        with self._stats_lock:
+            self.stats['rerank_seconds'] += time.perf_counter() - started
         return reranked_results
\ No newline at end of file
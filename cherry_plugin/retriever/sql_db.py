@@ -1,10 +1,13 @@
 """
 SQL检索模块：SQLite结构化数据检索
 """
+import logging
 import sqlite3
 import os
 import re
 
+logger = logging.getLogger(__name__)
+
 class SqlDB:
     def __init__(self, db_path="cherry_plugin/data/config.db"):
         # 如果是相对路径，转换为绝对路径
@@ -12,6 +15,7 @@ class SqlDB:
             base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
             db_path = os.path.join(base_dir, db_path)
         self.db_path = db_path
+        self._listeners = []  # 变更回调 callback(kind, row)，kind为"config"或"rule"
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         self.init_db()
     
@@ -43,7 +47,22 @@ class SqlDB:
         
         conn.commit()
         conn.close()
-        print(f"数据库初始化完成: {self.db_path}")
+        logger.info(f"数据库初始化完成: {self.db_path}")
+    
+    def add_listener(self, callback):
+        """注册数据变更回调（如统一索引的增量更新）"""
+        self._listeners.append(callback)
+    
+    def _notify(self, kind, row):
+        for callback in self._listeners:
+            try:
+                callback(kind, row)
+            except Exception as e:
+                logger.warning(f"SQL变更回调失败: {e}")
+    
+    def apply_change(self, kind, row):
+        """其他进程已写入数据库的变更：只通知监听者更新本进程内的派生索引"""
+        self._notify(kind, row)
     
     def add_config(self, key, value, description="", category="general"):
         """添加配置项"""
@@ -57,6 +76,7 @@ class SqlDB:
         
         conn.commit()
         conn.close()
+        self._notify("config", {'key': key, 'value': value, 'description': description, 'category': category})
     
     def add_rule(self, name, condition, action, category="general"):
         """添加规则"""
@@ -67,9 +87,27 @@ class SqlDB:
             INSERT INTO rules (name, condition, action, category)
             VALUES (?, ?, ?, ?)
         ''', (name, condition, action, category))
+        rule_id = cursor.lastrowid
         
         conn.commit()
         conn.close()
+        self._notify("rule", {'id': rule_id, 'name': name, 'condition': condition,
+                              'action': action, 'category': category})
+    
+    def all_configs(self):
+        """全部配置项"""
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute('SELECT key, value, description, category FROM config').fetchall()
+        conn.close()
+        return [{'key': row[0], 'value': row[1], 'description': row[2], 'category': row[3]} for row in rows]
+    
+    def all_rules(self):
+        """全部规则"""
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute('SELECT id, name, condition, action, category FROM rules').fetchall()
+        conn.close()
+        return [{'id': row[0], 'name': row[1], 'condition': row[2], 'action': row[3], 'category': row[4]}
+                for row in rows]
     
     def extract_keywords(self, question):
         """从问题中提取关键词"""
@@ -97,13 +135,24 @@ class SqlDB:
         
         return list(set(keywords))
     
-    def search_config(self, question, limit=5):
-        """搜索配置项"""
-        keywords = self.extract_keywords(question)
-        
+    def search_config(self, question, limit=5, analysis=None):
+        """搜索配置项（analysis命中配置键时一次精确查询，否则回退到关键词模糊匹配）"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
+        keys = sorted(analysis.values('config')) if analysis is not None else []
+        if keys:
+            cursor.execute(f'''
+                SELECT key, value, description, category FROM config
+                WHERE key IN ({", ".join("?" * len(keys))})
+                LIMIT ?
+            ''', (*keys, limit))
+            results = [{'type': 'config', 'key': row[0], 'value': row[1], 'description': row[2],
+                        'category': row[3], 'match_keyword': row[0]} for row in cursor.fetchall()]
+            conn.close()
+            return results
+        
+        keywords = self.extract_keywords(question)
         results = []
         
         # 精确匹配
@@ -128,13 +177,24 @@ class SqlDB:
         conn.close()
         return results[:limit]
     
-    def search_rules(self, question, limit=5):
-        """搜索规则"""
-        keywords = self.extract_keywords(question)
-        
+    def search_rules(self, question, limit=5, analysis=None):
+        """搜索规则（analysis命中规则名时一次精确查询，否则回退到关键词模糊匹配）"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
+        names = sorted(analysis.values('rule')) if analysis is not None else []
+        if names:
+            cursor.execute(f'''
+                SELECT id, name, condition, action, category FROM rules
+                WHERE name IN ({", ".join("?" * len(names))})
+                LIMIT ?
+            ''', (*names, limit))
+            results = [{'type': 'rule', 'id': row[0], 'name': row[1], 'condition': row[2], 'action': row[3],
+                        'category': row[4], 'match_keyword': row[1]} for row in cursor.fetchall()]
+            conn.close()
+            return results
+        
+        keywords = self.extract_keywords(question)
         results = []
         
         for keyword in keywords:
@@ -159,10 +219,10 @@ class SqlDB:
         conn.close()
         return results[:limit]
     
-    def search(self, question, limit=5):
-        """综合搜索"""
-        config_results = self.search_config(question, limit//2 + 1)
-        rule_results = self.search_rules(question, limit//2 + 1)
+    def search(self, question, limit=5, analysis=None):
+        """综合搜索（analysis为QueryAnalyzer对问题的分析结果，可选）"""
+        config_results = self.search_config(question, limit//2 + 1, analysis)
+        rule_results = self.search_rules(question, limit//2 + 1, analysis)
         
         all_results = config_results + rule_results
         return all_results[:limit]
\ No newline at end of file
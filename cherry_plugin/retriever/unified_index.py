@@ -0,0 +1,259 @@
+"""
+统一检索模块：配置、规则和图关系三元组编码进同一个FAISS索引，一次检索返回多源候选
+"""
+import logging
+import hashlib
+import json
+import os
+import threading
+
+import faiss
+import numpy as np
+
+from ..diagnostics import deep_size, faiss_size
+from ..persistence import RWLock, atomic_write_index, atomic_write_json, read_locked, write_locked
+
+logger = logging.getLogger(__name__)
+
+
+def format_config(row):
+    """配置行的文本形式（与process_question中的SQL结果一致）"""
+    return f"{row['key']} = {row['value']} ({row['description']})"
+
+
+def format_rule(row):
+    """规则行的文本形式"""
+    return f"{row['name']} - {row['condition']} -> {row['action']}"
+
+
+def format_relationship(from_node, relation_type, to_node):
+    """图关系三元组的文本形式"""
+    return (f"{from_node['id']}({from_node['properties'].get('职位', '')}) -[{relation_type}]-> "
+            f"{to_node['id']}({to_node['properties'].get('职位', '')})")
+
+
+def relationship_key(from_id, relation_type, to_id):
+    return f"graph:{from_id}-{relation_type}-{to_id}"
+
+
+class UnifiedIndex:
+    """跨数据源的向量索引：条目以字符串键标识（如 sql:config:<key>、graph:<from>-<type>-<to>），
+    文本未变化的条目不会重新编码"""
+
+    def __init__(self, model, dimension=384, path=None, save_delay=2.0):
+        self.model = model
+        self.dimension = dimension
+        self.path = path
+        self.save_delay = save_delay  # 变更后延迟保存的秒数，期间的多次变更合并为一次写入
+        self.persist = True  # prefork的worker只更新内存，由持久化写操作的主进程负责保存
+        self._save_timer = None
+        self._timer_lock = threading.Lock()
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        self.entries = {}  # 向量ID -> {'key', 'source', 'kind', 'text', 'hash'}
+        self.ids = {}  # 键 -> 向量ID
+        self._next_id = 0
+        self._lock = RWLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def reset(self, model, dimension):
+        """切换编码模型并清空索引（之后需调用sync按新模型重新编码全部条目）"""
+        with self._lock.write_lock():
+            self.model = model
+            self.dimension = dimension
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+            self.entries = {}
+            self.ids = {}
+            self._next_id = 0
+
+    def memory_stats(self):
+        """向量索引大小与条目文本的估算内存（字节）"""
+        with self._lock.read_lock():
+            return dict(faiss_size(self.index), entries_bytes=deep_size(self.entries))
+
+    def upsert(self, entries):
+        """新增或更新条目：entries为 (key, source, kind, text) 列表，返回重新编码的条目数"""
+        with self._lock.read_lock():
+            changed = {}
+            for key, source, kind, text in entries:
+                text_hash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+                current = self.ids.get(key)
+                if current is None or self.entries[current]['hash'] != text_hash:
+                    changed[key] = {'key': key, 'source': source, 'kind': kind, 'text': text, 'hash': text_hash}
+        if not changed:
+            return 0
+
+        # 编码在锁外进行，查询不受影响
+        changed = list(changed.values())
+        embeddings = np.ascontiguousarray(self.model.encode([entry['text'] for entry in changed]), dtype='float32')
+        faiss.normalize_L2(embeddings)
+
+        with self._lock.write_lock():
+            stale = [self.ids[entry['key']] for entry in changed if entry['key'] in self.ids]
+            if stale:
+                self.index.remove_ids(np.array(stale, dtype=np.int64))
+                for vector_id in stale:
+                    del self.entries[vector_id]
+            ids = np.arange(self._next_id, self._next_id + len(changed), dtype=np.int64)
+            self._next_id += len(changed)
+            self.index.add_with_ids(embeddings, ids)
+            for vector_id, entry in zip(ids.tolist(), changed):
+                self.entries[vector_id] = entry
+                self.ids[entry['key']] = vector_id
+        return len(changed)
+
+    def remove(self, keys):
+        """删除条目"""
+        with self._lock.write_lock():
+            ids = [self.ids.pop(key) for key in keys if key in self.ids]
+            if ids:
+                self.index.remove_ids(np.array(ids, dtype=np.int64))
+                for vector_id in ids:
+                    del self.entries[vector_id]
+        return len(ids)
+
+    def search(self, query_embedding, k=5, sources=None):
+        """检索最相似的条目，sources可限定数据源（如 {"sql", "graph"}）"""
+        with self._lock.read_lock():
+            if not self.entries:
+                return []
+            # 限定数据源时多取候选再过滤
+            search_k = min(len(self.entries), k if sources is None else k * 4)
+            query = np.ascontiguousarray(query_embedding, dtype='float32').reshape(1, -1)
+            scores, ids = self.index.search(query, search_k)
+            results = []
+            for score, vector_id in zip(scores[0], ids[0]):
+                entry = self.entries.get(int(vector_id))
+                if entry is None or (sources is not None and entry['source'] not in sources):
+                    continue
+                results.append({'key': entry['key'], 'source': entry['source'], 'kind': entry['kind'],
+                                'text': entry['text'], 'score': float(score)})
+                if len(results) >= k:
+                    break
+        return results
+
+    # ---- 数据源同步 ----
+
+    @staticmethod
+    def sql_entries(sql_db):
+        """SQL数据库中全部配置和规则对应的条目"""
+        entries = [(f"sql:config:{row['key']}", "sql", "config", format_config(row))
+                   for row in sql_db.all_configs()]
+        entries.extend((f"sql:rule:{row['id']}", "sql", "rule", format_rule(row))
+                       for row in sql_db.all_rules())
+        return entries
+
+    @staticmethod
+    def graph_entries(graph_db, node_ids=None):
+        """图数据库中关系三元组对应的条目（node_ids限定只取涉及这些节点的关系）"""
+        return [(relationship_key(from_node['id'], relation_type, to_node['id']), "graph", "relationship",
+                 format_relationship(from_node, relation_type, to_node))
+                for from_node, relation_type, to_node in graph_db.triples(node_ids)]
+
+    def sync(self, sql_db=None, graph_db=None):
+        """与数据源全量对账：新增/变更的条目重新编码，已不存在的条目删除"""
+        entries = []
+        prefixes = []
+        if sql_db is not None:
+            entries.extend(self.sql_entries(sql_db))
+            prefixes.append("sql:")
+        if graph_db is not None:
+            entries.extend(self.graph_entries(graph_db))
+            prefixes.append("graph:")
+        encoded = self.upsert(entries)
+
+        current = {entry[0] for entry in entries}
+        with self._lock.read_lock():
+            stale = [key for key in self.ids if key.startswith(tuple(prefixes)) and key not in current]
+        removed = self.remove(stale)
+        if encoded or removed:
+            logger.info(f"统一索引已同步：编码 {encoded} 条，删除 {removed} 条，共 {len(self)} 条")
+            if self.persist:
+                self.save()
+        return encoded, removed
+
+    def on_sql_change(self, kind, row):
+        """SqlDB变更回调"""
+        if kind == "config":
+            self.upsert([(f"sql:config:{row['key']}", "sql", "config", format_config(row))])
+        elif kind == "rule":
+            self.upsert([(f"sql:rule:{row['id']}", "sql", "rule", format_rule(row))])
+        self._schedule_save()
+
+    def on_graph_change(self, kind, item, graph_db):
+        """GraphDB变更回调：新增关系时编码该三元组；节点属性变化时重新渲染涉及该节点的三元组"""
+        if kind == "relationship":
+            self.upsert(self.graph_entries(graph_db, {item['from'], item['to']}))
+        elif kind == "node":
+            self.upsert(self.graph_entries(graph_db, {item['id']}))
+        self._schedule_save()
+
+    # ---- 持久化 ----
+
+    def _schedule_save(self):
+        """变更后延迟save_delay秒保存；已有待执行的保存时不重复安排"""
+        if not self.persist or self.path is None:
+            return
+        with self._timer_lock:
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(self.save_delay, self._scheduled_save)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def _scheduled_save(self):
+        with self._timer_lock:
+            self._save_timer = None
+        try:
+            self.save()
+        except Exception as e:
+            logger.warning(f"保存统一索引失败: {e}")
+
+    def flush(self):
+        """立即保存尚未写入的变更（关闭时调用）"""
+        with self._timer_lock:
+            timer, self._save_timer = self._save_timer, None
+        if timer is not None:
+            timer.cancel()
+            self.save()
+
+    def after_fork(self):
+        """fork出的worker中调用：父进程的保存定时器不会被继承，worker不再写索引文件"""
+        self.persist = False
+        self._save_timer = None
+        self._timer_lock = threading.Lock()
+
+    def save(self, path=None):
+        """保存索引和条目（<path>.index / <path>.entries.json）"""
+        path = path or self.path
+        if path is None:
+            return
+        with write_locked(path), self._lock.read_lock():
+            atomic_write_index(self.index, f"{path}.index")
+            atomic_write_json(f"{path}.entries.json", {
+                'next_id': self._next_id,
+                'entries': {str(vector_id): entry for vector_id, entry in self.entries.items()}
+            })
+
+    def load(self, path=None):
+        """加载索引和条目，文件不存在或不一致时返回False"""
+        path = path or self.path
+        if path is None or not os.path.exists(f"{path}.entries.json"):
+            return False
+        try:
+            with read_locked(path):
+                index = faiss.read_index(f"{path}.index")
+                with open(f"{path}.entries.json", 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            entries = {int(vector_id): entry for vector_id, entry in data['entries'].items()}
+            if index.ntotal != len(entries) or index.d != self.dimension:
+                return False
+            with self._lock.write_lock():
+                self.index = index
+                self.entries = entries
+                self.ids = {entry['key']: vector_id for vector_id, entry in entries.items()}
+                self._next_id = data['next_id']
+            return True
+        except Exception as e:
+            logger.warning(f"加载统一索引失败: {e}")
+            return False
@@ -1,109 +1,380 @@
 """
 向量检索模块：FAISS向量数据库
 """
+import logging
 import faiss
+import heapq
+import json
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import pickle
+from concurrent.futures import ThreadPoolExecutor
 import os
+import threading
+from ..persistence import RWLock, atomic_write_json, read_locked, write_locked
+from ..telemetry import telemetry
+from .embedding_store import EmbeddingStore, content_hash, model_slug
+from .vector_shard import VectorShard
+
+logger = logging.getLogger(__name__)
 
 class VectorDB:
-    def __init__(self, model_name=None):
+    def __init__(self, model_name=None, hybrid=True, fusion="weighted", dense_weight=0.6, rrf_k=60,
+                 max_shard_size=100000, search_workers=4, index_factory=None, embedding_dtype="float16",
+                 model=None):
         # 优先使用中文优化模型（强制CPU）
         device = 'cpu'  # 强制使用CPU
-        if model_name is None:
+        if model is not None:
+            # 直接使用已加载的编码模型（需提供encode方法）
+            self.model_name = model_name or type(model).__name__
+            self.model = model
+            getter = getattr(model, "get_sentence_embedding_dimension", None)
+            self.dimension = getter() if getter else 384
+        elif model_name is None:
+            # 只在需要加载模型时导入（传入model时不依赖sentence_transformers）
+            from sentence_transformers import SentenceTransformer
             try:
-                self.model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2", device=device)
+                self.model_name = "sentence-transformers/all-MiniLM-L6-v2"
+                self.model = SentenceTransformer(self.model_name, device=device)
                 self.dimension = 384
             except:
-                self.model = SentenceTransformer("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2", device=device)
+                self.model_name = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+                self.model = SentenceTransformer(self.model_name, device=device)
                 self.dimension = 384
         else:
+            from sentence_transformers import SentenceTransformer
+            self.model_name = model_name
             self.model = SentenceTransformer(model_name, device=device)
             self.dimension = 384  # 默认维度
         
-        self.index = None
-        self.documents = []
+        self.hybrid = hybrid
+        self.fusion = fusion  # "weighted"（归一化加权）或 "rrf"（倒数排名融合）
+        self.dense_weight = dense_weight
+        self.rrf_k = rrf_k
+        
+        # 分片：每个分片独立持有FAISS索引、文档、BM25倒排和元数据，
+        # 新文档写入最后一个热分片，写满后自动新建分片
+        self.shards = []
+        self.max_shard_size = max_shard_size
+        self.search_workers = search_workers
+        self.index_factory = index_factory  # 新建分片的FAISS索引类型，None表示IndexFlatIP
+        self.generation = 0  # 当前索引代数，后台重建完成后递增
         
-    def add_documents(self, docs):
-        """添加文档到向量数据库"""
+        # 原始向量持久化到 <path>.embeddings/<模型>/，重建索引时只编码新增或变更的文档
+        self.embedding_dtype = embedding_dtype
+        self.embedding_root = None
+        self._embedding_stores = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(search_workers, 1),
+                                            thread_name_prefix="vector-shard")
+        self._lock = RWLock()
+        self._reranker = None
+        self._reranker_lock = threading.Lock()
+    
+    @property
+    def documents(self):
+        """按分片顺序拼接的全部文档"""
+        with self._lock.read_lock():
+            return [doc for shard in self.shards for doc in shard.documents]
+    
+    def __len__(self):
+        with self._lock.read_lock():
+            return sum(len(shard) for shard in self.shards)
+    
+    def add_documents(self, docs, metadata=None):
+        """添加文档到向量数据库（metadata为与docs等长的字典列表，可选）"""
         if not docs:
             return
+        if metadata is not None and len(metadata) != len(docs):
+            raise ValueError("metadata数量必须与文档数量一致")
+        metadata = metadata or [None] * len(docs)
             
-        # 生成embeddings
-        embeddings = self.model.encode(docs)
+        # 生成embeddings（已持久化的文档直接读取）
+        with self._lock.read_lock():
+            model_name, model, dimension = self.model_name, self.model, self.dimension
+        embeddings = self.encode_documents(docs, model_name, model, dimension)
+        
+        with self._lock.write_lock():
+            self.append_to_shards(self.shards, docs, embeddings, metadata)
+            total = sum(len(shard) for shard in self.shards)
+        
+        logger.info(f"已添加 {len(docs)} 个文档，总计 {total} 个文档")
+    
+    def embedding_store(self, model_name, dimension):
+        """获取模型对应的向量存储；未设置存储目录时返回None"""
+        if self.embedding_root is None:
+            return None
+        store = self._embedding_stores.get(model_name)
+        if store is None:
+            store = EmbeddingStore(os.path.join(self.embedding_root, model_slug(model_name)),
+                                   model_name, dimension, self.embedding_dtype)
+            self._embedding_stores[model_name] = store
+        return store
+    
+    def encode_documents(self, docs, model_name, model, dimension, batch_size=256):
+        """编码文档为归一化向量，只对向量存储中缺失的文档运行模型"""
+        store = self.embedding_store(model_name, dimension)
+        if store is not None:
+            return store.encode(docs, model.encode, batch_size)
+        
+        embeddings = np.ascontiguousarray(model.encode(docs), dtype='float32')
         
-        # 初始化FAISS索引
-        if self.index is None:
-            self.index = faiss.IndexFlatIP(self.dimension)  # 内积相似度
-            
         # 标准化向量（用于余弦相似度）
         faiss.normalize_L2(embeddings)
+        return embeddings
+    
+    def compact_embeddings(self):
+        """合并当前模型的向量存储，丢弃已不在库中的文档向量"""
+        with self._lock.read_lock():
+            model_name, dimension = self.model_name, self.dimension
+            keep = {content_hash(doc) for shard in self.shards for doc in shard.documents}
+        store = self.embedding_store(model_name, dimension)
+        if store is not None:
+            store.compact(keep)
+    
+    def append_to_shards(self, shards, docs, embeddings, metadata, dimension=None, index_factory=None):
+        """将已归一化的向量写入分片列表的最后一个热分片，写满后新建分片（调用方负责加锁）"""
+        dimension = dimension or self.dimension
+        index_factory = index_factory or self.index_factory
+        start = 0
+        while start < len(docs):
+            shard = shards[-1] if shards else None
+            if shard is None or shard.cold or len(shard) >= self.max_shard_size:
+                used = {existing.name for existing in shards}
+                number = len(shards)
+                while f"shard_{number:03d}" in used:
+                    number += 1
+                shard = VectorShard(f"shard_{number:03d}", dimension, index_factory=index_factory)
+                shards.append(shard)
+            end = min(len(docs), start + self.max_shard_size - len(shard))
+            shard.add(docs[start:end], embeddings[start:end], metadata[start:end])
+            start = end
+    
+    def rows_since(self, snapshot):
+        """取出快照 {分片名: 已取行数} 之后新增的文档和元数据，并推进快照（后台重建补齐新增文档用）"""
+        with self._lock.read_lock():
+            return self._rows_since(snapshot)
+    
+    def _rows_since(self, snapshot):
+        """同rows_since（调用方持有锁）"""
+        names = {shard.name for shard in self.shards}
+        if not set(snapshot) <= names:
+            raise RuntimeError("重建期间有分片被卸载，放弃本次重建")
+        docs, metadata = [], []
+        for shard in self.shards:
+            shard_docs, shard_metadata = shard.rows(snapshot.get(shard.name, 0))
+            snapshot[shard.name] = snapshot.get(shard.name, 0) + len(shard_docs)
+            docs.extend(shard_docs)
+            metadata.extend(shard_metadata)
+        return docs, metadata
+    
+    def swap_generation(self, shards, generation, model_name=None, model=None, dimension=None,
+                        index_factory=None, snapshot=None, catch_up=None):
+        """原子切换到新一代分片；正在执行的查询继续使用旧分片直到返回
         
-        # 添加到索引
-        self.index.add(embeddings.astype('float32'))
-        self.documents.extend(docs)
+        catch_up(docs, metadata): 切换前在写锁内把snapshot之后新增的文档补齐到新分片，
+        补齐与切换之间不会再有新文档写入
+        """
+        with self._lock.write_lock():
+            if catch_up is not None:
+                docs, metadata = self._rows_since(snapshot)
+                if docs:
+                    catch_up(docs, metadata)
+            old_shards = self.shards
+            self.shards = shards
+            self.generation = generation
+            if model is not None:
+                self.model_name = model_name
+                self.model = model
+            if dimension is not None:
+                self.dimension = dimension
+            if index_factory is not None:
+                self.index_factory = index_factory
+        return old_shards
+    
+    def add_shard(self, shard):
+        """挂载一个已构建好的分片（无需重建其他分片）"""
+        with self._lock.write_lock():
+            if any(existing.name == shard.name for existing in self.shards):
+                raise ValueError(f"分片 {shard.name} 已存在")
+            self.shards.append(shard)
+        logger.info(f"已挂载分片 {shard.name}，包含 {len(shard)} 个文档")
+    
+    def remove_shard(self, name):
+        """卸载分片，返回被卸载的分片（不存在时返回None）"""
+        with self._lock.write_lock():
+            for position, shard in enumerate(self.shards):
+                if shard.name == name:
+                    del self.shards[position]
+                    logger.info(f"已卸载分片 {name}")
+                    return shard
+        return None
+    
+    def _search_shards(self, shards, query_embedding, query, search_k, hybrid, filters):
+        """并行检索各分片"""
+        def search_one(shard):
+            return shard.search(query_embedding, query, search_k, hybrid, filters)
         
-        print(f"已添加 {len(docs)} 个文档，总计 {len(self.documents)} 个文档")
+        if len(shards) <= 1 or self.search_workers <= 1:
+            return [search_one(shard) for shard in shards]
+        return list(self._executor.map(search_one, shards))
     
-    def search(self, query, k=5, use_rerank=True):
-        """搜索相似文档"""
-        if self.index is None or len(self.documents) == 0:
+    def search(self, query, k=5, use_rerank=True, hybrid=None, filters=None):
+        """搜索相似文档
+        
+        filters: 元数据过滤条件，如 {"category": "教程", "timestamp": (start, end)}，
+        在FAISS检索时通过ID选择器生效，不需要事后过滤
+        """
+        # 同时取出模型和分片列表，保证查询向量与所检索的索引代数一致
+        with self._lock.read_lock():
+            model = self.model
+            shards = [shard for shard in self.shards if len(shard)]
+        if not shards:
             return []
+        hybrid = self.hybrid if hybrid is None else hybrid
             
         # 生成查询向量
-        query_embedding = self.model.encode([query])
-        faiss.normalize_L2(query_embedding)
+        with telemetry.span("vector.encode"):
+            query_embedding = np.asarray(model.encode([query]), dtype='float32')
+            faiss.normalize_L2(query_embedding)
+            query_embedding = query_embedding[0]
         
-        # 搜索更多候选用于重排序
-        search_k = min(k * 4, len(self.documents)) if use_rerank else min(k, len(self.documents))
-        scores, indices = self.index.search(query_embedding.astype('float32'), search_k)
+        # 搜索更多候选用于重排序；各分片取同样数量的候选后用堆合并top-k
+        search_k = k * 4 if use_rerank else k
+        with telemetry.span("vector.search", shards=len(shards), hybrid=hybrid):
+            shard_results = self._search_shards(shards, query_embedding, query, search_k, hybrid, filters)
+            candidates = [result for results in shard_results for result in results]
+            if hybrid:
+                self._fuse_hybrid(candidates)
+            results = heapq.nlargest(search_k, candidates, key=lambda r: r['score'])
         
-        # 返回结果
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < len(self.documents):
-                results.append({
-                    'document': self.documents[idx],
-                    'score': float(score)
-                })
-        
-        # 重排序
+        # 重排序（重排序器常驻，分数缓存跨查询复用）
         if use_rerank and len(results) > k:
-            from .reranker import VectorReranker
-            reranker = VectorReranker(self.model)
-            results = reranker.rerank_vector_results(query, results, k)
+            results = self.get_reranker().rerank_vector_results(query, results, k)
         
         return results[:k]
     
+    def get_reranker(self):
+        """懒加载重排序器（交叉编码器模型只加载一次）"""
+        if self._reranker is None:
+            with self._reranker_lock:
+                if self._reranker is None:
+                    from .reranker import VectorReranker
+                    self._reranker = VectorReranker(self.model)
+        return self._reranker
+    
+    def after_fork(self):
+        """fork出的子进程中调用：父进程的检索线程池不会被子进程继承，重新创建"""
+        self._executor = ThreadPoolExecutor(max_workers=max(self.search_workers, 1),
+                                            thread_name_prefix="vector-shard")
+    
+    def memory_stats(self):
+        """各分片、向量存储和重排序器的内存统计"""
+        with self._lock.read_lock():
+            shards = list(self.shards)
+            stores = dict(self._embedding_stores)
+        reranker = self._reranker
+        return {'shards': [shard.memory_stats() for shard in shards],
+                'embedding_stores': {name: store.memory_stats() for name, store in stores.items()},
+                'reranker': reranker.memory_stats() if reranker is not None else None}
+    
+    def rerank_stats(self):
+        """重排序跳过率、缓存命中率和估算节省的时间"""
+        return self._reranker.get_stats() if self._reranker is not None else {}
+    
+    def _fuse_hybrid(self, candidates):
+        """在合并后的全部候选上融合稠密与稀疏分数，使各分片的分数可比"""
+        if self.fusion == "rrf":
+            dense_order = sorted(candidates, key=lambda r: r['dense_score'], reverse=True)
+            sparse_order = sorted((r for r in candidates if r['sparse_score'] > 0),
+                                  key=lambda r: r['sparse_score'], reverse=True)
+            for result in candidates:
+                result['score'] = 0.0
+            for rank, result in enumerate(dense_order):
+                result['score'] += self.dense_weight / (self.rrf_k + rank + 1)
+            for rank, result in enumerate(sparse_order):
+                result['score'] += (1 - self.dense_weight) / (self.rrf_k + rank + 1)
+        else:
+            max_sparse = max((r['sparse_score'] for r in candidates), default=0.0)
+            for result in candidates:
+                sparse = result['sparse_score'] / max_sparse if max_sparse > 0 else 0.0
+                result['score'] = self.dense_weight * result['dense_score'] + (1 - self.dense_weight) * sparse
+    
+    @staticmethod
+    def shard_dir(path, generation):
+        """第generation代分片所在目录（第0代沿用 <path>.shards）"""
+        return f"{path}.shards" if generation == 0 else f"{path}.shards.g{generation}"
+    
     def save(self, path):
-        """保存向量数据库"""
-        os.makedirs(os.path.dirname(path), exist_ok=True)
+        """保存向量数据库：分片写入当前代的分片目录，最后原子替换清单 <path>.manifest.json
         
-        # 保存FAISS索引
-        if self.index is not None:
-            faiss.write_index(self.index, f"{path}.index")
-        
-        # 保存文档
-        with open(f"{path}.docs", 'wb') as f:
-            pickle.dump(self.documents, f)
+        清单即当前代的指针，读者看到的清单总是指向完整的一代分片
+        """
+        shard_dir = self.shard_dir(path, self.generation)
+        if self.embedding_root is None:
+            self.embedding_root = f"{path}.embeddings"
+        # 分片文件分别原子替换，整体持有跨进程写锁；清单最后写入，读者看到的清单总是指向完整的分片。
+        # 只写有变化的分片，未变化的分片文件保持不动
+        with write_locked(path), self._lock.read_lock():
+            written = sum(shard.save(os.path.join(shard_dir, shard.name)) for shard in self.shards)
+            
+            atomic_write_json(f"{path}.manifest.json", {
+                'version': 1,
+                'generation': self.generation,
+                'model_name': self.model_name,
+                'dimension': self.dimension,
+                'index_factory': self.index_factory,
+                'shards': [{'name': shard.name, 'documents': len(shard), 'cold': shard.cold}
+                           for shard in self.shards]
+            }, indent=2)
             
-        print(f"向量数据库已保存到 {path}")
+        logger.info(f"向量数据库已保存到 {path}（写入 {written} 个有变化的分片）")
     
-    def load(self, path):
-        """加载向量数据库"""
+    def load(self, path, cold_shards=None):
+        """加载向量数据库
+        
+        cold_shards: 以内存映射方式加载的分片名集合（只读）；为None时沿用清单中的标记。
+        没有清单时按旧版单文件布局（<path>.index/.docs）加载为单个分片
+        """
         try:
-            # 加载FAISS索引
-            if os.path.exists(f"{path}.index"):
-                self.index = faiss.read_index(f"{path}.index")
+            with read_locked(path):
+                manifest_path = f"{path}.manifest.json"
+                if os.path.exists(manifest_path):
+                    with open(manifest_path, 'r', encoding='utf-8') as f:
+                        manifest = json.load(f)
+                    generation = manifest.get('generation', 0)
+                    shard_dir = self.shard_dir(path, generation)
+                    shards = []
+                    for entry in manifest['shards']:
+                        cold = entry.get('cold', False) if cold_shards is None else entry['name'] in cold_shards
+                        shards.append(VectorShard.load(entry['name'], os.path.join(shard_dir, entry['name']),
+                                                       manifest.get('dimension', self.dimension), cold))
+                elif os.path.exists(f"{path}.docs"):
+                    manifest = {}
+                    generation = 0
+                    shards = [VectorShard.load("shard_000", path, self.dimension)]
+                else:
+                    manifest = {}
+                    generation = 0
+                    shards = []
+            
+            # 清单记录的模型与当前不同（后台重建换过模型）时，查询必须使用同一模型编码
+            model_name = manifest.get('model_name') or self.model_name
+            if model_name == self.model_name:
+                model = self.model
+            else:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(model_name, device='cpu')
             
-            # 加载文档
-            if os.path.exists(f"{path}.docs"):
-                with open(f"{path}.docs", 'rb') as f:
-                    self.documents = pickle.load(f)
+            with self._lock.write_lock():
+                self.embedding_root = f"{path}.embeddings"
+                self.shards = shards
+                self.generation = generation
+                self.model_name = model_name
+                self.model = model
+                self.dimension = manifest.get('dimension', self.dimension)
+                self.index_factory = manifest.get('index_factory', self.index_factory)
+                total = sum(len(shard) for shard in self.shards)
                     
-            print(f"向量数据库已从 {path} 加载，包含 {len(self.documents)} 个文档")
+            logger.info(f"向量数据库已从 {path} 加载，包含 {len(shards)} 个分片、{total} 个文档")
             return True
         except Exception as e:
-            print(f"加载向量数据库失败: {e}")
-            return False
\ No newline at end of file
+            logger.warning(f"加载向量数据库失败: {e}")
+            return False
@@ -0,0 +1,182 @@
+"""
+向量分片模块：单个分片拥有独立的FAISS索引、文档、BM25倒排和元数据
+"""
+import os
+import pickle
+import shutil
+
+import faiss
+import numpy as np
+
+from ..diagnostics import deep_size, faiss_size
+from ..persistence import RWLock, atomic_write, atomic_write_index, atomic_write_pickle
+from .bm25 import BM25Index
+from .metadata_store import MetadataStore
+
+
+class VectorShard:
+    def __init__(self, name, dimension=384, cold=False, index_factory=None):
+        self.name = name
+        self.dimension = dimension
+        self.index_factory = index_factory  # FAISS index_factory描述串，None表示IndexFlatIP
+        self.cold = cold  # 冷分片以内存映射方式加载，只读
+        self.source = None  # 加载来源路径前缀
+        self.saved_prefix = None  # 与内存内容一致的磁盘文件前缀（加载或保存后设置，新增文档后清空）
+        self.index = None
+        self.documents = []
+        self.bm25 = BM25Index()
+        self.metadata = MetadataStore()
+        self._lock = RWLock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, docs, embeddings, metadata=None):
+        """添加已归一化的文档向量"""
+        if self.cold:
+            raise ValueError(f"分片 {self.name} 为只读冷分片")
+        with self._lock.write_lock():
+            embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+
+            # 初始化FAISS索引
+            if self.index is None:
+                if self.index_factory:
+                    self.index = faiss.index_factory(self.dimension, self.index_factory,
+                                                     faiss.METRIC_INNER_PRODUCT)
+                else:
+                    self.index = faiss.IndexFlatIP(self.dimension)  # 内积相似度
+            if not self.index.is_trained:
+                self.index.train(embeddings)
+
+            # 添加到索引
+            self.index.add(embeddings)
+            self.saved_prefix = None
+            self.documents.extend(docs)
+            self.bm25.add_documents(docs)
+            self.metadata.append(metadata or [None] * len(docs))
+
+    def memory_stats(self):
+        """索引、文档、BM25倒排和元数据的估算内存（字节）"""
+        with self._lock.read_lock():
+            return {'name': self.name, 'cold': self.cold, 'index': faiss_size(self.index),
+                    'documents_bytes': deep_size(self.documents), 'bm25_bytes': deep_size(self.bm25),
+                    'metadata_bytes': deep_size(self.metadata)}
+
+    def rows(self, start=0):
+        """返回从start开始的文档和元数据（用于重建索引）"""
+        with self._lock.read_lock():
+            end = len(self.documents)
+            return self.documents[start:end], [self.metadata.get(i) for i in range(start, end)]
+
+    def search(self, query_embedding, query, search_k, hybrid=True, filters=None):
+        """在分片内检索候选，返回带原始稠密/稀疏分数的结果列表（融合在合并各分片后进行）"""
+        with self._lock.read_lock():
+            if self.index is None or len(self.documents) == 0:
+                return []
+            mask = self.metadata.compile(filters)
+            allowed = len(self.documents) if mask is None else int(mask.sum())
+            if allowed == 0:
+                return []
+
+            search_k = min(search_k, allowed)
+            query_matrix = query_embedding.reshape(1, -1)
+            if mask is None:
+                scores, indices = self.index.search(query_matrix, search_k)
+            else:
+                selector = faiss.IDSelectorBitmap(np.packbits(mask, bitorder='little'))
+                scores, indices = self.index.search(query_matrix, search_k,
+                                                    params=faiss.SearchParameters(sel=selector))
+            dense_scores = {int(idx): float(score) for score, idx in zip(scores[0], indices[0])
+                            if 0 <= idx < len(self.documents)}
+
+            if not hybrid:
+                return [self._result(idx, score) for idx, score in dense_scores.items()]
+
+            sparse_ids, sparse_values = self.bm25.search(query, search_k, mask)
+            sparse_scores = {int(idx): float(score) for idx, score in zip(sparse_ids, sparse_values)
+                             if idx < len(self.documents)}
+
+            # 只被BM25召回的文档，从索引中取回向量补算余弦分数
+            missing = [idx for idx in sparse_scores if idx not in dense_scores]
+            if missing:
+                try:
+                    vectors = np.vstack([self.index.reconstruct(idx) for idx in missing])
+                    for idx, score in zip(missing, vectors @ query_embedding):
+                        dense_scores[idx] = float(score)
+                except RuntimeError:
+                    # 部分索引类型不支持reconstruct
+                    for idx in missing:
+                        dense_scores[idx] = 0.0
+
+            return [self._result(idx, dense_scores[idx], dense_score=dense_scores[idx],
+                                 sparse_score=sparse_scores.get(idx, 0.0))
+                    for idx in dense_scores]
+
+    def _result(self, idx, score, **extra):
+        result = {
+            'id': idx,
+            'shard': self.name,
+            'document': self.documents[idx],
+            'metadata': self.metadata.get(idx),
+            'score': score
+        }
+        result.update(extra)
+        return result
+
+    def save(self, prefix):
+        """保存分片：<prefix>.index / .docs / .bm25.npz / .meta.npz；
+        自上次加载或保存后没有变化且目标位置相同时跳过，返回是否写入"""
+        with self._lock.read_lock():
+            prefix = os.path.abspath(prefix)
+            if self.saved_prefix == prefix and os.path.exists(f"{prefix}.docs"):
+                return False
+            # 保存FAISS索引（内存映射的冷分片只在保存到新位置时复制原文件）
+            if self.index is not None and not self.cold:
+                atomic_write_index(self.index, f"{prefix}.index")
+            elif self.cold and self.source is not None and \
+                    os.path.abspath(self.source) != os.path.abspath(prefix):
+                with open(f"{self.source}.index", 'rb') as source:
+                    atomic_write(f"{prefix}.index", lambda f: shutil.copyfileobj(source, f), mode='wb')
+
+            # 保存文档
+            atomic_write_pickle(f"{prefix}.docs", self.documents)
+
+            # 保存BM25倒排和元数据
+            self.bm25.save(f"{prefix}.bm25.npz")
+            self.metadata.save(f"{prefix}.meta.npz")
+            self.saved_prefix = prefix
+        return True
+
+    @classmethod
+    def load(cls, name, prefix, dimension=384, cold=False):
+        """加载分片，冷分片的FAISS索引以IO_FLAG_MMAP方式映射"""
+        shard = cls(name, dimension, cold)
+        shard.source = prefix
+
+        # 加载FAISS索引
+        if os.path.exists(f"{prefix}.index"):
+            flags = faiss.IO_FLAG_MMAP if cold else 0
+            shard.index = faiss.read_index(f"{prefix}.index", flags)
+
+        # 加载文档
+        if os.path.exists(f"{prefix}.docs"):
+            with open(f"{prefix}.docs", 'rb') as f:
+                shard.documents = pickle.load(f)
+
+        # 加载BM25倒排和元数据（与文档数不一致时重建，此时磁盘文件与内存不一致，下次保存时重写）
+        consistent = os.path.exists(f"{prefix}.docs")
+        if os.path.exists(f"{prefix}.bm25.npz"):
+            shard.bm25 = BM25Index.load(f"{prefix}.bm25.npz")
+        if shard.bm25.num_docs != len(shard.documents):
+            shard.bm25 = BM25Index()
+            shard.bm25.add_documents(shard.documents)
+            consistent = False
+        if os.path.exists(f"{prefix}.meta.npz"):
+            shard.metadata = MetadataStore.load(f"{prefix}.meta.npz")
+        if shard.metadata.size != len(shard.documents):
+            shard.metadata = MetadataStore()
+            shard.metadata.append([None] * len(shard.documents), stamp_missing=False)
+            consistent = False
+        if consistent:
+            shard.saved_prefix = os.path.abspath(prefix)
+        return shard
@@ -1,12 +1,28 @@
 """
 混合路由模块：Embedding + 本地LLM分类
 """
+import logging
 from sentence_transformers import SentenceTransformer, util
 import requests
 import json
+import os
+
+from ..telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+# LLM精筛使用的Ollama接口，可通过环境变量指向其他地址（如压测时的模拟服务）
+OLLAMA_URL = os.environ.get("CHERRY_OLLAMA_URL", "http://localhost:11434/api/generate")
+OLLAMA_MODEL = os.environ.get("CHERRY_OLLAMA_MODEL", "qwen2.5:1.5b")
+OLLAMA_TIMEOUT = float(os.environ.get("CHERRY_OLLAMA_TIMEOUT", "10"))
+
+_METHOD_NAMES = {"vocabulary": "词表", "llm": "LLM", "embedding": "Embedding"}
 
 class HybridRouter:
-    def __init__(self):
+    def __init__(self, ollama_url=None, ollama_model=None, ollama_timeout=None):
+        self.ollama_url = ollama_url or OLLAMA_URL
+        self.ollama_model = ollama_model or OLLAMA_MODEL
+        self.ollama_timeout = ollama_timeout or OLLAMA_TIMEOUT
         # 优先使用中文优化模型（强制CPU）
         import torch
         device = 'cpu'  # 强制使用CPU
@@ -23,11 +39,12 @@ class HybridRouter:
     
     def embedding_route(self, question):
         """Embedding初筛"""
-        q_emb = self.embed_model.encode([question])
-        scores = {}
-        for module, examples_emb in self.module_emb.items():
-            similarities = util.cos_sim(q_emb, examples_emb)
-            scores[module] = float(similarities.max())
+        with telemetry.span("route.embedding"):
+            q_emb = self.embed_model.encode([question])
+            scores = {}
+            for module, examples_emb in self.module_emb.items():
+                similarities = util.cos_sim(q_emb, examples_emb)
+                scores[module] = float(similarities.max())
         
         best_route = max(scores, key=scores.get)
         return best_route, scores
@@ -43,10 +60,11 @@ class HybridRouter:
 分类:"""
         
         try:
-            response = requests.post("http://localhost:11434/api/generate", 
-                json={"model": "qwen2.5:1.5b", "prompt": prompt, "stream": False},
-                timeout=10)
-            result = response.json()["response"].strip().lower()
+            with telemetry.span("route.llm"):
+                response = requests.post(self.ollama_url,
+                    json={"model": self.ollama_model, "prompt": prompt, "stream": False},
+                    timeout=self.ollama_timeout)
+                result = response.json()["response"].strip().lower()
             
             # 提取有效分类
             for route in ["vdb", "sql", "graph"]:
@@ -55,23 +73,33 @@ class HybridRouter:
             return "vdb"  # 默认返回vdb
             
         except Exception as e:
-            print(f"LLM路由失败: {e}")
+            logger.warning(f"LLM路由失败: {e}")
+            telemetry.incr("llm_route_failures")
             return "vdb"
     
-    def route(self, question, threshold=0.1):
-        """混合路由决策"""
+    def plan(self, question, threshold=0.1, analysis=None):
+        """不调用LLM的路由决策，返回 (路由, 分数, 方法)；需要LLM精筛时路由为None"""
         embed_route, scores = self.embedding_route(question)
         
         # 计算分数差异
         sorted_scores = sorted(scores.items(), key=lambda x: x[1], reverse=True)
         score_diff = sorted_scores[0][1] - sorted_scores[1][1]
         
-        # 如果分数差异小于阈值，使用LLM精筛
+        # 分数接近但问题只命中单一数据源的词表时，直接采用词表建议，省去LLM往返
+        suggested = analysis.suggested_route() if analysis is not None else None
+        if score_diff < threshold and suggested:
+            return suggested, scores, "vocabulary"
+        # 如果分数差异小于阈值，需要LLM精筛
         if score_diff < threshold:
+            return None, scores, "llm"
+        return embed_route, scores, "embedding"
+    
+    def route(self, question, threshold=0.1, analysis=None):
+        """混合路由决策（analysis为QueryAnalyzer的分析结果，可选）"""
+        final_route, scores, method = self.plan(question, threshold, analysis)
+        if final_route is None:
             final_route = self.llm_route(question)
-            print(f"使用LLM路由: {question} -> {final_route}")
-        else:
-            final_route = embed_route
-            print(f"使用Embedding路由: {question} -> {final_route}")
+        logger.debug(f"使用{_METHOD_NAMES[method]}路由: {question} -> {final_route}")
+        telemetry.incr("route_decisions", method=method, route=final_route)
         
-        return final_route, scores
\ No newline at end of file
+        return final_route, scores
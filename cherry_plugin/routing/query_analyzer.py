@@ -0,0 +1,285 @@
+"""
+查询分析模块：基于已知词表的Aho-Corasick自动机，一次线性扫描得到问题中的实体和关键词
+"""
+import re
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from ..diagnostics import deep_size
+
+_ASCII_WORD = re.compile(r'[a-z0-9_]')
+
+# 词表类别
+NODE = "node"  # 图节点ID
+PROPERTY = "property"  # 节点/关系属性值
+RELATIONSHIP = "relationship"  # 关系类型
+CONFIG = "config"  # 配置键
+RULE = "rule"  # 规则名
+
+GRAPH_KINDS = (NODE, PROPERTY, RELATIONSHIP)
+SQL_KINDS = (CONFIG, RULE)
+
+
+class AhoCorasick:
+    """可增量插入的Aho-Corasick自动机：插入时只为新建的trie节点计算失败指针，
+    并把以新节点为更长后缀的已有节点改指向它（匹配时不需要重建）"""
+
+    def __init__(self, terms: Iterable[str] = ()):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]  # 节点 -> 以该节点结尾的词条
+        self._fail_children = {}  # 节点 -> 失败指针指向它的节点（失败树，不记录根节点）
+        self._by_char = {}  # 字符 -> 经该字符进入的节点
+        # 初始词表先建trie再按BFS一次算出全部失败指针，比逐个增量插入快
+        goto, output = self._goto, self._output
+        for term in terms:
+            node = 0
+            for char in term:
+                child = goto[node].get(char)
+                if child is None:
+                    child = len(goto)
+                    goto[node][char] = child
+                    goto.append({})
+                    output.append(None)
+                node = child
+            if output[node] is None:
+                output[node] = term
+        self._fail = [0] * len(goto)
+        self._build()
+
+    def _build(self) -> None:
+        """按BFS计算全部失败指针和失败树"""
+        goto, fail, fail_children, by_char = self._goto, self._fail, self._fail_children, self._by_char
+        queue = deque()
+        for char, child in goto[0].items():
+            by_char.setdefault(char, []).append(child)
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                target = goto[state].get(char, 0)
+                fail[child] = target
+                if target:
+                    fail_children.setdefault(target, []).append(child)
+                by_char.setdefault(char, []).append(child)
+                queue.append(child)
+
+    def add(self, term: str) -> None:
+        node = 0
+        for char in term:
+            child = self._goto[node].get(char)
+            if child is None:
+                child = self._new_node(node, char)
+            node = child
+        if self._output[node] is None:
+            self._output[node] = term
+
+    def _new_node(self, parent: int, char: str) -> int:
+        node = len(self._goto)
+        self._goto[parent][char] = node
+        self._goto.append({})
+        self._fail.append(0)
+        self._output.append(None)
+        if parent:
+            state = self._fail[parent]
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            self._link(node, self._goto[state].get(char, 0))
+        self._redirect(node, parent, char)
+        self._by_char.setdefault(char, []).append(node)
+        return node
+
+    def _link(self, node: int, fail: int) -> None:
+        previous = self._fail[node]
+        if previous:
+            self._fail_children[previous].remove(node)
+        self._fail[node] = fail
+        if fail:
+            self._fail_children.setdefault(fail, []).append(node)
+
+    def _redirect(self, node: int, parent: int, char: str) -> None:
+        """已有节点中以新节点为最长真后缀的，失败指针改指向新节点"""
+        if not parent:
+            # 新的单字符节点：经该字符进入且失败指针指向根的节点都改指向它
+            for other in self._by_char.get(char, ()):
+                if not self._fail[other]:
+                    self._link(other, node)
+            return
+        # 以parent为后缀的状态即失败树中parent的子树。子树中的状态有char子节点时，
+        # 该子节点原来的失败指针比新节点短，改指向新节点；更深的状态会先匹配到该子节点，不必继续
+        stack = list(self._fail_children.get(parent, ()))
+        while stack:
+            state = stack.pop()
+            child = self._goto[state].get(char)
+            if child is not None:
+                self._link(child, node)
+            else:
+                stack.extend(self._fail_children.get(state, ()))
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """返回所有匹配 (start, end, term)"""
+        matches = []
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            state = node
+            while state:
+                term = self._output[state]
+                if term is not None:
+                    matches.append((position + 1 - len(term), position + 1, term))
+                state = self._fail[state]
+        return matches
+
+
+class QueryAnalysis:
+    """一次分析的结果：互不重叠的最长匹配及其类别"""
+
+    def __init__(self, question: str, matches: List[Tuple[int, int, str, Dict[str, Set[str]]]]):
+        self.question = question
+        self.matches = matches
+
+    def terms(self, *kinds: str) -> Set[str]:
+        """匹配到的词条（小写）；指定kinds时只返回属于这些类别的词条"""
+        return {term for _, _, term, payloads in self.matches
+                if not kinds or any(kind in payloads for kind in kinds)}
+
+    def values(self, kind: str) -> Set[str]:
+        """某一类别匹配到的原始值（如配置键、节点ID的原始大小写）"""
+        result = set()
+        for _, _, _, payloads in self.matches:
+            result.update(payloads.get(kind, ()))
+        return result
+
+    def has(self, *kinds: str) -> bool:
+        return any(kind in payloads for _, _, _, payloads in self.matches for kind in kinds)
+
+    def suggested_route(self) -> Optional[str]:
+        """问题只命中单一数据源的词表时给出路由建议"""
+        graph, sql = self.has(*GRAPH_KINDS), self.has(*SQL_KINDS)
+        if graph and not sql:
+            return "graph"
+        if sql and not graph:
+            return "sql"
+        return None
+
+    def __bool__(self):
+        return bool(self.matches)
+
+    def __repr__(self):
+        return f"QueryAnalysis({[(term, sorted(payloads)) for _, _, term, payloads in self.matches]})"
+
+
+class QueryAnalyzer:
+    """从图节点ID、属性值、关系类型、配置键、规则名构建词表，所有检索器共享同一次分析结果"""
+
+    def __init__(self, sql_db=None, graph_db=None, min_length=2, cache_size=256):
+        self.min_length = min_length  # 过短的词条（如单字属性值）不进入词表，避免噪声匹配
+        self.cache_size = cache_size
+        self._vocabulary = {}  # 小写词条 -> {类别: {原始值}}
+        self._automaton = None  # 初始词表加载完后一次性构建，之后增量插入
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        if sql_db is not None:
+            for row in sql_db.all_configs():
+                self.add_term(row['key'], CONFIG)
+            for row in sql_db.all_rules():
+                self.add_term(row['name'], RULE)
+            sql_db.add_listener(self.on_sql_change)
+        if graph_db is not None:
+            for node in graph_db.nodes():
+                self._add_node(node)
+            for rel in graph_db.relationships():
+                self._add_relationship(rel)
+            graph_db.add_listener(self.on_graph_change)
+        with self._lock:
+            self._automaton = AhoCorasick(list(self._vocabulary))
+
+    def __len__(self):
+        return len(self._vocabulary)
+
+    def memory_stats(self) -> dict:
+        """词条数与词表、自动机、分析缓存的估算内存（字节）"""
+        with self._lock:
+            return {'terms': len(self._vocabulary),
+                    'bytes': deep_size(self._vocabulary) + deep_size(self._automaton) + deep_size(self._cache)}
+
+    def add_term(self, value, kind: str) -> None:
+        """加入词表（增量插入自动机）"""
+        value = str(value).strip()
+        term = value.lower()
+        if len(term) < self.min_length:
+            return
+        with self._lock:
+            self._vocabulary.setdefault(term, {}).setdefault(kind, set()).add(value)
+            if self._automaton is not None:
+                self._automaton.add(term)
+            self._cache.clear()
+
+    def _add_node(self, node: Dict) -> None:
+        self.add_term(node["id"], NODE)
+        for value in node.get("properties", {}).values():
+            if isinstance(value, str):
+                self.add_term(value, PROPERTY)
+
+    def _add_relationship(self, rel: Dict) -> None:
+        self.add_term(rel["type"], RELATIONSHIP)
+        for value in rel.get("properties", {}).values():
+            if isinstance(value, str):
+                self.add_term(value, PROPERTY)
+
+    def on_sql_change(self, kind: str, row: Dict) -> None:
+        """SqlDB变更回调"""
+        if kind == "config":
+            self.add_term(row['key'], CONFIG)
+        elif kind == "rule":
+            self.add_term(row['name'], RULE)
+
+    def on_graph_change(self, kind: str, item: Dict, graph_db=None) -> None:
+        """GraphDB变更回调"""
+        if kind == "node":
+            self._add_node(item)
+        elif kind == "relationship":
+            self._add_relationship(item)
+
+    @staticmethod
+    def _on_boundary(text: str, start: int, end: int) -> bool:
+        """英文/数字词条要求两侧不是字母数字，避免 api 匹配 rapid 这类子串"""
+        if start > 0 and _ASCII_WORD.match(text[start - 1]) and _ASCII_WORD.match(text[start]):
+            return False
+        if end < len(text) and _ASCII_WORD.match(text[end]) and _ASCII_WORD.match(text[end - 1]):
+            return False
+        return True
+
+    def analyze(self, question: str) -> QueryAnalysis:
+        """线性扫描问题，保留从左到右互不重叠的最长匹配"""
+        with self._lock:
+            cached = self._cache.get(question)
+            if cached is not None:
+                self._cache.move_to_end(question)
+                return cached
+
+            text = question.lower()
+            candidates = [(start, end, term) for start, end, term in self._automaton.find(text)
+                          if self._on_boundary(text, start, end)]
+            candidates.sort(key=lambda m: (m[0], -(m[1] - m[0])))
+            matches = []
+            covered = 0
+            for start, end, term in candidates:
+                if start < covered:
+                    continue
+                payloads = {kind: set(values) for kind, values in self._vocabulary[term].items()}
+                matches.append((start, end, term, payloads))
+                covered = end
+
+            analysis = QueryAnalysis(question, matches)
+            self._cache[question] = analysis
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return analysis
@@ -0,0 +1,278 @@
+"""
+遥测模块：请求链路的分阶段span、直方图和计数器，可导出为JSON快照或Prometheus文本格式；
+日志统一输出到stderr（可选写文件），stdio传输下不占用协议通道
+"""
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .persistence import atomic_write
+
+# 直方图桶上界（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def configure_logging(level=None, log_file=None):
+    """cherry_plugin日志输出到stderr，设置log_file或CHERRY_LOG_FILE时同时写文件；重复调用不会重复添加handler"""
+    logger = logging.getLogger("cherry_plugin")
+    level = level or os.environ.get("CHERRY_LOG_LEVEL", "INFO")
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+    log_file = log_file or os.environ.get("CHERRY_LOG_FILE")
+
+    formatter = logging.Formatter(_LOG_FORMAT)
+    if not any(getattr(h, '_cherry_stderr', False) for h in logger.handlers):
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(formatter)
+        handler._cherry_stderr = True
+        logger.addHandler(handler)
+    if log_file and not any(getattr(h, 'baseFilename', None) == os.path.abspath(log_file)
+                            for h in logger.handlers):
+        os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+        handler = logging.FileHandler(log_file, encoding='utf-8')
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    return logger
+
+
+class Histogram:
+    """累计分桶计数（用于Prometheus）+ 最近样本窗口（用于分位数）"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=1024):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def percentile(self, q: float) -> float:
+        """最近窗口内的分位数（最近邻取整）"""
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'mean_ms': round(self.sum * 1000 / self.count, 3) if self.count else 0.0,
+            'p50_ms': round(self.percentile(50) * 1000, 3),
+            'p95_ms': round(self.percentile(95) * 1000, 3),
+            'p99_ms': round(self.percentile(99) * 1000, 3),
+            'max_ms': round(self.max * 1000, 3),
+        }
+
+
+def _escape(value):
+    """Prometheus文本格式的标签值转义：反斜杠、双引号和换行"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Telemetry:
+    """进程内指标注册表；span在trace内按请求记录，trace结束后保留最近若干条供诊断"""
+
+    def __init__(self, trace_history=50):
+        self.enabled = os.environ.get("CHERRY_TELEMETRY", "1") != "0"
+        self.started = time.time()
+        self._counters = {}  # (名称, 标签) -> 值
+        self._histograms = {}  # (名称, 标签) -> Histogram
+        self._traces = deque(maxlen=trace_history)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _recording(self) -> bool:
+        return self.enabled and not getattr(self._local, 'muted', False)
+
+    @contextmanager
+    def muted(self):
+        """当前线程内暂停记录（如后台预取），避免后台工作混入请求链路的指标"""
+        previous = getattr(self._local, 'muted', False)
+        self._local.muted = True
+        try:
+            yield
+        finally:
+            self._local.muted = previous
+
+    def incr(self, metric: str, value: float = 1, **labels) -> None:
+        """计数器累加"""
+        if not self._recording():
+            return
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, metric: str, seconds: float, **labels) -> None:
+        """直方图记录一次耗时（秒）"""
+        if not self._recording():
+            return
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def span(self, stage: str, **attributes):
+        """记录一个阶段的耗时；yield的字典可补充属性（如路由方式、结果数）"""
+        if not self._recording():
+            yield {}
+            return
+        trace = getattr(self._local, 'trace', None)
+        record = {'stage': stage, 'attributes': attributes}
+        started = time.perf_counter()
+        if trace is not None:
+            record['offset_ms'] = round((started - trace['_started']) * 1000, 3)
+            record['depth'] = trace['_depth']
+            trace['spans'].append(record)
+            trace['_depth'] += 1
+        try:
+            yield attributes
+        except Exception as e:
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            record['duration_ms'] = round(elapsed * 1000, 3)
+            if trace is not None:
+                trace['_depth'] -= 1
+            self.observe("stage_seconds", elapsed, stage=stage)
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """一次请求的根span；同一线程内的span归入该trace"""
+        if not self._recording() or getattr(self._local, 'trace', None) is not None:
+            yield attributes
+            return
+        trace = {'name': name, 'timestamp': time.time(), 'attributes': attributes, 'spans': [],
+                 '_started': time.perf_counter(), '_depth': 0}
+        self._local.trace = trace
+        status = "ok"
+        try:
+            yield attributes
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            self._local.trace = None
+            elapsed = time.perf_counter() - trace.pop('_started')
+            trace.pop('_depth')
+            trace['duration_ms'] = round(elapsed * 1000, 3)
+            trace['status'] = status
+            self.observe("request_seconds", elapsed, name=name)
+            self.incr("requests", name=name, status=status)
+            with self._lock:
+                self._traces.append(trace)
+
+    def snapshot(self, traces: int = 10) -> dict:
+        """JSON友好的快照：计数器、各直方图的分位数和最近的请求trace"""
+        with self._lock:
+            counters = {_series(name, labels): value for (name, labels), value in sorted(self._counters.items())}
+            histograms = {_series(name, labels): histogram.summary()
+                          for (name, labels), histogram in sorted(self._histograms.items())}
+            recent = list(self._traces)[-traces:] if traces else []
+        return {'uptime_s': round(time.time() - self.started, 1), 'counters': counters,
+                'histograms': histograms, 'recent_traces': recent}
+
+    def prometheus(self, prefix: str = "cherry_") -> str:
+        """Prometheus文本格式（计数器加_total后缀，直方图输出累计桶、_sum、_count）"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = [(key, list(h.buckets), list(h.counts), h.sum, h.count)
+                          for key, h in sorted(self._histograms.items())]
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{prefix}{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{_series(metric, labels)} {value}")
+        for (name, labels), buckets, counts, total, count in histograms:
+            metric = f"{prefix}{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{_series(metric + '_bucket', labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{_series(metric + '_bucket', labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{_series(metric + '_sum', labels)} {total}")
+            lines.append(f"{_series(metric + '_count', labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def dump_prometheus(self, path: str) -> None:
+        """原子写入Prometheus文本（供node_exporter textfile collector等读取）"""
+        text = self.prometheus()
+        atomic_write(path, lambda f: f.write(text))
+
+    def export(self) -> dict:
+        """原始指标数据（可pickle），供其他进程汇总"""
+        with self._lock:
+            return {
+                'started': self.started,
+                'counters': dict(self._counters),
+                'histograms': {key: (h.buckets, list(h.counts), h.count, h.sum, h.max, list(h.recent))
+                               for key, h in self._histograms.items()},
+                'traces': list(self._traces),
+            }
+
+    def merge(self, exported: dict) -> None:
+        """累加另一个进程export()的指标（多进程服务汇总各worker）"""
+        with self._lock:
+            self.started = min(self.started, exported['started'])
+            for key, value in exported['counters'].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, (buckets, counts, count, total, maximum, recent) in exported['histograms'].items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(buckets)
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.count += count
+                histogram.sum += total
+                histogram.max = max(histogram.max, maximum)
+                histogram.recent.extend(recent)
+            traces = sorted(list(self._traces) + exported['traces'], key=lambda trace: trace['timestamp'])
+            self._traces = deque(traces, maxlen=self._traces.maxlen)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._traces.clear()
+
+    def after_fork(self) -> None:
+        """fork出的子进程中调用：锁可能在fork时被其他线程持有，重新创建并清空继承的数据"""
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.started = time.time()
+        self.reset()
+
+
+# 进程级共享实例：各模块直接记录，不需要在构造函数间传递
+telemetry = Telemetry()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试直接从源码树导入cherry_plugin
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from cherry_plugin.retriever.bm25 import BM25Index, tokenize
+from cherry_plugin.retriever.vector_shard import VectorShard
+
+TOPICS = ["机器学习", "数据库", "网络协议", "操作系统", "编译原理", "分布式存储", "图像处理", "自然语言"]
+
+
+def corpus(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    return [f"{TOPICS[i % len(TOPICS)]}文档{i} " + " ".join(rng.choice(TOPICS, 3)) + f" term_{i % 17}"
+            for i in range(n)]
+
+
+def test_tokenize_mixes_words_and_cjk_bigrams():
+    tokens = tokenize("Max_Tokens 机器学习")
+    assert "max_tokens" in tokens and "max" in tokens and "tokens" in tokens
+    assert "机器" in tokens and "学习" in tokens and "机" in tokens
+
+
+def test_incremental_add_matches_single_batch():
+    docs = corpus()
+    batched = BM25Index()
+    for start in range(0, len(docs), 37):
+        batched.add_documents(docs[start:start + 37])
+    whole = BM25Index()
+    whole.add_documents(docs)
+    for query in ["机器学习", "term_3 数据库", "编译原理 图像"]:
+        ids_a, scores_a = batched.search(query, 10)
+        ids_b, scores_b = whole.search(query, 10)
+        assert ids_a.tolist() == ids_b.tolist()
+        np.testing.assert_allclose(scores_a, scores_b, rtol=1e-6)
+
+
+def test_delta_segment_is_compacted_periodically(monkeypatch):
+    docs = corpus()
+    index = BM25Index(min_delta=200, compact_ratio=0.5)
+    compactions = []
+    compact = index.compact
+    monkeypatch.setattr(index, "compact", lambda: (compactions.append(len(index.delta_terms)), compact()))
+    batches = range(0, len(docs), 10)
+    for start in batches:
+        index.add_documents(docs[start:start + 10])
+    assert 0 < len(compactions) < len(batches) / 4
+    assert len(index.delta_terms) > 0
+
+    whole = BM25Index()
+    whole.add_documents(docs)
+    whole.compact()
+    for query in ["机器学习", "term_3 数据库"]:
+        ids, scores = index.search(query, 10)
+        assert ids.tolist() == whole.search(query, 10)[0].tolist()
+        np.testing.assert_allclose(scores, whole.search(query, 10)[1], rtol=1e-6)
+
+
+def test_search_does_not_modify_index():
+    index = BM25Index()
+    index.add_documents(corpus(50))
+    arrays = (index.offsets, index.doc_ids, index.tfs, index.doc_lengths)
+    index.search("数据库", 5)
+    assert all(a is b for a, b in zip(arrays, (index.offsets, index.doc_ids, index.tfs, index.doc_lengths)))
+
+
+def test_mask_filters_documents():
+    index = BM25Index()
+    index.add_documents(corpus(40))
+    mask = np.zeros(40, dtype=bool)
+    mask[::2] = True
+    ids, _ = index.search("机器学习", 40, mask)
+    assert len(ids) and all(i % 2 == 0 for i in ids)
+
+
+def test_save_load_roundtrip(tmp_path):
+    index = BM25Index()
+    index.add_documents(corpus(60))
+    index.add_documents(corpus(20, seed=1))
+    path = str(tmp_path / "bm25.npz")
+    index.save(path)
+    assert len(index.delta_terms) > 0  # 保存时合并写出，内存中的增量段不变
+    loaded = BM25Index.load(path)
+    assert len(loaded.delta_terms) == 0
+    for query in ["操作系统", "term_5"]:
+        assert loaded.search(query, 8)[0].tolist() == index.search(query, 8)[0].tolist()
+
+
+def test_concurrent_shard_search_after_add():
+    """分片在读锁下并行检索：新增文档后的并发检索结果须与全新索引一致且不破坏索引"""
+    docs = corpus()
+    rng = np.random.default_rng(1)
+    embeddings = rng.normal(size=(len(docs), 8)).astype('float32')
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    shard = VectorShard("s0", dimension=8)
+    for start in range(0, len(docs), 50):
+        shard.add(docs[start:start + 50], embeddings[start:start + 50])
+    fresh = BM25Index()
+    fresh.add_documents(docs)
+
+    queries = ["机器学习 term_3", "数据库 网络协议", "分布式存储", "自然语言 图像处理"] * 25
+    expected = {query: fresh.search(query, 10)[0].tolist() for query in set(queries)}
+
+    def sparse_top(query):
+        results = shard.search(embeddings[0], query, 10)
+        ranked = sorted((r for r in results if r['sparse_score'] > 0), key=lambda r: (-r['sparse_score'], r['id']))
+        return query, [r['id'] for r in ranked]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for query, ids in executor.map(sparse_top, queries):
+            assert set(expected[query]) <= set(ids)
+    for query in set(queries):
+        assert shard.bm25.search(query, 10)[0].tolist() == expected[query]
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from cherry_plugin.diagnostics import TracemallocRecorder
+
+
+@pytest.fixture
+def recorder(tmp_path):
+    recorder = TracemallocRecorder(str(tmp_path / "tracemalloc"))
+    recorder.start()
+    yield recorder
+    recorder.stop()
+
+
+def test_snapshot_and_diff_by_name(recorder):
+    recorder.snapshot("before")
+    data = [bytes(1000) for _ in range(100)]
+    recorder.snapshot("after-1")
+    result = recorder.diff("before", "after-1", top=5)
+    assert result['top'] and data
+
+
+@pytest.mark.parametrize("name", ["../escape", "a/b", "/tmp/x", "x.y"])
+def test_snapshot_rejects_unsafe_names(recorder, tmp_path, name):
+    with pytest.raises(ValueError):
+        recorder.snapshot(name)
+    assert not os.path.exists(tmp_path / "escape.tracemalloc")
+
+
+def test_diff_only_loads_registered_snapshots(recorder, tmp_path):
+    recorder.snapshot("known")
+    outside = tmp_path / "outside.tracemalloc"
+    outside.write_bytes(b"not a snapshot")
+    with pytest.raises(ValueError):
+        recorder.diff("known", str(outside))
+    with pytest.raises(ValueError):
+        recorder.diff(str(outside), "known")
@@ -0,0 +1,71 @@
+import hashlib
+
+import numpy as np
+
+from cherry_plugin.retriever.embedding_store import EmbeddingStore
+from cherry_plugin.retriever.entity_linker import EntityLinker
+
+DIMENSION = 16
+
+
+class CountingEncoder:
+    """按文本哈希生成确定性向量，并记录编码过的文本"""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        vectors = np.stack([np.random.default_rng(int(hashlib.md5(t.encode()).hexdigest()[:8], 16))
+                            .normal(size=DIMENSION) for t in texts]).astype('float32')
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+NODES = [{"id": "张三", "label": "Person", "properties": {"职位": "工程师", "别名": "小张"}},
+         {"id": "李四", "label": "Person", "properties": {"职位": "经理"}}]
+
+
+def make_linker(tmp_path, encoder):
+    store = EmbeddingStore(str(tmp_path / "entity_embeddings"), "fake", DIMENSION)
+    return EntityLinker(encoder, DIMENSION, min_score=0.5, store=store)
+
+
+def test_restart_reuses_stored_vectors(tmp_path):
+    first = CountingEncoder()
+    make_linker(tmp_path, first).add_nodes(NODES)
+    assert first.encoded
+
+    second = CountingEncoder()
+    linker = make_linker(tmp_path, second)
+    linker.add_nodes(NODES)
+    assert second.encoded == []
+    assert linker.link(second.encode(["小张"])[0])[0][0] == "张三"
+
+
+def test_only_changed_nodes_are_encoded(tmp_path):
+    make_linker(tmp_path, CountingEncoder()).add_nodes(NODES)
+    encoder = CountingEncoder()
+    changed = [NODES[0], {"id": "李四", "label": "Person", "properties": {"职位": "总监"}}]
+    make_linker(tmp_path, encoder).add_nodes(changed)
+    assert encoder.encoded == ["李四 总监"]
+
+
+def test_linker_without_store_encodes_directly(tmp_path):
+    encoder = CountingEncoder()
+    linker = EntityLinker(encoder, DIMENSION, min_score=0.5)
+    linker.add_nodes(NODES)
+    assert len(linker) == 2 and encoder.encoded
+
+
+def test_reset_switches_store_and_reencodes(tmp_path):
+    linker = make_linker(tmp_path, CountingEncoder())
+    linker.add_nodes(NODES)
+    other = EmbeddingStore(str(tmp_path / "other_model"), "other", DIMENSION)
+    linker.reset(DIMENSION, other)
+    assert len(linker) == 0 and linker.link(CountingEncoder().encode(["小张"])[0]) == []
+
+    encoder = CountingEncoder()
+    linker.encoder = encoder
+    linker.add_nodes(NODES)
+    # 新模型的存储中没有向量，全部重新编码
+    assert len(linker) == 2 and "小张" in encoder.encoded
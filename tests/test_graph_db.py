@@ -0,0 +1,69 @@
+import multiprocessing
+
+import pytest
+
+from cherry_plugin.retriever.graph_db import GraphDB
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "graph_data.json")
+
+
+def test_writers_merge_instead_of_overwriting(path):
+    first, second = GraphDB(path), GraphDB(path)
+    first.add_node("张三", "Person")
+    second.add_node("李四", "Person")
+    first.add_relationship("张三", "李四", "合作")
+    second.add_relationship("李四", "张三", "汇报")
+
+    reloaded = GraphDB(path)
+    assert {node["id"] for node in reloaded.nodes()} == {"张三", "李四"}
+    assert sorted(rel["type"] for rel in reloaded.graph_data["relationships"]) == ["合作", "汇报"]
+    # 写入时合并进来的其他进程的变更也进入内存和邻接索引
+    assert {r["relationship"] for r in second.relationships_from(["张三"], limit=10)} == {"合作", "汇报"}
+
+
+def test_merged_changes_notify_listeners(path):
+    first, second = GraphDB(path), GraphDB(path)
+    seen = []
+    second.add_listener(lambda kind, item, graph_db: seen.append((kind, item.get("id") or item["type"])))
+    first.add_node("王五", "Person")
+    second.add_node("赵六", "Person")
+    assert seen == [("node", "王五"), ("node", "赵六")]
+
+
+def test_duplicate_entries_are_kept(path):
+    graph = GraphDB(path)
+    graph.add_relationship("a", "b", "合作")
+    graph.add_relationship("a", "b", "合作")
+    graph.save_data()
+    assert len(GraphDB(path).graph_data["relationships"]) == 2
+
+
+def _add_relationships(path, prefix, count):
+    graph = GraphDB(path)
+    for i in range(count):
+        graph.add_relationship(f"{prefix}{i}", f"{prefix}{i + 1}", "合作")
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="需要fork")
+def test_concurrent_processes_keep_all_writes(path):
+    GraphDB(path).save_data()
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_add_relationships, args=(path, prefix, 25)) for prefix in "abc"]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+    assert len(GraphDB(path).graph_data["relationships"]) == 75
+
+
+def test_memory_stats(path):
+    graph_db = GraphDB(path)
+    graph_db.add_node("张三", "Person")
+    graph_db.add_node("李四", "Person")
+    graph_db.add_relationship("张三", "李四", "合作")
+    stats = graph_db.memory_stats()
+    assert (stats['nodes'], stats['relationships']) == (2, 1)
+    assert stats['graph_data_bytes'] > 0 and stats['indexes_bytes'] > 0
@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+
+from cherry_plugin.memory.memory_index import MemoryIndex
+
+DIMENSION = 8
+
+
+def vectors(count, seed=0):
+    data = np.random.default_rng(seed).normal(size=(count, DIMENSION)).astype('float32')
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+def index_files(path):
+    return [name for name in os.listdir(path) if name.endswith(".index")]
+
+
+def test_saves_are_throttled(tmp_path):
+    index = MemoryIndex(str(tmp_path), DIMENSION, save_interval=3600)
+    index.add("s", [1, 2], vectors(2))
+    index.maybe_save()
+    assert index_files(tmp_path) == []
+    assert index.search("s", vectors(1)[0], 1)
+
+    index.save_interval = 0
+    index.maybe_save()
+    assert len(index_files(tmp_path)) == 1
+
+
+def test_evicted_sessions_are_written(tmp_path):
+    index = MemoryIndex(str(tmp_path), DIMENSION, max_loaded_sessions=1, save_interval=3600)
+    index.add("a", [1], vectors(1))
+    index.add("b", [2], vectors(1, seed=1))
+    assert len(index_files(tmp_path)) == 1
+
+    reloaded = MemoryIndex(str(tmp_path), DIMENSION)
+    assert reloaded.max_indexed_id("a") == 1
+
+
+def test_remove_session_deletes_file(tmp_path):
+    index = MemoryIndex(str(tmp_path), DIMENSION)
+    index.add("s", [1], vectors(1))
+    index.save()
+    index.remove_session("s")
+    assert index_files(tmp_path) == []
+    assert index.max_indexed_id("s") == 0
+
+
+def test_memory_stats_counts_dirty_sessions(tmp_path):
+    index = MemoryIndex(str(tmp_path), DIMENSION, save_interval=3600)
+    index.add("s", [1, 2], vectors(2))
+    assert index.memory_stats() == {'sessions_loaded': 1, 'sessions_dirty': 1, 'bytes': 2 * DIMENSION * 4}
+    index.save()
+    assert index.memory_stats()['sessions_dirty'] == 0
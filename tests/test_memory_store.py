@@ -0,0 +1,52 @@
+import pytest
+
+from cherry_plugin.memory.memory_store import MemoryStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MemoryStore(data_dir=str(tmp_path), background=False)
+    yield store
+    store.close()
+
+
+def test_summary_due_counts_only_own_session(store, monkeypatch):
+    calls = {}
+    original = store.update_long_term_summary
+
+    def counting(session_id=None):
+        calls[session_id] = calls.get(session_id, 0) + 1
+        original(session_id)
+
+    monkeypatch.setattr(store, "update_long_term_summary", counting)
+    sessions = [f"s{i}" for i in range(12)]
+    for turn in range(store.max_short_term):
+        for session in sessions:
+            store.add_conversation(f"问题{turn} 机器学习", f"回答{turn}", session)
+
+    # 会话交错写入时，每个会话恰好在积累满max_short_term轮后摘要一次
+    assert calls == {session: 1 for session in sessions}
+    assert not store._summary_due("s0")
+    assert store._load_checkpoint("s0")[0] == store.get_recent_turns(1, "s0")[0]["id"]
+
+
+def test_summary_not_due_before_threshold(store):
+    for turn in range(store.max_short_term - 1):
+        store.add_conversation(f"问题{turn}", "回答", "a")
+        store.add_conversation(f"问题{turn}", "回答", "b")
+    assert not store._summary_due("a")
+    assert store.get_long_term_summary("a") == "暂无历史对话摘要"
+
+
+def test_extract_topics_uses_words_and_bigrams(store):
+    topics = store._extract_topics("我想了解一下机器学习模型的训练方法和部署流程，用PyTorch")
+    assert {"机器", "学习", "模型", "训练", "方法", "部署", "流程", "pytorch"} <= set(topics)
+    assert all(len(topic) == 2 for topic in topics if topic != "pytorch")
+    assert "了解" not in topics and "一下" not in topics
+
+
+def test_summary_lists_repeated_topics(store):
+    for turn in range(store.max_short_term):
+        store.add_conversation(f"机器学习的第{turn}个问题", "回答", "a")
+    summary = store.get_long_term_summary("a")
+    assert summary.startswith("最近讨论的主要话题") and "机器" in summary and "学习" in summary
@@ -0,0 +1,39 @@
+import numpy as np
+
+from cherry_plugin.optimization.minhash import MinHashLSH, shingles
+
+BASE = "向量数据库使用FAISS进行近似最近邻检索，支持分片与混合检索"
+
+
+def test_shingles_normalize_whitespace_and_case():
+    assert shingles("AB  c", 3) == {"ab ", "b c"}
+    assert shingles("ab", 3) == {"ab"}
+    assert shingles("   ", 3) == set()
+
+
+def test_signature_similarity_tracks_jaccard():
+    lsh = MinHashLSH(num_perm=128, bands=32)
+    texts = [BASE, BASE + "。", "今天天气很好，适合出去散步和骑自行车"]
+    signatures = lsh.signatures(texts)
+    assert (signatures[0] == signatures[1]).mean() > 0.8
+    assert (signatures[0] == signatures[2]).mean() < 0.2
+
+
+def test_duplicate_mask_keeps_first_occurrence():
+    lsh = MinHashLSH()
+    texts = [BASE, "完全无关的一段关于烹饪和菜谱的文字内容", BASE + "！", BASE]
+    assert lsh.duplicate_mask(texts, 0.7).tolist() == [True, True, False, False]
+
+
+def test_distinct_texts_are_all_kept():
+    lsh = MinHashLSH()
+    rng = np.random.default_rng(0)
+    texts = ["".join(chr(c) for c in rng.integers(0x4e00, 0x4e00 + 3000, 40)) for _ in range(300)]
+    mask = lsh.duplicate_mask(texts, 0.9)
+    assert mask.all()
+
+
+def test_candidate_pairs_are_ordered():
+    lsh = MinHashLSH()
+    pairs = lsh.candidate_pairs(lsh.signatures([BASE, BASE, BASE]))
+    assert pairs and all(i < j for i, j in pairs)
@@ -0,0 +1,137 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from cherry_plugin.persistence import FileLock, RWLock, atomic_write, atomic_write_json, write_locked
+
+
+def test_atomic_write_keeps_old_file_on_failure(tmp_path):
+    path = str(tmp_path / "data.json")
+    atomic_write_json(path, {"version": 1})
+
+    def failing(f):
+        f.write("{\"version\": ")
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        atomic_write(path, failing)
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f) == {"version": 1}
+    assert os.listdir(tmp_path) == ["data.json"]
+
+
+def test_rwlock_readers_share_writer_excludes():
+    lock = RWLock()
+    events = []
+    with lock.read_lock():
+        with lock.read_lock():
+            events.append("nested read")
+
+    entered = threading.Event()
+
+    def writer():
+        with lock.write_lock():
+            events.append("write")
+            entered.set()
+
+    with lock.read_lock():
+        thread = threading.Thread(target=writer)
+        thread.start()
+        time.sleep(0.05)
+        assert not entered.is_set()
+        events.append("read done")
+    thread.join(1)
+    assert events == ["nested read", "read done", "write"]
+
+
+def test_rwlock_waiting_writer_blocks_new_readers():
+    lock = RWLock()
+    order = []
+
+    def writer():
+        with lock.write_lock():
+            order.append("write")
+
+    def reader():
+        with lock.read_lock():
+            order.append("read")
+
+    with lock.read_lock():
+        writer_thread = threading.Thread(target=writer)
+        writer_thread.start()
+        time.sleep(0.05)
+        reader_thread = threading.Thread(target=reader)
+        reader_thread.start()
+        time.sleep(0.05)
+        assert order == []
+    writer_thread.join(1)
+    reader_thread.join(1)
+    assert order == ["write", "read"]
+
+
+def _increment(path, count):
+    for _ in range(count):
+        with FileLock(path):
+            with open(path, encoding='utf-8') as f:
+                value = int(f.read())
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(str(value + 1))
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="需要fork")
+def test_file_lock_serializes_processes(tmp_path):
+    path = str(tmp_path / "counter")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("0")
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_increment, args=(path, 200)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+    with open(path, encoding='utf-8') as f:
+        assert int(f.read()) == 800
+
+
+def test_write_locked_nests_across_paths(tmp_path):
+    with write_locked(str(tmp_path / "a")), write_locked(str(tmp_path / "b")):
+        pass
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="需要fork")
+def test_path_locks_are_reset_in_forked_child(tmp_path):
+    """fork时其他线程持有的路径锁不会带进子进程"""
+    path = str(tmp_path / "data.json")
+    held, release = threading.Event(), threading.Event()
+
+    def holder():
+        with write_locked(path):
+            held.set()
+            release.wait(10)
+
+    thread = threading.Thread(target=holder)
+    thread.start()
+    held.wait(5)
+    try:
+        process = multiprocessing.get_context("fork").Process(target=_write_in_child, args=(path,), daemon=True)
+        process.start()
+        time.sleep(0.2)
+        release.set()  # 释放父进程的文件锁，子进程随后才能拿到跨进程锁
+        process.join(10)
+        if process.is_alive():
+            process.terminate()
+        assert process.exitcode == 0
+    finally:
+        release.set()
+        thread.join()
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f) == {"child": True}
+
+
+def _write_in_child(path):
+    with write_locked(path):
+        atomic_write_json(path, {"child": True})
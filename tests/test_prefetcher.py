@@ -0,0 +1,52 @@
+import time
+
+import numpy as np
+import pytest
+
+from cherry_plugin.prefetcher import Prefetcher
+
+
+class Analysis:
+    """只实现Prefetcher用到的values()"""
+
+    def __init__(self, nodes=()):
+        self.nodes = set(nodes)
+
+    def values(self, kind):
+        return set(self.nodes) if kind == "node" else set()
+
+
+def unit(vector):
+    vector = np.asarray(vector, dtype='float32')
+    return vector / np.linalg.norm(vector)
+
+
+@pytest.fixture
+def prefetcher():
+    prefetcher = Prefetcher(plugin=None, enabled=True)
+    prefetcher._entries[("s1", "A和谁有关系")] = {
+        'query': "A和谁有关系", 'embedding': unit([1, 0, 0]), 'entities': frozenset({"A"}),
+        'route': "graph", 'scores': {}, 'retrieved': [], 'created': time.monotonic(), 'hits': 0}
+    return prefetcher
+
+
+def test_lookup_hits_same_entities(prefetcher):
+    assert prefetcher.lookup("s1", unit([1, 0.05, 0]), Analysis({"A"}))[0] == "graph"
+    assert prefetcher.get_stats()['hits'] == 1
+
+
+def test_lookup_requires_identical_entity_set(prefetcher):
+    assert prefetcher.lookup("s1", unit([1, 0.05, 0]), Analysis({"B"})) is None
+    assert prefetcher.lookup("s1", unit([1, 0.05, 0]), Analysis({"A", "B"})) is None
+    # 问题没有提到任何实体时也不复用针对具体实体的预取
+    assert prefetcher.lookup("s1", unit([1, 0.05, 0]), Analysis()) is None
+
+
+def test_lookup_scoped_to_session_and_similarity(prefetcher):
+    assert prefetcher.lookup("s2", unit([1, 0, 0]), Analysis({"A"})) is None
+    assert prefetcher.lookup("s1", unit([0, 1, 0]), Analysis({"A"})) is None
+
+
+def test_disabled_prefetcher_never_hits(prefetcher):
+    prefetcher.enabled = False
+    assert prefetcher.lookup("s1", unit([1, 0, 0]), Analysis({"A"})) is None
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+
+import pytest
+
+from cherry_plugin import prefork
+from cherry_plugin.prefork import PreforkPool
+
+pytestmark = pytest.mark.skipif(not prefork.fork_supported(), reason="需要fork")
+
+
+class Listeners:
+    def __init__(self):
+        self.listeners = []
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+
+class FakeMemory:
+    def flush(self, timeout=None):
+        pass
+
+
+class FakePlugin:
+    """只实现worker池用到的接口：写操作通过图数据监听器产生变更，读操作报告所在进程"""
+
+    def __init__(self):
+        self.sql_db = Listeners()
+        self.graph_db = Listeners()
+        self.memory = FakeMemory()
+        self.relationships = []
+
+    def warm_up(self):
+        pass
+
+    def after_fork(self, threads=None):
+        pass
+
+    def process_question(self, question, session_id=None):
+        if question == "crash":
+            os._exit(1)
+        return {'pid': os.getpid(), 'relationships': list(self.relationships)}
+
+    def add_relationship(self, from_id, to_id, relation_type, properties=None):
+        item = {'from': from_id, 'to': to_id, 'type': relation_type}
+        self.relationships.append(item)
+        for callback in self.graph_db.listeners:
+            callback("relationship", item, self.graph_db)
+
+    def apply_changes(self, changes):
+        self.relationships.extend(item for kind, item in changes if kind == "relationship")
+
+
+@pytest.fixture
+def pool():
+    pool = PreforkPool(FakePlugin(), workers=3).start()
+    yield pool
+    pool.close()
+
+
+def test_session_affinity(pool):
+    pids = {pool.process_question("q", session_id="s1")['pid'] for _ in range(10)}
+    assert len(pids) == 1 and pids != {os.getpid()}
+
+
+def test_write_is_broadcast_to_every_worker(pool):
+    pool.write("add_relationship", "a", "b", "合作")
+    for worker in pool.workers:
+        result = worker.send(999, "process_question", ("q",), {}).result(10)
+        assert result['relationships'] == [{'from': 'a', 'to': 'b', 'type': '合作'}]
+
+
+def test_crashed_worker_is_respawned(pool, monkeypatch):
+    threads = []
+    spawn = pool._spawn
+    monkeypatch.setattr(pool, "_spawn", lambda index: (threads.append(threading.current_thread().name),
+                                                         spawn(index))[1])
+    with pytest.raises(RuntimeError):
+        pool.process_question("crash", session_id="s2")
+    deadline = time.monotonic() + 10
+    while pool.restarts == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert pool.restarts == 1
+    assert threads == ["cherry-prefork-supervisor"]
+    assert pool.process_question("q", session_id="s2")['pid'] != os.getpid()
+
+
+def test_unknown_method_is_rejected(pool):
+    with pytest.raises(ValueError):
+        pool.submit("drop_everything")
@@ -0,0 +1,87 @@
+import random
+
+import pytest
+
+from cherry_plugin.retriever.graph_db import GraphDB
+from cherry_plugin.routing.query_analyzer import AhoCorasick, QueryAnalyzer
+
+
+def brute_force(terms, text):
+    return sorted((start, start + len(term), term) for term in terms
+                  for start in range(len(text)) if text.startswith(term, start))
+
+
+def test_aho_corasick_finds_all_overlapping_matches():
+    automaton = AhoCorasick()
+    terms = ["he", "she", "his", "hers", "机器", "机器学习", "学习"]
+    for term in terms:
+        automaton.add(term)
+    text = "ushers 学习机器学习"
+    assert sorted(automaton.find(text)) == brute_force(terms, text)
+
+
+def test_aho_corasick_incremental_insert_after_find():
+    automaton = AhoCorasick()
+    automaton.add("abc")
+    assert automaton.find("xabcabd") == [(1, 4, "abc")]
+    automaton.add("bd")
+    automaton.add("ab")
+    assert sorted(automaton.find("xabcabd")) == brute_force(["abc", "bd", "ab"], "xabcabd")
+
+
+def test_aho_corasick_empty():
+    assert AhoCorasick().find("anything") == []
+
+
+@pytest.fixture
+def graph(tmp_path):
+    graph = GraphDB(str(tmp_path / "graph_data.json"))
+    graph.add_node("张三", "Person", {"职位": "工程师"})
+    graph.add_node("张三丰", "Person", {})
+    graph.add_relationship("张三", "张三丰", "合作", {"项目": "api"})
+    return graph
+
+
+def test_analyzer_keeps_longest_non_overlapping_matches(graph):
+    analysis = QueryAnalyzer(graph_db=graph).analyze("张三丰和谁合作")
+    assert analysis.values("node") == {"张三丰"}
+    assert analysis.values("relationship") == {"合作"}
+    assert analysis.suggested_route() == "graph"
+
+
+def test_analyzer_ascii_terms_need_word_boundaries(graph):
+    analyzer = QueryAnalyzer(graph_db=graph)
+    assert analyzer.analyze("rapid 开发").values("property") == set()
+    assert analyzer.analyze("调用api的人").values("property") == {"api"}
+
+
+def test_analyzer_follows_graph_changes(graph):
+    analyzer = QueryAnalyzer(graph_db=graph)
+    assert not analyzer.analyze("李四是谁")
+    graph.add_node("李四", "Person", {})
+    assert analyzer.analyze("李四是谁").values("node") == {"李四"}
+
+
+def test_aho_corasick_interleaved_inserts_match_brute_force():
+    rng = random.Random(7)
+    alphabet = "abc机器学"
+    automaton, terms = AhoCorasick(), []
+    for _ in range(300):
+        term = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 5)))
+        automaton.add(term)
+        terms.append(term)
+        text = "".join(rng.choice(alphabet) for _ in range(30))
+        assert sorted(automaton.find(text)) == brute_force(set(terms), text)
+
+
+def test_aho_corasick_bulk_build_then_incremental():
+    rng = random.Random(11)
+    alphabet = "abc机器学"
+    terms = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 5))) for _ in range(100)]
+    automaton = AhoCorasick(terms)
+    for _ in range(100):
+        term = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 5)))
+        automaton.add(term)
+        terms.append(term)
+        text = "".join(rng.choice(alphabet) for _ in range(30))
+        assert sorted(automaton.find(text)) == brute_force(set(terms), text)
@@ -0,0 +1,88 @@
+import pytest
+
+from cherry_plugin.retriever.reranker import Reranker, VectorReranker
+
+
+def fuse(results, fusion, dense_weight=0.6, rrf_k=60):
+    """与VectorDB._fuse_hybrid相同的融合公式"""
+    if fusion == "rrf":
+        dense_order = sorted(results, key=lambda r: r['dense_score'], reverse=True)
+        sparse_order = sorted((r for r in results if r['sparse_score'] > 0),
+                              key=lambda r: r['sparse_score'], reverse=True)
+        for r in results:
+            r['score'] = 0.0
+        for rank, r in enumerate(dense_order):
+            r['score'] += dense_weight / (rrf_k + rank + 1)
+        for rank, r in enumerate(sparse_order):
+            r['score'] += (1 - dense_weight) / (rrf_k + rank + 1)
+    else:
+        max_sparse = max(r['sparse_score'] for r in results)
+        for r in results:
+            r['score'] = dense_weight * r['dense_score'] + (1 - dense_weight) * r['sparse_score'] / max_sparse
+    return results
+
+
+def candidates(dense, sparse):
+    return [{'id': i, 'document': f"doc{i}", 'dense_score': d, 'sparse_score': s}
+            for i, (d, s) in enumerate(zip(dense, sparse))]
+
+
+@pytest.fixture
+def reranker():
+    return VectorReranker(skip_margin=0.15, shorten_margin=0.2)
+
+
+@pytest.mark.parametrize("fusion", ["rrf", "weighted"])
+def test_skips_when_dense_margin_is_large(reranker, fusion):
+    results = fuse(candidates([0.9, 0.85, 0.8, 0.4, 0.35, 0.3], [1.0, 3.0, 0.5, 8.0, 0.2, 0.1]), fusion)
+    assert reranker._plan(results, 3) == []
+
+
+@pytest.mark.parametrize("fusion", ["rrf", "weighted"])
+def test_shortens_to_dense_window(reranker, fusion):
+    dense = [0.9, 0.8, 0.75, 0.7, 0.62, 0.3, 0.2, 0.1]
+    results = fuse(candidates(dense, [1.0] * len(dense)), fusion)
+    planned = reranker._plan(results, 3)
+    # 第3名稠密分数0.75：窗口为[0.55, 1]，差距0.05小于skip_margin
+    assert sorted(r['id'] for r in planned) == [0, 1, 2, 3, 4]
+
+
+def test_dense_only_results_use_score(reranker):
+    results = [{'document': f"doc{i}", 'score': s} for i, s in enumerate([0.9, 0.88, 0.5, 0.45])]
+    assert reranker._plan(results, 2) == []
+    results[2]['score'] = 0.87
+    assert [r["document"] for r in reranker._plan(results, 2)] == ["doc0", "doc1", "doc2"]
+
+
+def test_no_plan_when_results_fit_top_k(reranker):
+    assert reranker._plan(candidates([0.9, 0.1], [0, 0]), 3) == []
+
+
+def test_skip_returns_fused_order(reranker):
+    results = fuse(candidates([0.9, 0.85, 0.8, 0.4, 0.35], [0.1, 0.1, 5.0, 0.1, 0.1]), "weighted")
+    ranked = reranker.rerank_vector_results("q", results, 3)
+    assert [r['id'] for r in ranked] == sorted(range(3), key=lambda i: -results[i]['score'])
+
+
+class FakeCrossEncoder:
+    def __init__(self):
+        self.pairs = []
+
+    def compute_score(self, pairs):
+        self.pairs.extend(pairs)
+        return [float(len(doc)) for _, doc in pairs]
+
+
+def test_bge_scores_are_cached_with_lru_eviction():
+    reranker = Reranker("cosine", cache_size=3)
+    reranker.method, reranker.rerank_model = "bge", FakeCrossEncoder()
+    ranked = reranker.rerank("q", ["a", "bbb", "cc"], top_k=2)
+    assert ranked == [("bbb", 3.0), ("cc", 2.0)]
+    reranker.rerank("q", ["a", "bbb"], top_k=2)
+    assert len(reranker.rerank_model.pairs) == 3
+    assert reranker.stats['pairs_cached'] == 2
+
+    reranker.rerank("q", ["dddd"], top_k=1)  # 淘汰最久未用的 "cc"
+    reranker.rerank("q", ["cc", "bbb"], top_k=2)
+    assert [doc for _, doc in reranker.rerank_model.pairs] == ["a", "bbb", "cc", "dddd", "cc"]
+    assert len(reranker._score_cache) == 3
@@ -0,0 +1,22 @@
+from cherry_plugin.telemetry import Telemetry
+
+
+def test_prometheus_escapes_label_values():
+    telemetry = Telemetry()
+    telemetry.incr("tool_calls", tool='a"b\\c\nd')
+    telemetry.observe("stage_seconds", 0.01, stage='x"y')
+    text = telemetry.prometheus()
+    assert 'cherry_tool_calls_total{tool="a\\"b\\\\c\\nd"} 1' in text
+    assert 'stage="x\\"y"' in text
+    # 每个样本只占一行
+    assert all(line.startswith(("#", "cherry_")) for line in text.splitlines() if line)
+
+
+def test_merge_adds_exported_counters():
+    first, second = Telemetry(), Telemetry()
+    first.incr("requests", route="vdb")
+    second.incr("requests", 2, route="vdb")
+    merged = Telemetry()
+    merged.merge(first.export())
+    merged.merge(second.export())
+    assert merged.snapshot(0)['counters'] == {'requests{route="vdb"}': 3}
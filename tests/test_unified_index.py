@@ -0,0 +1,55 @@
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from cherry_plugin.retriever.unified_index import UnifiedIndex
+
+DIMENSION = 8
+
+
+class HashModel:
+    def encode(self, texts):
+        return np.stack([np.random.default_rng(int(hashlib.md5(t.encode()).hexdigest()[:8], 16))
+                         .normal(size=DIMENSION) for t in texts]).astype('float32')
+
+
+def config(key, value):
+    return {'key': key, 'value': value, 'description': "", 'category': "general"}
+
+
+def make_index(tmp_path, save_delay):
+    return UnifiedIndex(HashModel(), DIMENSION, str(tmp_path / "unified_index"), save_delay=save_delay)
+
+
+def test_changes_are_saved_once_after_delay(tmp_path, monkeypatch):
+    index = make_index(tmp_path, save_delay=0.2)
+    saves = []
+    save = index.save
+    monkeypatch.setattr(index, "save", lambda: (saves.append(1), save()))
+    for i in range(5):
+        index.on_sql_change("config", config(f"key{i}", i))
+    assert saves == []
+    time.sleep(0.5)
+    assert saves == [1]
+
+    reloaded = make_index(tmp_path, save_delay=0.2)
+    assert reloaded.load() and len(reloaded) == 5
+
+
+def test_flush_saves_pending_changes(tmp_path):
+    index = make_index(tmp_path, save_delay=3600)
+    index.on_sql_change("config", config("timeout", 30))
+    index.flush()
+    assert os.path.exists(tmp_path / "unified_index.entries.json")
+
+
+def test_forked_worker_does_not_save(tmp_path):
+    index = make_index(tmp_path, save_delay=0)
+    index.after_fork()
+    index.on_sql_change("config", config("timeout", 30))
+    index.flush()
+    time.sleep(0.1)
+    assert len(index) == 1
+    assert not os.path.exists(tmp_path / "unified_index.entries.json")
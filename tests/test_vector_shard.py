@@ -0,0 +1,39 @@
+import numpy as np
+
+from cherry_plugin.retriever.vector_shard import VectorShard
+
+DIMENSION = 8
+
+
+def embeddings(count, seed=0):
+    data = np.random.default_rng(seed).normal(size=(count, DIMENSION)).astype('float32')
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+def test_unchanged_shard_is_not_rewritten(tmp_path):
+    prefix = str(tmp_path / "shard_000")
+    shard = VectorShard("shard_000", DIMENSION)
+    shard.add(["机器学习入门", "数据库索引"], embeddings(2))
+    assert shard.save(prefix)
+    assert not shard.save(prefix)
+
+    shard.add(["网络协议"], embeddings(1, seed=1))
+    assert shard.save(prefix)
+
+    loaded = VectorShard.load("shard_000", prefix, DIMENSION)
+    assert len(loaded) == 3
+    assert not loaded.save(prefix)
+    # 保存到新位置（如新一代分片目录）时总是写入
+    assert loaded.save(str(tmp_path / "g1" / "shard_000"))
+
+
+def test_shard_with_rebuilt_bm25_is_saved_again(tmp_path):
+    prefix = str(tmp_path / "shard_000")
+    shard = VectorShard("shard_000", DIMENSION)
+    shard.add(["机器学习入门", "数据库索引"], embeddings(2))
+    shard.save(prefix)
+    (tmp_path / "shard_000.bm25.npz").unlink()
+
+    loaded = VectorShard.load("shard_000", prefix, DIMENSION)
+    assert loaded.save(prefix)
+    assert (tmp_path / "shard_000.bm25.npz").exists()